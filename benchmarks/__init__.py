@@ -0,0 +1,10 @@
+"""
+Performance benchmarks for the bookstore app.
+
+Each benchmark is a module that can be run with `python -m`, e.g.
+
+    python -m benchmarks.views --books 100000 --categories 200
+
+and writes its results as JSON so that runs on different commits can be
+compared with `python -m benchmarks.compare`.
+"""
@@ -0,0 +1,139 @@
+"""
+Helpers shared by the benchmarks: Django setup, a throwaway database seeded
+with a synthetic catalogue, timing statistics and JSON output.
+"""
+import contextlib
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_django(settings_module='inventory.settings'):
+    """
+    Configures Django the way manage.py does.
+    """
+    if BASE_DIR not in sys.path:
+        sys.path.insert(0, BASE_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+
+
+@contextlib.contextmanager
+def benchmark_database(verbosity=0):
+    """
+    Creates (and finally destroys) a test database, so that benchmarks never
+    touch the development database.
+    """
+    from django.db import connection
+    from django.test.utils import override_settings
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=verbosity, keepdb=False)
+    try:
+        # the test client's host and no query logging overhead
+        with override_settings(DEBUG=False, ALLOWED_HOSTS=['testserver']):
+            yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+
+
+def seed_catalogue(books, categories, batch_size=10000, stdout=None):
+    """
+    Fills the database with `categories` categories and `books` books spread
+    evenly over them, using bulk inserts, and returns the category ids.
+    """
+    from django.db import transaction
+
+    from bookstore import cache, counters, models
+
+    with transaction.atomic():
+        models.Category.objects.bulk_create(
+            models.Category(name='Category {0}'.format(i))
+            for i in range(categories)
+        )
+    category_ids = list(
+        models.Category.objects.order_by('id').values_list('id', flat=True))
+
+    for start in range(0, books, batch_size):
+        with transaction.atomic():
+            models.Book.objects.bulk_create([
+                models.Book(
+                    title='Book {0}'.format(i),
+                    category_id=category_ids[i % len(category_ids)])
+                for i in range(start, min(start + batch_size, books))
+            ])
+        if stdout is not None:
+            stdout.write('\rseeded {0} books'.format(
+                min(start + batch_size, books)))
+            stdout.flush()
+    if stdout is not None and books:
+        stdout.write('\n')
+
+    counters.recount()
+    cache.invalidate_catalogue()
+    return category_ids
+
+
+def percentile(samples, fraction):
+    """
+    Returns the value below which `fraction` of the sorted `samples` fall.
+    """
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def latency_stats(seconds):
+    """
+    Summarizes a list of durations (in seconds) in milliseconds.
+    """
+    milliseconds = [sample * 1000 for sample in seconds]
+    return {
+        'samples': len(milliseconds),
+        'mean_ms': sum(milliseconds) / len(milliseconds),
+        'p50_ms': percentile(milliseconds, 0.50),
+        'p90_ms': percentile(milliseconds, 0.90),
+        'p99_ms': percentile(milliseconds, 0.99),
+        'max_ms': max(milliseconds),
+    }
+
+
+def environment():
+    """
+    Describes where the benchmark ran, including the commit under test.
+    """
+    import django
+
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=BASE_DIR,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'platform': platform.platform(),
+        'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
+    }
+
+
+def write_results(results, path):
+    """
+    Writes `results` as JSON to `path`, or to standard output for `-`.
+    """
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if path == '-':
+        sys.stdout.write(text + '\n')
+        return
+    with open(path, 'w') as output:
+        output.write(text + '\n')
@@ -0,0 +1,50 @@
+"""
+Compares two benchmark result files, e.g. from two commits:
+
+    python -m benchmarks.compare before.json after.json
+
+Prints every numeric measurement found in both files with the relative
+change, flagging changes beyond the threshold.
+"""
+import argparse
+import json
+
+
+def flatten(results, prefix=''):
+    """
+    Yields (dotted path, value) pairs for every number in `results`.
+    """
+    for key, value in sorted(results.items()):
+        path = '{0}{1}'.format(prefix, key)
+        if isinstance(value, dict):
+            for item in flatten(value, path + '.'):
+                yield item
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield path, value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument(
+        '--threshold', type=float, default=0.10,
+        help='The relative change that is flagged (default: 0.10).')
+    args = parser.parse_args(argv)
+
+    with open(args.before) as before_file, open(args.after) as after_file:
+        before = dict(flatten(json.load(before_file)))
+        after = dict(flatten(json.load(after_file)))
+
+    for path in sorted(set(before) & set(after)):
+        if path.startswith('parameters.'):
+            continue
+        old, new = before[path], after[path]
+        change = (new - old) / float(old) if old else 0.0
+        flag = ' <--' if abs(change) > args.threshold else ''
+        print('{0:60} {1:>12.3f} {2:>12.3f} {3:>+8.1%}{4}'.format(
+            path, old, new, change, flag))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Compares mixed read/write throughput of the development and production
+database modes (see DATABASES in inventory/settings.py).
+
+Each mode runs in its own process against its own SQLite file: the file is
+migrated and seeded, then a number of threads issue listing reads and book
+creations (in the proportion given by --write-ratio) for a fixed time.
+
+    python -m benchmarks.database --books 50000 --threads 8 --duration 10
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks import common
+
+MODES = ('development', 'production')
+
+
+def workload(args):
+    """
+    Runs the read/write mix in the current process and returns the results.
+    """
+    common.setup_django()
+    from django.core.management import call_command
+    from django.db import OperationalError, connections, transaction
+
+    from bookstore import counters, models, queries
+
+    call_command('migrate', verbosity=0)
+    category_ids = common.seed_catalogue(args.books, args.categories)
+    connections.close_all()
+
+    deadline = time.time() + args.duration
+    lock = threading.Lock()
+    totals = {'reads': 0, 'writes': 0, 'errors': 0}
+    durations = {'reads': [], 'writes': []}
+
+    def worker(seed):
+        chooser = random.Random(seed)
+        local = {'reads': [], 'writes': []}
+        errors = 0
+        try:
+            while time.time() < deadline:
+                kind = 'writes' if chooser.random() < args.write_ratio \
+                    else 'reads'
+                started = time.perf_counter()
+                try:
+                    if kind == 'reads':
+                        list(queries.listing_page(
+                            queries.book_listing(),
+                            chooser.randint(0, args.books))[0])
+                    else:
+                        category_id = chooser.choice(category_ids)
+                        with transaction.atomic():
+                            models.Book.objects.create(
+                                title='Concurrent book',
+                                category_id=category_id)
+                            counters.adjust(category_id, 1)
+                except OperationalError:
+                    errors += 1
+                    continue
+                local[kind].append(time.perf_counter() - started)
+        finally:
+            connections.close_all()
+        with lock:
+            for kind in local:
+                totals[kind] += len(local[kind])
+                durations[kind].extend(local[kind])
+            totals['errors'] += errors
+
+    threads = [
+        threading.Thread(target=worker, args=(seed,))
+        for seed in range(args.threads)
+    ]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+
+    result = {
+        'seconds': elapsed,
+        'operations_per_second': (
+            totals['reads'] + totals['writes']) / elapsed,
+        'reads_per_second': totals['reads'] / elapsed,
+        'writes_per_second': totals['writes'] / elapsed,
+        'errors': totals['errors'],
+    }
+    for kind in durations:
+        if durations[kind]:
+            result[kind] = common.latency_stats(durations[kind])
+    return result
+
+
+def run_mode(mode, args):
+    """
+    Runs the workload for one database mode in a child process.
+    """
+    directory = tempfile.mkdtemp(prefix='bookstore-bench-')
+    try:
+        env = dict(os.environ)
+        env['INVENTORY_PRODUCTION'] = '1' if mode == 'production' else '0'
+        env['INVENTORY_DB_NAME'] = os.path.join(directory, 'db.sqlite3')
+        command = [
+            sys.executable, '-m', 'benchmarks.database', '--worker',
+            '--books', str(args.books),
+            '--categories', str(args.categories),
+            '--threads', str(args.threads),
+            '--duration', str(args.duration),
+            '--write-ratio', str(args.write_ratio),
+        ]
+        output = subprocess.check_output(
+            command, cwd=common.BASE_DIR, env=env)
+        return json.loads(output.decode())
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--categories', type=int, default=100)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument(
+        '--write-ratio', type=float, default=0.2,
+        help='The fraction of operations that create a book.')
+    parser.add_argument('--mode', choices=MODES, action='append')
+    parser.add_argument('--output', default='-')
+    parser.add_argument(
+        '--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        sys.stdout.write(json.dumps(workload(args)))
+        return
+
+    results = {
+        'environment': common.environment(),
+        'parameters': vars(args),
+        'modes': {},
+    }
+    for mode in args.mode or MODES:
+        sys.stderr.write('{0}...\n'.format(mode))
+        results['modes'][mode] = run_mode(mode, args)
+    common.write_results(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
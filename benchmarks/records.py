@@ -0,0 +1,100 @@
+"""
+Measures the CPU time and memory of reading the book listing as model
+instances, as values() dicts, as values_list() tuples and as the BookRecords
+of queries.listing_page().
+
+Each strategy reads --rows books (with their category names) from a throwaway
+database seeded with a synthetic catalogue, --repeat times. Memory is the
+tracemalloc peak while reading and the size still held by the rows once read.
+
+    python -m benchmarks.records --rows 100000 --output records.json
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+from benchmarks import common
+
+
+def strategies():
+    """
+    Returns the strategies to compare, each a function that reads `limit`
+    books of the listing and returns the rows.
+    """
+    from bookstore import models, queries
+
+    def instances(limit):
+        return list(models.Book.objects.select_related('category').only(
+            'title', 'category__name').order_by('id')[:limit])
+
+    def dicts(limit):
+        return list(models.Book.objects.values(
+            'id', 'title', 'category__name').order_by('id')[:limit])
+
+    def tuples(limit):
+        return list(queries.book_listing()[:limit])
+
+    def records(limit):
+        return queries.listing_page(queries.book_listing(), limit=limit)[0]
+
+    return [
+        ('instances', instances),
+        ('dicts', dicts),
+        ('tuples', tuples),
+        ('records', records),
+    ]
+
+
+def measure(read, limit, repeat):
+    """
+    Returns the CPU time and memory used by `read(limit)`.
+    """
+    seconds = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.process_time()
+        rows = read(limit)
+        seconds.append(time.process_time() - started)
+        del rows
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        rows = read(limit)
+        held, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'rows': len(rows),
+        'cpu': common.latency_stats(seconds),
+        'held_bytes': held,
+        'peak_bytes': peak,
+        'bytes_per_row': held / max(len(rows), 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--categories', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default='-')
+    args = parser.parse_args(argv)
+
+    common.setup_django()
+
+    results = {
+        'environment': common.environment(),
+        'parameters': vars(args),
+        'strategies': {},
+    }
+    with common.benchmark_database():
+        common.seed_catalogue(args.rows, args.categories)
+        for name, read in strategies():
+            results['strategies'][name] = measure(read, args.rows, args.repeat)
+    common.write_results(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
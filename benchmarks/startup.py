@@ -0,0 +1,168 @@
+"""
+Compares the cold start and the per-request overhead of the full project
+(inventory.settings, inventory.wsgi) and of the lean worker profile
+(inventory.settings_lean, inventory.wsgi_lean).
+
+Every start runs in a fresh process against a migrated throwaway SQLite
+file, --starts times per profile. A start measures how long importing the
+WSGI module takes, how many modules it loads, the first response to the
+category page, and then --requests requests to /metrics, a view without
+queries or templates, whose latency is the overhead of the framework and the
+middlewares.
+
+    python -m benchmarks.startup --starts 10 --requests 2000 --output startup.json
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import common
+
+PROFILES = {
+    'full': ('inventory.settings', 'inventory.wsgi'),
+    'lean': ('inventory.settings_lean', 'inventory.wsgi_lean'),
+}
+
+
+def request(application, path):
+    """
+    Sends a GET request for `path` to a WSGI application and returns the
+    status line.
+    """
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'HTTP_HOST': 'localhost',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.url_scheme': 'http',
+        'wsgi.version': (1, 0),
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    statuses = []
+    body = application(
+        environ, lambda status, headers: statuses.append(status))
+    try:
+        for _ in body:
+            pass
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    return statuses[0]
+
+
+def start(wsgi_module, requests):
+    """
+    Imports `wsgi_module` in the current, fresh process, serves the requests
+    and returns the measurements.
+    """
+    started = time.perf_counter()
+    module = __import__(wsgi_module, fromlist=['application'])
+    imported = time.perf_counter()
+    status = request(module.application, '/category/create')
+    first_response = time.perf_counter()
+    if not status.startswith('200'):
+        raise RuntimeError('/category/create answered {0}'.format(status))
+
+    durations = []
+    for _ in range(requests):
+        began = time.perf_counter()
+        request(module.application, '/metrics')
+        durations.append(time.perf_counter() - began)
+    return {
+        'import_seconds': imported - started,
+        'first_response_seconds': first_response - imported,
+        'modules': len(sys.modules),
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'request_seconds': durations,
+    }
+
+
+def run_profile(name, args, env):
+    """
+    Starts the profile `name` --starts times and summarizes the starts.
+    """
+    settings_module, wsgi_module = PROFILES[name]
+    env = dict(env, DJANGO_SETTINGS_MODULE=settings_module)
+    starts = []
+    for _ in range(args.starts):
+        output = subprocess.check_output([
+            sys.executable, '-m', 'benchmarks.startup', '--worker',
+            wsgi_module, '--requests', str(args.requests),
+        ], cwd=common.BASE_DIR, env=env)
+        starts.append(json.loads(output.decode()))
+
+    durations = [
+        duration for result in starts
+        for duration in result['request_seconds']]
+    return {
+        'settings': settings_module,
+        'import': common.latency_stats(
+            [result['import_seconds'] for result in starts]),
+        'first_response': common.latency_stats(
+            [result['first_response_seconds'] for result in starts]),
+        'ready': common.latency_stats([
+            result['import_seconds'] + result['first_response_seconds']
+            for result in starts]),
+        'modules': starts[0]['modules'],
+        'max_rss_kb': max(result['max_rss_kb'] for result in starts),
+        'request_overhead': common.latency_stats(durations),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--starts', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument(
+        '--production', action='store_true',
+        help='Run both profiles in the production configuration.')
+    parser.add_argument('--profile', choices=sorted(PROFILES), action='append')
+    parser.add_argument('--output', default='-')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        if common.BASE_DIR not in sys.path:
+            sys.path.insert(0, common.BASE_DIR)
+        sys.stdout.write(json.dumps(start(args.worker, args.requests)))
+        return
+
+    directory = tempfile.mkdtemp(prefix='bookstore-bench-')
+    try:
+        env = dict(os.environ)
+        env['INVENTORY_PRODUCTION'] = '1' if args.production else '0'
+        env['INVENTORY_ALLOWED_HOSTS'] = 'localhost'
+        env['INVENTORY_DB_NAME'] = os.path.join(directory, 'db.sqlite3')
+        subprocess.check_call(
+            [sys.executable, 'manage.py', 'migrate', '--verbosity', '0'],
+            cwd=common.BASE_DIR, env=env)
+
+        results = {
+            'environment': common.environment(),
+            'parameters': vars(args),
+            'profiles': {},
+        }
+        for name in args.profile or sorted(PROFILES):
+            sys.stderr.write('{0}...\n'.format(name))
+            results['profiles'][name] = run_profile(name, args, env)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    common.write_results(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
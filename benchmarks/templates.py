@@ -0,0 +1,105 @@
+"""
+Measures the cost of rendering the bookstore listings, per 10k rows.
+
+Three things are timed, without a database:
+
+- compiling a template, which the default loaders repeat on every render
+  and the cached loader of the production configuration does once;
+- rendering the book listing from model instances with a `{% for %}` loop
+  that resolves `book.title` and `book.category.name` on every row, as the
+  listing used to;
+- rendering book-listing.html from the (id, title, category name) tuples of
+  queries.book_listing() with the format_rows filter.
+
+    python -m benchmarks.templates --rows 10000 --repeat 5 --output templates.json
+"""
+import argparse
+import time
+
+from benchmarks import common
+
+LISTING = 'book-listing.html'
+# the book listing as it was before the format_rows filter
+ATTRIBUTE_LISTING = """<ul>
+    {% for book in books %}
+        <li>{{ book.title }} ({{ book.category.name }})</li>
+    {% empty %}
+        <p>No books created yet.</p>
+    {% endfor %}
+</ul>"""
+
+
+def timed(func, repeat):
+    """
+    Calls `func` `repeat` times and returns the durations in seconds.
+    """
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - started)
+    return durations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default='-')
+    args = parser.parse_args(argv)
+
+    common.setup_django()
+    from django.template import Context, Engine
+
+    from bookstore import models, rendering
+
+    libraries = {'listings': 'bookstore.templatetags.listings'}
+    engine = Engine(dirs=[rendering.TEMPLATE_DIR], libraries=libraries)
+    cached_engine = Engine(
+        dirs=[rendering.TEMPLATE_DIR], libraries=libraries, loaders=[
+            ('django.template.loaders.cached.Loader', [
+                'django.template.loaders.filesystem.Loader']),
+        ])
+    cached_engine.get_template(LISTING)
+
+    categories = [
+        models.Category(id=i, name='Category {0}'.format(i))
+        for i in range(100)]
+    instances = [
+        models.Book(id=i, title='Book {0}'.format(i),
+                    category=categories[i % len(categories)])
+        for i in range(args.rows)]
+    rows = [
+        (book.id, book.title, book.category.name) for book in instances]
+    attribute_template = engine.from_string(ATTRIBUTE_LISTING)
+    listing_template = cached_engine.get_template(LISTING)
+    per_10k = 10000.0 / max(args.rows, 1)
+
+    def scale(durations):
+        return common.latency_stats([d * per_10k for d in durations])
+
+    results = {
+        'environment': common.environment(),
+        'parameters': vars(args),
+        'compile': {
+            'uncached': common.latency_stats(timed(
+                lambda: engine.get_template(LISTING), args.repeat * 100)),
+            'cached': common.latency_stats(timed(
+                lambda: cached_engine.get_template(LISTING),
+                args.repeat * 100)),
+        },
+        'render_per_10k_rows': {
+            'attributes': scale(timed(
+                lambda: attribute_template.render(
+                    Context({'books': instances})),
+                args.repeat)),
+            'format_rows': scale(timed(
+                lambda: listing_template.render(Context({'books': rows})),
+                args.repeat)),
+        },
+    }
+    common.write_results(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
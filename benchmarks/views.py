@@ -0,0 +1,258 @@
+"""
+Benchmarks every view in bookstore/views.py against a synthetic catalogue.
+
+For each view this measures latency percentiles over a number of requests
+made through the Django test Client, the number of queries of one request
+and the peak memory allocated while serving one request. An optional
+throughput mode runs a mix of read requests from several threads at once.
+
+    python -m benchmarks.views --books 100000 --categories 500 \\
+        --requests 50 --threads 8 --duration 10 --output views.json
+"""
+import argparse
+import itertools
+import random
+import sys
+import threading
+import time
+import tracemalloc
+
+from benchmarks import common
+
+
+def scenarios(fixture):
+    """
+    Returns (name, method, request factory) tuples covering every view. A
+    request factory takes the index of the request and returns its URL and
+    POST data. Write scenarios consume the rows set aside in `fixture` so
+    that every request does real work.
+    """
+    from django.core.urlresolvers import reverse
+
+    category = fixture['category_id']
+    book = fixture['book_id']
+    return [
+        ('category_create GET', 'get', lambda i: (
+            reverse('category-create'), None)),
+        ('category_create POST', 'post', lambda i: (
+            reverse('category-create'),
+            {'name': 'Benchmark category {0}'.format(i)})),
+        ('category_edit GET', 'get', lambda i: (
+            reverse('category-edit', kwargs={'categ_id': category}), None)),
+        ('category_edit POST', 'post', lambda i: (
+            reverse('category-edit', kwargs={'categ_id': category}),
+            {'name': 'Renamed category {0}'.format(i)})),
+        ('category_delete GET', 'get', lambda i: (
+            reverse('category-delete', kwargs={'categ_id': category}), None)),
+        ('category_delete POST', 'post', lambda i: (
+            reverse('category-delete', kwargs={
+                'categ_id': fixture['deletable_categories'][i]}), {})),
+        ('book_create GET', 'get', lambda i: (
+            reverse('book-create'), None)),
+        ('book_create POST', 'post', lambda i: (
+            reverse('book-create'),
+            {'category': category, 'title': 'Benchmark book {0}'.format(i)})),
+        ('book_edit GET', 'get', lambda i: (
+            reverse('book-edit', kwargs={'book_id': book}), None)),
+        ('book_edit POST', 'post', lambda i: (
+            reverse('book-edit', kwargs={'book_id': book}),
+            {'category': category, 'title': 'Renamed book {0}'.format(i)})),
+        ('book_delete GET', 'get', lambda i: (
+            reverse('book-delete', kwargs={'book_id': book}), None)),
+        ('book_delete POST', 'post', lambda i: (
+            reverse('book-delete', kwargs={
+                'book_id': fixture['deletable_books'][i]}), {})),
+        ('book_search GET', 'get', lambda i: (
+            reverse('book-search'), {'q': 'Book 1{0}'.format(i % 10)})),
+        ('book_export GET', 'get', lambda i: (
+            reverse('book-export'), None)),
+    ]
+
+
+def prepare_fixture(category_ids, requests):
+    """
+    Picks the rows the scenarios work on and sets aside rows for the delete
+    scenarios to consume.
+    """
+    from bookstore import counters, models
+
+    needed = requests + 3
+    deletable_categories = []
+    for i in range(needed):
+        deletable_categories.append(models.Category.objects.create(
+            name='Deletable category {0}'.format(i)).id)
+    models.Book.objects.bulk_create(
+        models.Book(
+            title='Deletable book {0}'.format(i),
+            category_id=category_ids[0])
+        for i in range(needed)
+    )
+    counters.recount()
+    deletable_books = list(
+        models.Book.objects.filter(title__startswith='Deletable book ')
+        .order_by('id').values_list('id', flat=True))
+    return {
+        'category_id': category_ids[0],
+        'book_id': models.Book.objects.order_by('id').values_list(
+            'id', flat=True)[0],
+        'deletable_categories': deletable_categories,
+        'deletable_books': deletable_books,
+    }
+
+
+def perform(client, method, url, data):
+    """
+    Makes one request and reads the whole (possibly streamed) response.
+    """
+    if method == 'get':
+        response = client.get(url, data or {})
+    else:
+        response = client.post(url, data or {})
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+    return response
+
+
+def measure(client, name, method, factory, requests):
+    """
+    Measures the latency, queries and peak memory of one scenario.
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    counter = itertools.count()
+    # warm up caches and compiled templates
+    perform(client, method, *factory(next(counter)))
+
+    durations = []
+    for _ in range(requests):
+        url, data = factory(next(counter))
+        started = time.perf_counter()
+        response = perform(client, method, url, data)
+        durations.append(time.perf_counter() - started)
+
+    with CaptureQueriesContext(connection) as queries:
+        perform(client, method, *factory(next(counter)))
+    # the log is reset when the next request starts
+    query_count = len(queries)
+
+    tracemalloc.start()
+    try:
+        perform(client, method, *factory(next(counter)))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    result = common.latency_stats(durations)
+    result.update({
+        'status': response.status_code,
+        'queries': query_count,
+        'peak_memory_kb': peak / 1024.0,
+    })
+    return result
+
+
+def throughput(fixture, threads, duration):
+    """
+    Runs a mix of read requests from `threads` threads for `duration`
+    seconds and reports the requests per second and latency percentiles.
+    """
+    from django.db import connections
+    from django.test import Client
+
+    mix = [
+        scenario for scenario in scenarios(fixture)
+        if scenario[1] == 'get' and scenario[0] != 'book_export GET'
+    ]
+    deadline = time.time() + duration
+    durations = []
+    lock = threading.Lock()
+
+    def worker(seed):
+        client = Client()
+        chooser = random.Random(seed)
+        local = []
+        i = 0
+        try:
+            while time.time() < deadline:
+                name, method, factory = chooser.choice(mix)
+                started = time.perf_counter()
+                perform(client, method, *factory(i))
+                local.append(time.perf_counter() - started)
+                i += 1
+        finally:
+            connections.close_all()
+        with lock:
+            durations.extend(local)
+
+    started = time.time()
+    pool = [
+        threading.Thread(target=worker, args=(seed,))
+        for seed in range(threads)
+    ]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.time() - started
+
+    result = common.latency_stats(durations) if durations else {}
+    result.update({
+        'threads': threads,
+        'seconds': elapsed,
+        'requests': len(durations),
+        'requests_per_second': len(durations) / elapsed,
+    })
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--categories', type=int, default=100)
+    parser.add_argument(
+        '--requests', type=int, default=20,
+        help='The number of timed requests per view.')
+    parser.add_argument(
+        '--threads', type=int, default=0,
+        help='Also measure throughput with this many threads.')
+    parser.add_argument(
+        '--duration', type=float, default=10.0,
+        help='How long the throughput mode runs, in seconds.')
+    parser.add_argument(
+        '--only', action='append', default=[],
+        help='Only benchmark the views whose name contains this text.')
+    parser.add_argument('--settings', default='inventory.settings')
+    parser.add_argument('--output', default='-')
+    args = parser.parse_args(argv)
+
+    common.setup_django(args.settings)
+    from django.test import Client
+
+    results = {
+        'environment': common.environment(),
+        'parameters': vars(args),
+        'views': {},
+    }
+    with common.benchmark_database():
+        category_ids = common.seed_catalogue(
+            args.books, max(1, args.categories), stdout=sys.stderr)
+        fixture = prepare_fixture(category_ids, args.requests)
+        client = Client()
+        for name, method, factory in scenarios(fixture):
+            if args.only and not any(text in name for text in args.only):
+                continue
+            sys.stderr.write('{0}...\n'.format(name))
+            results['views'][name] = measure(
+                client, name, method, factory, args.requests)
+        if args.threads:
+            sys.stderr.write('throughput...\n')
+            results['throughput'] = throughput(
+                fixture, args.threads, args.duration)
+
+    common.write_results(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
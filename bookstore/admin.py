@@ -1,3 +1,322 @@
-from django.contrib import admin
+"""
+The admin of Books and Categories, built to stay usable with millions of
+books.
 
-# Register your models here.
+The stock ModelAdmin counts the whole table for every changelist page, loads
+the category of every listed book with a query of its own, renders every
+category in the dropdown of the book form, searches with LIKE '%term%' and
+deletes through the collector, which loads every object first. Here:
+
+- the changelists are paginated by EstimatedCountPaginator, which never runs
+  an unbounded COUNT(*);
+- the categories of the listed books are joined into the changelist query,
+  and the category of a book is entered by id;
+- searches go through bookstore.search, which answers all but the shortest
+  substring terms from an index;
+- the bulk actions run set-based statements and keep the book counters, the
+  cached pages and the change feed consistent, like bookstore.batch does.
+"""
+from collections import Counter
+
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db import connections, router, transaction
+from django.db.models import Sum
+from django.shortcuts import render
+from django.utils.functional import cached_property
+
+from bookstore import (
+    cache, changes, counters, deletion, models, queries, search)
+
+# filtered changelists count at most this many rows
+MAX_EXACT_COUNT = 10000
+CONFIRM_DELETE_TEMPLATE = 'admin/bookstore/bulk_delete_confirmation.html'
+
+ESTIMATE_SQL = {
+    'postgresql': (
+        'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass'),
+    'mysql': (
+        'SELECT table_rows FROM information_schema.tables '
+        'WHERE table_schema = DATABASE() AND table_name = %s'),
+}
+
+
+def table_estimate(model, using):
+    """
+    Returns the number of rows of the table of `model` estimated from the
+    statistics of the database, or None when it keeps none.
+    """
+    connection = connections[using]
+    sql = ESTIMATE_SQL.get(connection.vendor)
+    if sql is None:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [model._meta.db_table])
+        row = cursor.fetchone()
+    # tables never analyzed report no rows, or -1
+    if row is None or row[0] is None or row[0] <= 0:
+        return None
+    return int(row[0])
+
+
+def estimated_count(queryset):
+    """
+    Returns the number of rows of `queryset` without an unbounded COUNT(*).
+
+    The number of Books is the sum of the book counters of the categories,
+    other unfiltered tables are estimated from the database statistics, and
+    everything else is counted up to MAX_EXACT_COUNT rows.
+    """
+    if not queryset.query.where:
+        if queryset.model is models.Book:
+            return models.Category.objects.using(queryset.db).aggregate(
+                total=Sum('book_count'))['total'] or 0
+        estimate = table_estimate(queryset.model, queryset.db)
+        if estimate is not None:
+            return estimate
+    # a count over a slice is run on a subquery that stops at the limit
+    return min(
+        queryset.order_by().values('pk')[:MAX_EXACT_COUNT + 1].count(),
+        MAX_EXACT_COUNT)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    A Paginator whose count comes from estimated_count(); with an estimate
+    below the real count the last rows are not reachable by page number.
+    """
+
+    @cached_property
+    def count(self):
+        return estimated_count(self.object_list)
+
+
+def move_books(books, category_id):
+    """
+    Moves the Books of the queryset `books` into the Category `category_id`
+    in one transaction and returns the number of books moved.
+    """
+    with transaction.atomic(using=router.db_for_write(models.Book)):
+        rows = list(books.exclude(category_id=category_id).order_by(
+        ).values_list('id', 'category_id'))
+        ids = [pk for pk, previous in rows]
+        for chunk in queries.chunks(ids, queries.LOOKUP_BATCH_SIZE):
+            models.Book.objects.filter(pk__in=chunk).update(
+                category_id=category_id)
+        changes.record_ids(models.Book, 'update', ids)
+        deltas = Counter({category_id: len(ids)})
+        deltas.subtract(Counter(previous for pk, previous in rows))
+        counters.adjust_many(deltas)
+        # bulk writes send no model signals
+        if ids:
+            cache.invalidate(cache.invalidate_catalogue)
+    return len(ids)
+
+
+def delete_books(books):
+    """
+    Deletes the Books of the queryset `books` in one transaction and returns
+    the number of books deleted.
+    """
+    with transaction.atomic(using=router.db_for_write(models.Book)):
+        rows = list(books.order_by().values_list('id', 'category_id'))
+        deletion.delete_ids(models.Book, [pk for pk, category_id in rows])
+        deltas = Counter()
+        deltas.subtract(Counter(category_id for pk, category_id in rows))
+        counters.adjust_many(deltas)
+        if rows:
+            cache.invalidate(cache.invalidate_catalogue)
+    return len(rows)
+
+
+def confirm_delete(modeladmin, request, count):
+    """
+    Renders the page asking to confirm the deletion of the `count` selected
+    objects, without listing them.
+    """
+    opts = modeladmin.model._meta
+    context = dict(
+        modeladmin.admin_site.each_context(request),
+        title='Are you sure?',
+        opts=opts,
+        count=count,
+        objects_name=(
+            opts.verbose_name if count == 1 else opts.verbose_name_plural),
+        action_checkbox_name=helpers.ACTION_CHECKBOX_NAME,
+        selected=request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+        select_across=request.POST.get('select_across', '0'),
+    )
+    return render(request, CONFIRM_DELETE_TEMPLATE, context)
+
+
+class BookActionForm(helpers.ActionForm):
+    """
+    The action form of the Book changelist, with the id of the category that
+    the `move_to_category` action moves the selected books into.
+    """
+    category = forms.IntegerField(
+        label='Category id:', required=False, min_value=1)
+
+
+@admin.register(models.Category)
+class CategoryAdmin(admin.ModelAdmin):
+    """
+    The admin of Categories. A Category is deleted through the
+    `delete_selected` action only, which removes its books with set-based
+    statements instead of listing them on a confirmation page.
+    """
+    list_display = ('id', 'name', 'book_count')
+    readonly_fields = ('book_count',)
+    # answered by get_search_results() from the indexes
+    search_fields = ('name',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['delete_selected', 'recount_books']
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Matches the Category whose id is `search_term`, or the Categories
+        whose name starts with it.
+        """
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if search_term.isdigit():
+            return queryset.filter(pk=int(search_term)), False
+        return queryset.filter(
+            name__gte=search_term, name__lt=search_term + u'\uffff'), False
+
+    def has_delete_permission(self, request, obj=None):
+        """
+        Allows the `delete_selected` action, but not the delete view, whose
+        confirmation page would list every book of the category.
+        """
+        if obj is not None:
+            return False
+        return super(CategoryAdmin, self).has_delete_permission(request)
+
+    def delete_selected(self, request, queryset):
+        """
+        Deletes the selected Categories with their books, in the background
+        for the categories that the category delete page defers too.
+        """
+        if not self.has_delete_permission(request):
+            raise PermissionDenied
+        if not request.POST.get('post'):
+            return confirm_delete(self, request, estimated_count(queryset))
+        deleted = deferred = books = 0
+        for category in queryset.order_by('pk'):
+            if deletion.should_defer(category):
+                deletion.delete_category_deferred(category)
+                deferred += 1
+            else:
+                books += deletion.delete_category(category)
+                deleted += 1
+        self.message_user(
+            request,
+            'Deleted {0} categories and {1} books; queued the deletion of '
+            '{2} categories.'.format(deleted, books, deferred),
+            messages.SUCCESS)
+    delete_selected.short_description = (
+        'Delete selected categories and their books')
+
+    def recount_books(self, request, queryset):
+        """
+        Recomputes the book counts of the selected Categories.
+        """
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        category_ids = list(queryset.order_by().values_list('pk', flat=True))
+        counters.recount(category_ids)
+        self.message_user(
+            request, 'Recounted the books of {0} categories.'.format(
+                len(category_ids)), messages.SUCCESS)
+    recount_books.short_description = (
+        'Recount the books of selected categories')
+
+
+@admin.register(models.Book)
+class BookAdmin(admin.ModelAdmin):
+    """
+    The admin of Books. Saves and deletes of single books update the book
+    counters of their categories, as the bookstore views do.
+    """
+    list_display = ('id', 'title', 'category_name')
+    list_select_related = ('category',)
+    raw_id_fields = ('category',)
+    # answered by get_search_results() from the indexes
+    search_fields = ('title',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    action_form = BookActionForm
+    actions = ['delete_selected', 'move_to_category']
+
+    def category_name(self, obj):
+        return obj.category.name
+    # not sortable: ordering the changelist by category name reads every book
+    category_name.short_description = 'category'
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Matches the Book whose id is `search_term`, or the Books whose title
+        contains it, through bookstore.search.
+        """
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if search_term.isdigit():
+            return queryset.filter(pk=int(search_term)), False
+        return search.filter_titles(queryset, search_term), False
+
+    def save_model(self, request, obj, form, change):
+        # the change form already runs in a transaction
+        obj.save()
+        if not change:
+            counters.adjust(obj.category_id, 1)
+        elif 'category' in form.changed_data:
+            counters.adjust(form.initial['category'], -1)
+            counters.adjust(obj.category_id, 1)
+
+    def delete_model(self, request, obj):
+        deleted, _ = obj.delete()
+        if deleted:
+            counters.adjust(obj.category_id, -1)
+
+    def delete_selected(self, request, queryset):
+        """
+        Deletes the selected Books with set-based statements.
+        """
+        if not self.has_delete_permission(request):
+            raise PermissionDenied
+        if not request.POST.get('post'):
+            return confirm_delete(self, request, estimated_count(queryset))
+        deleted = delete_books(queryset)
+        self.message_user(
+            request, 'Deleted {0} books.'.format(deleted), messages.SUCCESS)
+    delete_selected.short_description = 'Delete selected books'
+
+    def move_to_category(self, request, queryset):
+        """
+        Moves the selected Books into the category whose id is entered next
+        to the action.
+        """
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        try:
+            category_id = int(request.POST.get('category', ''))
+        except ValueError:
+            category_id = None
+        if (category_id is None or not models.Category.objects.filter(
+                pk=category_id).exists()):
+            self.message_user(
+                request, 'Enter the id of an existing category to move the '
+                'books into.', messages.ERROR)
+            return None
+        moved = move_books(queryset, category_id)
+        self.message_user(
+            request, 'Moved {0} books to category {1}.'.format(
+                moved, category_id), messages.SUCCESS)
+    move_to_category.short_description = 'Move selected books to category'
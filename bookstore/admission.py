@@ -0,0 +1,214 @@
+"""
+Request coalescing and admission control for the hot bookstore pages.
+
+When many clients ask for the same page at once, every request used to run
+the same listing query and render on its own. coalesce() lets concurrent
+callers that need the same value share a single computation: the first one
+computes it while the others wait for its result. bookstore.cache coalesces
+the misses of its cached values, fragments and responses this way.
+
+bookstore.middleware.AdmissionControlMiddleware bounds the number of requests
+of a route that run at once, as set in BOOKSTORE_ADMISSION. A request over
+the limit waits in a bounded queue for a free slot; when the queue is full or
+the wait times out, the request is shed with a 503 and a Retry-After header
+instead of piling up on the database. The limits hold per process.
+
+The number of computed and joined values, and of admitted, waiting and shed
+requests, are rendered for the /metrics endpoint by render().
+"""
+import collections
+import threading
+
+from django.conf import settings
+from django.http import HttpResponse
+
+DEFAULT_TIMEOUT = 5.0
+DEFAULT_RETRY_AFTER = 1
+
+
+class Counters(object):
+    """
+    Thread-safe counts of events, keyed by label and outcome.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counts = collections.Counter()
+
+    def add(self, label, outcome):
+        with self._lock:
+            self.counts[label, outcome] += 1
+
+    def get(self, label, outcome):
+        with self._lock:
+            return self.counts[label, outcome]
+
+    def items(self):
+        """Returns the ((label, outcome), count) pairs, sorted."""
+        with self._lock:
+            return sorted(self.counts.items())
+
+
+coalescing_counts = Counters()
+admission_counts = Counters()
+
+
+class _Call(object):
+    """A computation in flight and, once done, its outcome."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Runs at most one computation per key at a time; callers that ask for a
+    key while it is being computed wait for the result instead.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, compute):
+        """
+        Returns the result of `compute()` and whether it was computed by
+        another caller. The error of a failed computation is raised in every
+        caller that waited for it.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+
+        try:
+            call.value = compute()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value, False
+
+
+_flights = SingleFlight()
+
+
+def coalesce(key, compute, label):
+    """
+    Returns `compute()`, sharing the computation with the concurrent callers
+    of the same `key`. `label` names the kind of value in the counters.
+    """
+    value, shared = _flights.do(key, compute)
+    coalescing_counts.add(label, 'joined' if shared else 'computed')
+    return value
+
+
+class Limiter(object):
+    """
+    Lets at most `concurrency` callers hold a slot at once, and up to `queue`
+    more wait at most `timeout` seconds for one.
+    """
+    ADMITTED = 'admitted'
+    WAITED = 'waited'
+
+    def __init__(self, concurrency, queue, timeout=DEFAULT_TIMEOUT):
+        self.queue = queue
+        self.timeout = timeout
+        self.waiting = 0
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes a slot and returns ADMITTED or, after waiting for it, WAITED.
+        Returns None when the queue is full or the wait timed out.
+        """
+        if self._slots.acquire(blocking=False):
+            return self.ADMITTED
+        with self._lock:
+            if self.waiting >= self.queue:
+                return None
+            self.waiting += 1
+        try:
+            acquired = self._slots.acquire(timeout=self.timeout)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        return self.WAITED if acquired else None
+
+    def release(self):
+        self._slots.release()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter(url_name):
+    """
+    Returns the Limiter of the route `url_name`, or None when the route is
+    not limited.
+    """
+    config = getattr(settings, 'BOOKSTORE_ADMISSION', {}).get(url_name)
+    if config is None:
+        return None
+    key = (url_name, config['concurrency'], config['queue'],
+           config.get('timeout', DEFAULT_TIMEOUT))
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = Limiter(*key[1:])
+        return _limiters[key]
+
+
+def overloaded(url_name):
+    """
+    Returns the response to a request shed from the route `url_name`.
+    """
+    config = settings.BOOKSTORE_ADMISSION[url_name]
+    response = HttpResponse(
+        'The server is busy, please retry shortly.\n', status=503,
+        content_type='text/plain; charset=utf-8')
+    response['Retry-After'] = str(
+        config.get('retry_after', DEFAULT_RETRY_AFTER))
+    return response
+
+
+def render():
+    """
+    Returns the coalescing and admission counters in the Prometheus text
+    format.
+    """
+    lines = [
+        '# HELP bookstore_coalesced_total Values computed, or joined while '
+        'another request computed them.',
+        '# TYPE bookstore_coalesced_total counter',
+    ]
+    for (label, outcome), count in coalescing_counts.items():
+        lines.append(
+            'bookstore_coalesced_total{{cache="{0}",outcome="{1}"}} {2}'
+            .format(label, outcome, count))
+    lines.extend([
+        '# HELP bookstore_admission_total Requests of limited routes '
+        'admitted at once, after waiting, or shed.',
+        '# TYPE bookstore_admission_total counter',
+    ])
+    for (label, outcome), count in admission_counts.items():
+        lines.append(
+            'bookstore_admission_total{{url_name="{0}",outcome="{1}"}} '
+            '{2}'.format(label, outcome, count))
+    return '\n'.join(lines) + '\n'
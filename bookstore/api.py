@@ -0,0 +1,339 @@
+"""
+JSON endpoints for Books and Categories.
+
+Rows are serialized straight from QuerySet.values(), without instantiating
+models. Every response carries an ETag and Last-Modified derived from the
+head of the change feed, read from the database for every request, so that
+all processes agree on them and writes made anywhere change them. Clients
+that already hold the current data are answered with an empty 304 after that
+single indexed query, and other responses are served from the response cache
+until the catalogue changes.
+
+batch_write applies a batch of creations, edits and deletions in one request
+and one transaction (see bookstore.batch).
+
+change_feed returns the changes made since a sequence number (see
+bookstore.changes), so that consumers can stay in sync without rereading the
+catalogue. It is not cached: a long-polling consumer waits for the next
+change instead.
+
+The job endpoints queue exports, recounts and category deletions as
+background jobs (see bookstore.jobs), and report the status and progress of
+every job, imports included.
+
+The endpoints that write are called by back-office tools rather than by
+browsers. They are exempt from CSRF checks, which protect the cookies of
+browsers, and take one of the BOOKSTORE_API_TOKENS in an
+`Authorization: Bearer <token>` header instead.
+"""
+import functools
+import json
+from operator import itemgetter
+
+from django.conf import settings
+from django.http import FileResponse, JsonResponse
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_GET, require_POST
+
+from bookstore import (
+    batch, cache, changes, exporter, jobs, models, queries, tasks)
+
+BOOK_FIELDS = ('id', 'title', 'category_id', 'category__name')
+CATEGORY_FIELDS = ('id', 'name', 'book_count')
+
+
+def _generation(request):
+    """
+    Returns the generation of the catalogue read from the database for
+    `request`, ignoring BOOKSTORE_GENERATION_TTL, so that the validators and
+    the cached response of the request agree.
+    """
+    if not hasattr(request, 'bookstore_generation'):
+        request.bookstore_generation = cache.generation(fresh=True)
+    return request.bookstore_generation
+
+
+def _etag(request, *args, **kwargs):
+    """Returns an ETag that changes whenever the catalogue changes."""
+    version = _generation(request)[0]
+    if version is None:
+        return None
+    return 'catalogue-{0}'.format(version)
+
+
+def _last_modified(request, *args, **kwargs):
+    """Returns when the catalogue last changed."""
+    return _generation(request)[1]
+
+
+conditional = condition(etag_func=_etag, last_modified_func=_last_modified)
+
+
+def _json(data, status=200):
+    """Returns `data` as compact JSON."""
+    return JsonResponse(
+        data, status=status, json_dumps_params={'separators': (',', ':')})
+
+
+def token_required(view):
+    """
+    Exempts `view` from CSRF checks and answers with a 401 unless the request
+    carries one of the BOOKSTORE_API_TOKENS as a bearer token.
+    """
+    @csrf_exempt
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        scheme, _, token = request.META.get(
+            'HTTP_AUTHORIZATION', '').partition(' ')
+        tokens = getattr(settings, 'BOOKSTORE_API_TOKENS', ())
+        if scheme.lower() != 'bearer' or not any(
+                constant_time_compare(token, known) for known in tokens):
+            response = _json(
+                {'error': 'Expected the header Authorization: Bearer '
+                          '<token> with a valid API token.'},
+                status=401)
+            response['WWW-Authenticate'] = 'Bearer'
+            return response
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def _book(row):
+    """Renames the category name of a Book row to `category`."""
+    row['category'] = row.pop('category__name')
+    return row
+
+
+def _page(request, queryset):
+    """
+    Returns the requested keyset page of `queryset` together with the URL of
+    the next page (None on the last page).
+    """
+    after, limit = queries.page_params(request.GET)
+    rows, next_after = queries.keyset_page(
+        queryset, after, limit, id_of=itemgetter('id'))
+    next_url = None
+    if next_after is not None:
+        params = request.GET.copy()
+        params['after'] = next_after
+        params['limit'] = limit
+        next_url = '{0}?{1}'.format(request.path, params.urlencode())
+    return rows, next_url
+
+
+@require_GET
+@conditional
+@cache.cached_get
+def book_list(request):
+    books = models.Book.objects.values(*BOOK_FIELDS)
+    try:
+        category = int(request.GET['category'])
+    except (KeyError, ValueError):
+        category = None
+    if category is not None:
+        try:
+            books = books.filter(category_id=queries.parse_id(category))
+        except ValueError:
+            return _json(
+                {'error': 'Expected a category id between {0} and {1}.'.format(
+                    queries.MIN_ID, queries.MAX_ID)},
+                status=400)
+    rows, next_url = _page(request, books)
+    return _json({'results': [_book(row) for row in rows], 'next': next_url})
+
+
+@require_GET
+@conditional
+@cache.cached_get
+def book_detail(request, book_id):
+    try:
+        row = models.Book.objects.values(*BOOK_FIELDS).get(pk=book_id)
+    except models.Book.DoesNotExist:
+        return _json(
+            {'error': 'Book of id {0} does not exist!'.format(book_id)},
+            status=404)
+    return _json(_book(row))
+
+
+@require_GET
+@conditional
+@cache.cached_get
+def category_list(request):
+    categories = models.Category.objects.values(*CATEGORY_FIELDS)
+    rows, next_url = _page(request, categories)
+    return _json({'results': rows, 'next': next_url})
+
+
+@require_GET
+@conditional
+@cache.cached_get
+def category_detail(request, categ_id):
+    try:
+        row = models.Category.objects.values(*CATEGORY_FIELDS).get(
+            pk=categ_id)
+    except models.Category.DoesNotExist:
+        return _json(
+            {'error': 'Category of id {0} does not exist!'.format(categ_id)},
+            status=404)
+    return _json(row)
+
+
+@token_required
+@require_POST
+def batch_write(request):
+    try:
+        operations = json.loads(request.body.decode('utf-8'))['operations']
+    except (ValueError, KeyError, TypeError):
+        return _json(
+            {'error': 'Expected a JSON object with a list of operations.'},
+            status=400)
+    try:
+        results = batch.apply(operations)
+    except batch.BatchError as error:
+        return _json({'errors': error.errors}, status=400)
+    return _json({'results': results})
+
+
+def _feed_params(params):
+    """
+    Returns the `since`, `limit` and `wait` parameters of a change feed
+    request, or raises ValueError.
+    """
+    since = int(params.get('since', 0))
+    limit = int(params.get('limit', changes.DEFAULT_LIMIT))
+    wait = float(params.get('wait', 0))
+    if since < 0 or limit < 1 or not 0 <= wait <= changes.MAX_WAIT:
+        raise ValueError
+    return since, min(limit, changes.MAX_LIMIT), wait
+
+
+@require_GET
+def change_feed(request):
+    try:
+        since, limit, wait = _feed_params(request.GET)
+    except ValueError:
+        return _json({'error': (
+            'Expected a non-negative since, a positive limit and a wait of '
+            'at most {0:g} seconds.').format(changes.MAX_WAIT)}, status=400)
+    # one extra change tells whether the consumer has caught up
+    rows = changes.wait(since, limit + 1, wait) if wait else changes.since(
+        since, limit + 1)
+    return _json({
+        'changes': rows[:limit],
+        'next': rows[:limit][-1]['seq'] if rows else since,
+        'more': len(rows) > limit,
+    })
+
+
+def _job(job):
+    """Returns the status, progress and outcome of a Job."""
+    return {
+        'id': job.pk,
+        'kind': job.kind,
+        'status': job.status,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'cancel_requested': job.cancel_requested,
+        'progress': {'done': job.done, 'total': job.total},
+        'result': None if job.result is None else json.loads(job.result),
+        'error': job.error,
+        'created': job.created,
+        'started': job.started,
+        'finished': job.finished,
+    }
+
+
+def _job_payload(kind, data):
+    """
+    Returns the payload of a job of `kind` that clients may queue, built from
+    the `data` they sent, or raises ValueError.
+    """
+    if kind == 'export_books':
+        fmt = data.get('format', 'csv')
+        if fmt not in exporter.FORMATS:
+            raise ValueError('Unknown export format: {0}'.format(fmt))
+        return {'format': fmt}
+    if kind == 'delete_category':
+        category_id = data.get('category')
+        if not isinstance(category_id, int) or not (
+                models.Category.objects.filter(pk=category_id).exists()):
+            raise ValueError(
+                'Category of id {0} does not exist!'.format(category_id))
+        return {'category_id': category_id}
+    if kind == 'recount_categories':
+        return {}
+    raise ValueError('Expected one of: delete_category, export_books, '
+                     'recount_categories.')
+
+
+@token_required
+@require_POST
+def job_create(request):
+    try:
+        body = json.loads(request.body.decode('utf-8'))
+        kind, data = body['kind'], body.get('data', {})
+        if not isinstance(data, dict):
+            raise TypeError
+    except (ValueError, KeyError, TypeError):
+        return _json(
+            {'error': 'Expected a JSON object with the kind of job.'},
+            status=400)
+    try:
+        payload = _job_payload(kind, data)
+    except ValueError as error:
+        return _json({'error': str(error)}, status=400)
+    return _json(_job(jobs.enqueue(kind, payload)), status=202)
+
+
+def _get_job(job_id):
+    try:
+        return models.Job.objects.get(pk=job_id)
+    except models.Job.DoesNotExist:
+        return None
+
+
+def _no_job(job_id):
+    return _json(
+        {'error': 'Job of id {0} does not exist!'.format(job_id)}, status=404)
+
+
+@require_GET
+def job_detail(request, job_id):
+    job = _get_job(job_id)
+    if job is None:
+        return _no_job(job_id)
+    return _json(_job(job))
+
+
+@token_required
+@require_POST
+def job_cancel(request, job_id):
+    cancelled = jobs.cancel(job_id)
+    job = _get_job(job_id)
+    if job is None:
+        return _no_job(job_id)
+    if not cancelled:
+        return _json({'error': 'Job of id {0} has already finished.'.format(
+            job_id)}, status=409)
+    return _json(_job(job))
+
+
+@require_GET
+def job_output(request, job_id):
+    job = _get_job(job_id)
+    if job is None:
+        return _no_job(job_id)
+    if job.kind != 'export_books' or job.status != models.Job.SUCCEEDED:
+        return _json({'error': 'Job of id {0} has no output.'.format(
+            job_id)}, status=404)
+    fmt = json.loads(job.payload).get('format', 'csv')
+    try:
+        output = open(tasks.export_path(job.pk, fmt), 'rb')
+    except IOError:
+        return _json({'error': 'The output of job {0} was removed.'.format(
+            job_id)}, status=410)
+    response = FileResponse(output, content_type=exporter.CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = (
+        'attachment; filename="books.{0}"'.format(fmt))
+    return response
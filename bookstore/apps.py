@@ -3,3 +3,10 @@ from django.apps import AppConfig
 
 class BookstoreConfig(AppConfig):
     name = 'bookstore'
+
+    def ready(self):
+        """
+        Connects the signal receivers of the bookstore app and registers
+        the tasks of its job queue.
+        """
+        from bookstore import signals, tasks  # noqa: F401
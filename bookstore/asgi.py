@@ -0,0 +1,294 @@
+"""
+An ASGI handler for the bookstore, served by inventory.asgi.
+
+Django 1.10 only speaks WSGI, so the handler translates every ASGI request
+into a WSGIRequest. Requests for the views that have an async variant in
+bookstore.async_views are awaited on the event loop, and their database and
+template work runs on a bounded thread pool of BOOKSTORE_ASYNC_THREADS
+threads, so a slow query holds a pool thread but never the connection to the
+client. The Django middleware in MIDDLEWARE wraps these views through its
+process_request, process_view, process_exception and process_response
+hooks; middleware without those hooks, such as
+bookstore.middleware.InstrumentationMiddleware, only wraps the other views,
+which run through the regular WSGI handler on the same pool.
+"""
+import asyncio
+import io
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers.exception import response_for_exception
+from django.core.handlers.wsgi import (
+    WSGIHandler, WSGIRequest, get_script_name)
+from django.core.urlresolvers import (
+    Resolver404, get_resolver, set_script_prefix)
+from django.db import close_old_connections
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.module_loading import import_string
+
+from bookstore import routers
+
+DEFAULT_THREADS = 32
+
+_lock = threading.Lock()
+_executor = None
+
+
+def executor():
+    """
+    Returns the thread pool that runs the blocking work of the async views.
+    """
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=getattr(
+                settings, 'BOOKSTORE_ASYNC_THREADS', DEFAULT_THREADS))
+        return _executor
+
+
+def _call(request, func, args, kwargs):
+    """
+    Calls `func` on a pool thread, letting GET and HEAD requests read from
+    the replicas like bookstore.middleware.ReplicaRoutingMiddleware, and
+    releases the database connections of the thread that are past their
+    CONN_MAX_AGE afterwards.
+    """
+    try:
+        if request is not None:
+            # the URL prefix used by reverse() is thread-local
+            set_script_prefix(get_script_name(request.environ))
+        if request is not None and request.method in ('GET', 'HEAD'):
+            with routers.allow_replicas():
+                return func(*args, **kwargs)
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def run_in_pool(request, func, *args, **kwargs):
+    """
+    Runs the blocking `func` on the thread pool on behalf of `request` and
+    returns a future of its result for the running event loop to await.
+    """
+    return asyncio.get_event_loop().run_in_executor(
+        executor(), _call, request, func, args, kwargs)
+
+
+def _environ(scope, body):
+    """
+    Builds the WSGI environ of an ASGI HTTP request.
+    """
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path,
+        'PATH_INFO': path.encode('utf-8').decode('iso-8859-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('iso-8859-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/{0}'.format(
+            scope.get('http_version', '1.1')),
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin1').upper().replace('-', '_')
+        value = value.decode('latin1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_{0}'.format(name)
+        if name in environ:
+            value = '{0},{1}'.format(environ[name], value)
+        environ[name] = value
+    # the whole body has been read, whether or not it was sent chunked
+    environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
+
+
+def _response_headers(response):
+    """
+    Returns the headers and cookies of a Django response as ASGI headers.
+    """
+    headers = [
+        (name.encode('latin1'), value.encode('latin1'))
+        for name, value in response.items()]
+    for cookie in response.cookies.values():
+        headers.append(
+            (b'Set-Cookie', cookie.output(header='').strip().encode('latin1')))
+    return headers
+
+
+class ASGIHandler(object):
+    """
+    An ASGI application serving the inventory project: the views of
+    bookstore.async_views on the event loop and every other view through the
+    WSGI handler on the thread pool.
+    """
+
+    def __init__(self):
+        from bookstore import async_views
+
+        self.async_views = async_views.VIEWS
+        self.wsgi_handler = WSGIHandler()
+        self.middleware = []
+        for path in settings.MIDDLEWARE:
+            middleware_class = import_string(path)
+            if issubclass(middleware_class, MiddlewareMixin):
+                self.middleware.append(middleware_class())
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            body = await self.read_body(receive)
+            await self.handle(scope, body, send)
+        else:
+            raise ValueError(
+                'Unsupported ASGI scope type: {0}'.format(scope['type']))
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def read_body(self, receive):
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+        return b''.join(chunks)
+
+    async def handle(self, scope, body, send):
+        request = WSGIRequest(_environ(scope, body))
+        try:
+            match = get_resolver().resolve(request.path_info)
+        except Resolver404:
+            match = None
+        view = match and self.async_views.get(match.url_name)
+        if view is None:
+            await self.handle_wsgi(request.environ, send)
+            return
+
+        request.resolver_match = match
+        response = await run_in_pool(
+            request, self.process_request, request, view, match)
+        if response is None:
+            try:
+                response = await view(request, *match.args, **match.kwargs)
+            except Exception as exception:
+                response = await run_in_pool(
+                    request, self.process_exception, request, exception)
+        response = await run_in_pool(
+            request, self.process_response, request, response)
+        await self.send_response(response, send)
+
+    def process_request(self, request, view, match):
+        """
+        Runs the process_request and process_view hooks of the middleware
+        and returns the response of the first one that short-circuits.
+        """
+        for middleware in self.middleware:
+            if hasattr(middleware, 'process_request'):
+                response = middleware.process_request(request)
+                if response is not None:
+                    return response
+        for middleware in self.middleware:
+            if hasattr(middleware, 'process_view'):
+                response = middleware.process_view(
+                    request, view, match.args, match.kwargs)
+                if response is not None:
+                    return response
+        return None
+
+    def process_exception(self, request, exception):
+        for middleware in reversed(self.middleware):
+            if hasattr(middleware, 'process_exception'):
+                response = middleware.process_exception(request, exception)
+                if response is not None:
+                    return response
+        return response_for_exception(request, exception)
+
+    def process_response(self, request, response):
+        if hasattr(response, 'render') and callable(response.render):
+            response = response.render()
+        for middleware in reversed(self.middleware):
+            if hasattr(middleware, 'process_response'):
+                response = middleware.process_response(request, response)
+        return response
+
+    async def send_response(self, response, send):
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': _response_headers(response),
+        })
+        try:
+            if response.streaming:
+                await self.send_chunks(response, send)
+            else:
+                await send({
+                    'type': 'http.response.body', 'body': response.content})
+        finally:
+            await run_in_pool(None, response.close)
+
+    async def send_chunks(self, iterable, send):
+        """
+        Sends the chunks of a streamed body, producing each one on the thread
+        pool since producing it may query the database.
+        """
+        chunks = iter(iterable)
+        while True:
+            chunk = await run_in_pool(None, next, chunks, None)
+            if chunk is None:
+                break
+            await send({
+                'type': 'http.response.body', 'body': chunk,
+                'more_body': True})
+        await send({'type': 'http.response.body'})
+
+    async def handle_wsgi(self, environ, send):
+        """
+        Serves the request with the WSGI handler, including all middleware,
+        on the thread pool.
+        """
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [
+                (name.encode('latin1'), value.encode('latin1'))
+                for name, value in headers]
+
+        output = await run_in_pool(
+            None, self.wsgi_handler, environ, start_response)
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': started['status'],
+                'headers': started['headers'],
+            })
+            await self.send_chunks(output, send)
+        finally:
+            if hasattr(output, 'close'):
+                await run_in_pool(None, output.close)
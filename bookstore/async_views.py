@@ -0,0 +1,72 @@
+"""
+Async variants of the listing and CRUD views, served by bookstore.asgi.
+
+Each variant awaits the blocking work of its view on the thread pool of
+bookstore.asgi and runs independent queries concurrently. VIEWS maps the URL
+names of bookstore.urls to their async variants.
+"""
+import asyncio
+import functools
+
+from django.shortcuts import render
+
+from bookstore import forms, queries, views
+from bookstore.asgi import run_in_pool
+
+
+def pooled(view):
+    """
+    Returns an async variant of `view` that runs the whole view on the
+    thread pool.
+    """
+    @functools.wraps(view)
+    async def async_view(request, *args, **kwargs):
+        return await run_in_pool(request, view, request, *args, **kwargs)
+    return async_view
+
+
+async def category_create(request):
+    if 'name' in request.POST:
+        return await run_in_pool(request, views.category_create, request)
+
+    context = {
+        'category_form': forms.CategoryForm(),
+        'category_listing': await run_in_pool(
+            request, views._cached_listing, request, 'category-listing.html',
+            queries.category_listing(), 'categories')
+    }
+    return await run_in_pool(
+        request, render, request, 'category-create.html', context)
+
+
+async def book_create(request):
+    if request.POST:
+        return await run_in_pool(request, views.book_create, request)
+
+    # the category choices of the form and the listing are independent
+    book_form, book_listing = await asyncio.gather(
+        run_in_pool(request, forms.BookForm),
+        run_in_pool(
+            request, views._cached_listing, request, 'book-listing.html',
+            queries.book_listing(), 'books'))
+    context = {
+        'book_form': book_form,
+        'book_listing': book_listing
+    }
+    return await run_in_pool(
+        request, render, request, 'book-create.html', context)
+
+
+category_edit = pooled(views.category_edit)
+category_delete = pooled(views.category_delete)
+book_edit = pooled(views.book_edit)
+book_delete = pooled(views.book_delete)
+
+VIEWS = {
+    'category-create': category_create,
+    'category-edit': category_edit,
+    'category-delete': category_delete,
+    'book-create': book_create,
+    'book-edit': book_edit,
+    'book-delete': book_delete,
+}
@@ -0,0 +1,326 @@
+"""
+Batch creation, editing and deletion of Books and Categories.
+
+A batch is a list of operations such as
+
+    {"action": "create", "model": "category", "data": {"name": "Poetry"}}
+    {"action": "update", "model": "book", "id": 7, "data": {"category": 3}}
+    {"action": "delete", "model": "book", "id": 9}
+
+Every operation is validated before anything is written, with the fields of
+CategoryForm and BookForm and with one query per model (and per 500 ids) to
+check that the objects they name exist. The batch is then applied, in the
+transaction of the validation, with bulk inserts, one UPDATE per group of rows changing the same
+fields, and set-based deletes, in this order: categories are created and
+renamed, books are created, edited and deleted, and categories are deleted
+together with their remaining books. Books can therefore be moved out of a
+category deleted in the same batch, but only into categories that exist
+before it. Every change is recorded in the change feed (bookstore.changes).
+"""
+from collections import Counter, defaultdict
+
+from django.core.exceptions import ValidationError
+from django.db import connections, router, transaction
+from django.db.models import Case, Max, Value, When
+
+from bookstore import (
+    cache, changes, counters, deletion, forms, models, queries)
+
+ACTIONS = ('create', 'update', 'delete')
+STATUSES = {'create': 'created', 'update': 'updated', 'delete': 'deleted'}
+MODELS = {'book': models.Book, 'category': models.Category}
+MAX_OPERATIONS = 10000
+# rows per UPDATE statement; each row adds up to five query parameters, which
+# keeps every statement below the SQLite limit
+UPDATE_BATCH_SIZE = 100
+
+
+class BatchError(Exception):
+    """
+    Raised when operations of a batch are invalid; `errors` lists the index
+    and the field errors of each invalid operation.
+    """
+
+    def __init__(self, errors):
+        super(BatchError, self).__init__(
+            '{0} invalid operations'.format(len(errors)))
+        self.errors = errors
+
+
+def _existing(queryset, ids):
+    """
+    Returns a dict of the rows of `queryset`, a values_list() starting with
+    the id, whose ids are in `ids`, keyed by id.
+    """
+    rows = {}
+    for chunk in queries.chunks(ids, queries.LOOKUP_BATCH_SIZE):
+        for row in queryset.filter(pk__in=chunk):
+            rows[row[0]] = row
+    return rows
+
+
+def _does_not_exist(model, pk):
+    return {'__all__': ['{0} of id {1} does not exist!'.format(
+        model.__name__, pk)]}
+
+
+def _clean(fields, data, names, partial, values):
+    """
+    Cleans the values of the form fields `names` in `data`, skipping the
+    missing ones when `partial`, into `values` and returns their errors.
+    """
+    errors = {}
+    for name in names:
+        if partial and name not in data:
+            continue
+        try:
+            values[name] = fields[name].clean(data.get(name))
+        except ValidationError as error:
+            errors[name] = error.messages
+    return errors
+
+
+def _clean_category_id(field, value, available):
+    """
+    Validates a category id like the category field of BookForm does, but
+    against the ids in `available` rather than with a query per value.
+    """
+    if value in field.empty_values:
+        raise ValidationError(field.error_messages['required'])
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        value = None
+    if value not in available:
+        raise ValidationError(field.error_messages['invalid_choice'])
+    return value
+
+
+def _structure_errors(operation):
+    """
+    Returns the errors in the shape of an operation, if any.
+    """
+    if not isinstance(operation, dict):
+        return {'__all__': ['Expected an object.']}
+    errors = {}
+    if operation.get('action') not in ACTIONS:
+        errors['action'] = ['Expected one of: {0}.'.format(', '.join(ACTIONS))]
+    if operation.get('model') not in MODELS:
+        errors['model'] = ['Expected one of: {0}.'.format(
+            ', '.join(sorted(MODELS)))]
+    if operation.get('action') in ('update', 'delete') and not isinstance(
+            operation.get('id'), int):
+        errors['id'] = ['Expected an integer id.']
+    if operation.get('action') in ('create', 'update') and not isinstance(
+            operation.get('data'), dict):
+        errors['data'] = ['Expected an object.']
+    return errors
+
+
+def validate(operations):
+    """
+    Validates a list of operations and returns the changes to apply. Raises
+    BatchError if any operation is invalid.
+    """
+    if not isinstance(operations, list):
+        raise BatchError([{'index': None, 'errors': {
+            '__all__': ['Expected a list of operations.']}}])
+    if len(operations) > MAX_OPERATIONS:
+        raise BatchError([{'index': None, 'errors': {'__all__': [
+            'A batch holds at most {0} operations.'.format(
+                MAX_OPERATIONS)]}}])
+
+    errors = {}
+    targets = defaultdict(Counter)
+    for index, operation in enumerate(operations):
+        errors[index] = _structure_errors(operation)
+        if not errors[index] and operation['action'] != 'create':
+            targets[operation['model']][operation['id']] += 1
+
+    category_ids = set(targets['category'])
+    for index, operation in enumerate(operations):
+        if not errors[index] and operation['model'] == 'book' and (
+                operation['action'] != 'delete'):
+            try:
+                category_ids.add(int(operation['data']['category']))
+            except (KeyError, TypeError, ValueError):
+                pass
+    books = _existing(
+        models.Book.objects.values_list('id', 'category_id'),
+        targets['book'])
+    categories = set(_existing(
+        models.Category.objects.values_list('id'), category_ids))
+    # books cannot be added to the categories deleted by the batch
+    available = categories - {
+        operation['id'] for index, operation in enumerate(operations)
+        if not errors[index] and operation['model'] == 'category' and
+        operation['action'] == 'delete'}
+
+    category_fields = forms.CategoryForm().fields
+    book_fields = forms.BookForm().fields
+    changes = []
+    for index, operation in enumerate(operations):
+        if errors[index]:
+            continue
+        action, model = operation['action'], operation['model']
+        pk = operation['id'] if action != 'create' else None
+        if pk is not None and targets[model][pk] > 1:
+            errors[index] = {'id': [
+                '{0} of id {1} appears in more than one operation.'.format(
+                    MODELS[model].__name__, pk)]}
+            continue
+        if pk is not None and pk not in (
+                books if model == 'book' else categories):
+            errors[index] = _does_not_exist(MODELS[model], pk)
+            continue
+        if action == 'delete':
+            changes.append((action, model, pk, {}))
+            continue
+
+        partial = action == 'update'
+        data = operation['data']
+        values = {}
+        if model == 'category':
+            errors[index] = _clean(
+                category_fields, data, ['name'], partial, values)
+        else:
+            errors[index] = _clean(
+                book_fields, data, ['title'], partial, values)
+            if not partial or 'category' in data:
+                try:
+                    values['category_id'] = _clean_category_id(
+                        book_fields['category'], data.get('category'),
+                        available)
+                except ValidationError as error:
+                    errors[index]['category'] = error.messages
+        if not values and not errors[index]:
+            errors[index]['__all__'] = ['Nothing to update.']
+        changes.append((action, model, pk, values))
+
+    invalid = [
+        {'index': index, 'errors': errors[index]}
+        for index in range(len(operations)) if errors[index]]
+    if invalid:
+        raise BatchError(invalid)
+    return changes, books
+
+
+def bulk_insert(model, objs):
+    """
+    Inserts `objs` and sets their primary keys, with bulk inserts on the
+    databases that return the new ids or number them predictably, and with
+    one INSERT per object on the others. No change is recorded.
+    """
+    if not objs:
+        return
+    using = router.db_for_write(model)
+    connection = connections[using]
+    if connection.features.can_return_ids_from_bulk_insert:
+        model.objects.using(using).bulk_create(objs)
+    elif connection.vendor == 'sqlite':
+        model.objects.using(using).bulk_create(objs)
+        # SQLite numbers the rows of an AUTOINCREMENT table consecutively and
+        # the transaction holds the write lock since its first insert
+        last = model.objects.using(using).aggregate(last=Max('pk'))['last']
+        for pk, obj in enumerate(objs, last - len(objs) + 1):
+            obj.pk = pk
+    else:
+        for obj in objs:
+            # a raw save is not recorded by the receivers of bookstore.signals
+            obj.save_base(using=using, raw=True, force_insert=True)
+
+
+def _update(model, rows):
+    """
+    Applies a dict of primary keys to dicts of field values, with one UPDATE
+    per group of up to UPDATE_BATCH_SIZE rows that change the same fields.
+    """
+    groups = defaultdict(list)
+    for pk, values in rows.items():
+        groups[tuple(sorted(values))].append(pk)
+    for names, pks in groups.items():
+        for chunk in queries.chunks(sorted(pks), UPDATE_BATCH_SIZE):
+            assignments = {}
+            for name in names:
+                field = model._meta.get_field(name)
+                distinct = {rows[pk][name] for pk in chunk}
+                if len(distinct) == 1:
+                    assignments[name] = distinct.pop()
+                else:
+                    assignments[name] = Case(
+                        *[When(pk=pk, then=Value(rows[pk][name]))
+                          for pk in chunk],
+                        output_field=field)
+            model.objects.filter(pk__in=chunk).update(**assignments)
+
+
+def apply(operations):
+    """
+    Validates and applies a batch of operations in one transaction and
+    returns a result for each operation, in order. Raises BatchError, before
+    anything is written, if any operation is invalid.
+
+    The validation reads the objects and categories in the transaction of
+    the writes. With inventory.backends.sqlite3 that transaction holds the
+    write lock from its start, so no concurrent write can make the counter
+    deltas stale or delete a category that the batch inserts books into.
+    """
+    with transaction.atomic(using=router.db_for_write(models.Book)):
+        planned, books = validate(operations)
+        by_kind = defaultdict(list)
+        for position, (action, model, pk, values) in enumerate(planned):
+            by_kind[action, model].append((position, pk, values))
+        results = [
+            {'id': pk, 'status': STATUSES[action]}
+            for action, model, pk, values in planned]
+        deltas = Counter()
+
+        new_categories = [
+            models.Category(name=values['name'])
+            for position, pk, values in by_kind['create', 'category']]
+        bulk_insert(models.Category, new_categories)
+        changes.record(new_categories, 'create')
+        category_updates = {
+            pk: values for position, pk, values in by_kind[
+                'update', 'category']}
+        _update(models.Category, category_updates)
+        changes.record_ids(models.Category, 'update', category_updates)
+
+        new_books = [
+            models.Book(
+                title=values['title'], category_id=values['category_id'])
+            for position, pk, values in by_kind['create', 'book']]
+        bulk_insert(models.Book, new_books)
+        changes.record(new_books, 'create')
+        deltas.update(counters.count_books(new_books))
+
+        book_updates = {}
+        for position, pk, values in by_kind['update', 'book']:
+            book_updates[pk] = values
+            if values.get('category_id', books[pk][1]) != books[pk][1]:
+                deltas[books[pk][1]] -= 1
+                deltas[values['category_id']] += 1
+        _update(models.Book, book_updates)
+        changes.record_ids(models.Book, 'update', book_updates)
+
+        deleted_books = [pk for position, pk, values in by_kind[
+            'delete', 'book']]
+        deletion.delete_ids(models.Book, deleted_books)
+        deltas.subtract(Counter(books[pk][1] for pk in deleted_books))
+        counters.adjust_many(deltas)
+
+        deleted_categories = [pk for position, pk, values in by_kind[
+            'delete', 'category']]
+        for pk in deleted_categories:
+            deletion.delete_books(pk)
+        deletion.delete_ids(models.Category, deleted_categories)
+
+        for created, kind in ((new_categories, ('create', 'category')),
+                              (new_books, ('create', 'book'))):
+            for obj, (position, pk, values) in zip(created, by_kind[kind]):
+                results[position]['id'] = obj.pk
+
+        # bulk writes send no model signals
+        if planned:
+            cache.invalidate(cache.invalidate_catalogue)
+    return results
@@ -0,0 +1,344 @@
+"""
+Caching of data that the bookstore pages read often but that changes rarely.
+
+Every cached value is stored under the current generation of the catalogue,
+which is read from the database: the sequence number and time of the latest
+entry of the change feed (see bookstore.changes). Every write to a Book or
+Category appends to the feed in its own transaction, so the generation moves
+for every process the moment the write commits, whichever process made it,
+and stale entries are never read again. Values are kept in a process-local
+LRU, bounded by the BOOKSTORE_LOCAL_CACHE_ENTRIES and
+BOOKSTORE_LOCAL_CACHE_BYTES settings, in front of the CACHES backend named by
+BOOKSTORE_CACHE_ALIAS, when there is one.
+
+Reading the generation costs one indexed query per request, or per cached
+read outside of requests. With
+BOOKSTORE_GENERATION_TTL set, a process reuses the generation it read for
+that many seconds instead, and may serve pages that old after the writes of
+other processes; its own writes are seen at once.
+
+Concurrent misses of the same value in a process are computed once, the
+other requests waiting for the result (see bookstore.admission). Values
+computed inside replica_reads() read a read replica only once it has
+replayed the generation they are cached under (see bookstore.routers).
+"""
+import collections
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router, transaction
+from django.http import HttpResponse
+
+from bookstore import admission, models, routers
+
+CATEGORY_CHOICES_KEY = 'bookstore:category-choices'
+FRAGMENT_KEY = 'bookstore:fragment:{0}'
+RESPONSE_KEY = 'bookstore:response:{0}'
+
+DEFAULT_LOCAL_ENTRIES = 1000
+DEFAULT_LOCAL_BYTES = 32 * 1024 * 1024
+
+_lock = threading.Lock()
+# the generation last read by this process, when BOOKSTORE_GENERATION_TTL
+# lets it reuse that: (generation, last modified, time read)
+_local_generation = []
+# the generation read by the request that the current thread is handling
+_request = threading.local()
+
+
+def _size(value):
+    """
+    Estimates the memory used by a cached value, counting the characters of
+    strings and the bytes of byte strings, which dominate the cached values.
+    """
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return 64 + sum(_size(item) for item in value)
+    return 64
+
+
+class LRUCache(object):
+    """
+    A thread-safe least recently used cache bounded both by its number of
+    entries and by the estimated size of its values.
+    """
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, size = self._entries.pop(key)
+            except KeyError:
+                return default
+            self._entries[key] = (value, size)
+            return value
+
+    def set(self, key, value):
+        size = _size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while (len(self._entries) > self.max_entries or
+                   self.bytes > self.max_bytes):
+                self.bytes -= self._entries.popitem(last=False)[1][1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+
+_local_values = LRUCache(
+    getattr(settings, 'BOOKSTORE_LOCAL_CACHE_ENTRIES', DEFAULT_LOCAL_ENTRIES),
+    getattr(settings, 'BOOKSTORE_LOCAL_CACHE_BYTES', DEFAULT_LOCAL_BYTES))
+
+
+def _shared_cache():
+    """
+    Returns the shared cache backend, or None when only the process-local
+    cache is used.
+    """
+    alias = getattr(settings, 'BOOKSTORE_CACHE_ALIAS', None)
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def read_generation(using=None):
+    """
+    Reads the generation of the catalogue and when it last changed from the
+    database `using`, by default the one that the Change feed is read from.
+    Returns (None, None) while the feed is empty: rows written without it,
+    e.g. by raw SQL, have no generation to be cached under.
+    """
+    using = using or router.db_for_read(models.Change)
+    head = models.Change.objects.using(using).order_by('-seq').values_list(
+        'seq', 'created').first()
+    if head is None:
+        return None, None
+    seq, created = head
+    # the time tells apart the changes that reuse the number of a change
+    # rolled back earlier
+    return '{0}.{1}'.format(
+        seq, int(created.timestamp() * 1000000)), created
+
+
+def start_request(**kwargs):
+    """
+    Lets the request that the current thread starts to handle read the
+    generation once, for all its cached reads.
+    """
+    _request.active = True
+    _request.generation = None
+
+
+def finish_request(**kwargs):
+    _request.active = False
+    _request.generation = None
+
+
+def generation(fresh=False):
+    """
+    Returns the current generation of the catalogue and when it last
+    changed, as read by the current request, or reusing the generation read
+    within the last BOOKSTORE_GENERATION_TTL seconds when that setting allows
+    it. With `fresh` the generation is read from the database, and the rest
+    of the request uses it too.
+    """
+    current = getattr(_request, 'generation', None)
+    if current is not None and not fresh:
+        return current
+    ttl = getattr(settings, 'BOOKSTORE_GENERATION_TTL', 0)
+    if ttl and not fresh:
+        with _lock:
+            if _local_generation and (
+                    time.time() - _local_generation[2] < ttl):
+                return _local_generation[0], _local_generation[1]
+    version, modified = read_generation()
+    if ttl:
+        with _lock:
+            _local_generation[:] = [version, modified, time.time()]
+    if getattr(_request, 'active', False):
+        _request.generation = (version, modified)
+    return version, modified
+
+
+def _label(key):
+    """Returns the kind of value stored under `key`, e.g. `fragment`."""
+    return key.split(':')[1]
+
+
+def get_or_compute(key, compute):
+    """
+    Returns the value stored under `key` for the current generation of the
+    catalogue, calling `compute` to build (and cache) it on a miss.
+    """
+    version = catalogue_version()
+    if version is None:
+        return compute()
+    local_key = (key, version)
+    value = _local_values.get(local_key)
+    if value is not None:
+        return value
+
+    def load():
+        shared = _shared_cache()
+        value = None
+        if shared is not None:
+            value = shared.get(key, version=version)
+        if value is None:
+            value = compute()
+            if shared is not None:
+                shared.set(key, value, None, version=version)
+        # entries of older generations are never read again and age out of
+        # the LRU
+        _local_values.set(local_key, value)
+        return value
+
+    return admission.coalesce(local_key, load, _label(key))
+
+
+@contextmanager
+def replica_reads():
+    """
+    Sends the Book and Category reads of the block to a read replica when
+    the current request may read one and the replica has replayed the
+    current generation of the catalogue, and to the primary otherwise, so
+    that the values computed from them are cached under the generation of
+    the data they read.
+    """
+    alias = routers.choose_replica()
+    if alias is not None and read_generation(alias)[0] != catalogue_version():
+        alias = None
+    with routers.catalogue_reads(alias):
+        yield
+
+
+def invalidate(func):
+    """
+    Calls the invalidation function `func` now and again once the current
+    transaction commits. The second call discards anything that was cached
+    from the old data between the write and the commit.
+    """
+    func()
+    transaction.on_commit(func)
+
+
+def category_choices():
+    """
+    Returns the (id, name) pairs of every Category, ordered by id, as used
+    for the category choices of BookForm.
+    """
+    def load():
+        with replica_reads():
+            return list(models.Category.objects.order_by('id').values_list(
+                'id', 'name'))
+
+    return get_or_compute(CATEGORY_CHOICES_KEY, load)
+
+
+def catalogue_version():
+    """
+    Returns a version that changes whenever any Book or Category changes,
+    or None when nothing has been recorded in the change feed yet.
+    """
+    return generation()[0]
+
+
+def catalogue_last_modified():
+    """
+    Returns when any Book or Category last changed, or None when nothing
+    has changed yet.
+    """
+    return generation()[1]
+
+
+def invalidate_catalogue():
+    """
+    Makes this process read the generation of the catalogue again on its
+    next cached read, so that it sees its own writes at once, also later in
+    the same request and when BOOKSTORE_GENERATION_TTL lets it reuse the
+    generation.
+    """
+    _request.generation = None
+    with _lock:
+        del _local_generation[:]
+
+
+def fragment(name, compute):
+    """
+    Returns the rendered fragment `name` (which must identify everything the
+    fragment depends on besides the catalogue), rendering it with `compute`
+    only when the catalogue changed since it was last rendered.
+    """
+    return get_or_compute(FRAGMENT_KEY.format(name), compute)
+
+
+def cached_get(view):
+    """
+    Caches the successful GET responses of `view` per URL until the
+    catalogue changes.
+
+    Responses that use the CSRF token, set cookies or are streamed are
+    specific to a client (or too large) and are never cached or shared.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return view(request, *args, **kwargs)
+        key = RESPONSE_KEY.format(request.get_full_path())
+        version = catalogue_version()
+        if version is None:
+            return view(request, *args, **kwargs)
+        cached = _local_values.get((key, version))
+        shared = _shared_cache()
+        if cached is None and shared is not None:
+            cached = shared.get(key, version=version)
+        if cached is not None:
+            status, content_type, content = cached
+            return HttpResponse(
+                content, status=status, content_type=content_type)
+
+        responses = []
+
+        def respond():
+            response = view(request, *args, **kwargs)
+            responses.append(response)
+            if (response.status_code != 200 or response.streaming or
+                    response.cookies or
+                    request.META.get('CSRF_COOKIE_USED')):
+                return None
+            cached = (200, response['Content-Type'], response.content)
+            _local_values.set((key, version), cached)
+            if shared is not None:
+                shared.set(key, cached, None, version=version)
+            return cached
+
+        # concurrent requests for the URL share the response of the first
+        cached = admission.coalesce((key, version), respond, 'response')
+        if responses:
+            return responses[0]
+        if cached is None:
+            # the response of the first request was specific to its client
+            return view(request, *args, **kwargs)
+        status, content_type, content = cached
+        return HttpResponse(content, status=status, content_type=content_type)
+    return wrapper
@@ -0,0 +1,200 @@
+"""
+The change feed of Books and Categories.
+
+Every create, edit and delete of a Book or Category appends a Change with
+the next sequence number, in the transaction that makes it: single saves and
+deletes through the receivers in bookstore.signals, and the bulk writes of
+bookstore.importer, bookstore.batch and bookstore.deletion, which send no
+model signals, by calling record() or record_ids() themselves. The
+denormalized Category.book_count is not part of the recorded data, but
+counters.recount() records the categories whose count it corrects. The head
+of the feed is also the generation of the bookstore caches (see
+bookstore.cache).
+
+Consumers read the feed from the last sequence number they have seen with
+since(), in time proportional to the number of changes rather than to the
+size of the catalogue, and can wait for new changes with wait(). Changes
+commit in sequence order, so a consumer never skips one that commits late:
+writes to SQLite are serialized, and on other databases every transaction
+that appends changes first locks the FeedLock row until it ends.
+
+compact() drops the changes superseded by a later change of the same object,
+so a consumer that replays the compacted feed from the start still ends up
+with the current catalogue, deletions included.
+"""
+import json
+import threading
+import time
+
+from django.db import connections, router, transaction
+from django.db.models import Max
+
+from bookstore import models, queries
+
+# the fields of each model recorded in the feed
+FIELDS = {
+    models.Book: ('title', 'category_id'),
+    models.Category: ('name',),
+}
+MODEL_NAMES = {models.Book: 'book', models.Category: 'category'}
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+# the longest a consumer may wait for new changes, and how often a waiting
+# consumer checks for changes committed by other processes
+MAX_WAIT = 30.0
+POLL_INTERVAL = 1.0
+
+# the primary key of the FeedLock row
+LOCK_ID = 1
+
+_committed = threading.Condition()
+
+
+def _notify():
+    """Wakes the consumers waiting in this process for new changes."""
+    with _committed:
+        _committed.notify_all()
+
+
+def _data(model, values):
+    return json.dumps(
+        dict(zip(FIELDS[model], values)), separators=(',', ':'))
+
+
+def _lock_feed(using):
+    """
+    Locks the feed of the database `using` until the current transaction
+    ends, so that no other transaction takes sequence numbers after the ones
+    of this one and commits first. SQLite runs one writer at a time and
+    needs no lock.
+    """
+    if not connections[using].features.has_select_for_update:
+        return
+    lock = models.FeedLock.objects.using(using).select_for_update().filter(
+        pk=LOCK_ID)
+    if not lock.exists():
+        # e.g. after the tables were flushed
+        models.FeedLock.objects.using(using).get_or_create(pk=LOCK_ID)
+        lock.exists()
+
+
+def _append(model, changes):
+    """
+    Inserts `changes`, a list of Change instances of `model` objects, in the
+    current transaction and wakes the waiting consumers once it commits.
+    """
+    if not changes:
+        return
+    using = router.db_for_write(model)
+    _lock_feed(using)
+    models.Change.objects.using(using).bulk_create(changes)
+    transaction.on_commit(_notify, using=using)
+
+
+def record(instances, action):
+    """
+    Appends an `action` Change for each of `instances`, saved Books or
+    Categories of the same model, with their current field values.
+    """
+    if not instances:
+        return
+    model = type(instances[0])
+    fields = FIELDS[model]
+    _append(model, [
+        models.Change(
+            model=MODEL_NAMES[model], object_id=instance.pk, action=action,
+            data=None if action == 'delete' else _data(
+                model, [getattr(instance, field) for field in fields]))
+        for instance in instances
+    ])
+
+
+def record_ids(model, action, ids):
+    """
+    Appends an `action` Change for each `model` object with one of the
+    primary keys `ids`, reading the field values of created and edited
+    objects from the database.
+    """
+    ids = list(ids)
+    if action == 'delete':
+        _append(model, [
+            models.Change(model=MODEL_NAMES[model], object_id=pk,
+                          action=action)
+            for pk in ids])
+        return
+    using = router.db_for_write(model)
+    for chunk in queries.chunks(ids, queries.LOOKUP_BATCH_SIZE):
+        rows = model.objects.using(using).filter(pk__in=chunk).order_by(
+            'pk').values_list('pk', *FIELDS[model])
+        _append(model, [
+            models.Change(
+                model=MODEL_NAMES[model], object_id=row[0], action=action,
+                data=_data(model, row[1:]))
+            for row in rows
+        ])
+
+
+def head():
+    """
+    Returns the sequence number of the latest change, 0 for an empty feed.
+    """
+    return models.Change.objects.aggregate(
+        head=Max('seq'))['head'] or 0
+
+
+def since(seq, limit=DEFAULT_LIMIT):
+    """
+    Returns up to `limit` changes after the sequence number `seq`, in order,
+    as dicts ready to be serialized.
+    """
+    rows = models.Change.objects.filter(seq__gt=seq).order_by(
+        'seq').values_list('seq', 'model', 'object_id', 'action', 'data')
+    return [
+        {
+            'seq': row[0],
+            'model': row[1],
+            'id': row[2],
+            'action': row[3],
+            'data': None if row[4] is None else json.loads(row[4]),
+        }
+        for row in rows[:limit]
+    ]
+
+
+def wait(seq, limit=DEFAULT_LIMIT, timeout=MAX_WAIT):
+    """
+    Returns the changes after `seq` like since(), waiting up to `timeout`
+    seconds for one to be committed when there are none yet. Changes
+    committed in this process wake the consumer at once; those of other
+    processes are noticed within POLL_INTERVAL seconds.
+    """
+    deadline = time.time() + min(timeout, MAX_WAIT)
+    while True:
+        changes = since(seq, limit)
+        remaining = deadline - time.time()
+        if changes or remaining <= 0:
+            return changes
+        with _committed:
+            _committed.wait(min(remaining, POLL_INTERVAL))
+
+
+def compact(until=None):
+    """
+    Deletes every change up to the sequence number `until` (by default the
+    whole feed) that is superseded by a later change of the same object,
+    and returns the number of changes deleted.
+    """
+    changes = models.Change.objects.all()
+    if until is not None:
+        changes = changes.filter(seq__lte=until)
+    latest = changes.values('model', 'object_id').annotate(
+        latest=Max('seq')).values('latest')
+    # read first: MySQL rejects a DELETE with a subquery on its own table
+    superseded = list(
+        changes.exclude(seq__in=latest).values_list('seq', flat=True))
+    deleted = 0
+    for chunk in queries.chunks(superseded, queries.LOOKUP_BATCH_SIZE):
+        # Change has no signal receivers, so this is a single DELETE
+        count, _ = models.Change.objects.filter(seq__in=chunk).delete()
+        deleted += count
+    return deleted
@@ -0,0 +1,93 @@
+"""
+Maintenance of the denormalized Category.book_count counters.
+
+Every code path that adds, moves or removes Books updates the counters of the
+affected Categories with F() expressions, inside the transaction that makes
+the change, so that reading the number of books in a category never needs a
+COUNT(*) over the Book table. recount() rebuilds the counters from scratch.
+"""
+from collections import Counter, defaultdict
+
+from django.db import connections, router, transaction
+from django.db.models import F
+
+from bookstore import cache, changes, models, queries
+
+
+def adjust(category_id, delta):
+    """
+    Adds `delta` (which may be negative) to the book count of a Category.
+    """
+    if delta:
+        models.Category.objects.filter(pk=category_id).update(
+            book_count=F('book_count') + delta)
+
+
+def adjust_many(deltas):
+    """
+    Applies a mapping of Category ids to book count deltas, with one UPDATE
+    per distinct delta rather than one per Category.
+    """
+    by_delta = defaultdict(list)
+    for category_id, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(category_id)
+    for delta, category_ids in by_delta.items():
+        for chunk in queries.chunks(category_ids, queries.LOOKUP_BATCH_SIZE):
+            models.Category.objects.filter(pk__in=chunk).update(
+                book_count=F('book_count') + delta)
+
+
+def count_books(books):
+    """
+    Returns a Counter of the number of `books` in each Category id.
+    """
+    return Counter(book.category_id for book in books)
+
+
+def recount(category_ids=None):
+    """
+    Recomputes the book counts of the Categories `category_ids`, by default
+    of every Category, with set-based statements. The Categories whose count
+    was wrong are recorded as updated in the change feed, which moves the
+    generation of the cached pages that show the counts.
+    """
+    category = models.Category._meta
+    book = models.Book._meta
+    names = {
+        'category': category.db_table,
+        'count': category.get_field('book_count').column,
+        'book': book.db_table,
+        'fk': book.get_field('category').column,
+        'pk': category.pk.column,
+    }
+    counted = (
+        '(SELECT COUNT(*) FROM {book} WHERE {book}.{fk} = {category}.{pk})'
+    ).format(**names)
+    wrong = 'SELECT {pk} FROM {category} WHERE {count} <> {counted}'.format(
+        counted=counted, **names)
+    update = 'UPDATE {category} SET {count} = {counted} WHERE {pk} IN '.format(
+        counted=counted, **names)
+    using = router.db_for_write(models.Category)
+    connection = connections[using]
+
+    def placeholders(chunk):
+        return '({0})'.format(', '.join(['%s'] * len(chunk)))
+
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        if category_ids is None:
+            cursor.execute(wrong)
+            changed = [row[0] for row in cursor.fetchall()]
+        else:
+            changed = []
+            for chunk in queries.chunks(
+                    category_ids, queries.LOOKUP_BATCH_SIZE):
+                cursor.execute('{0} AND {1} IN {2}'.format(
+                    wrong, names['pk'], placeholders(chunk)), chunk)
+                changed.extend(row[0] for row in cursor.fetchall())
+        for chunk in queries.chunks(changed, queries.LOOKUP_BATCH_SIZE):
+            cursor.execute(update + placeholders(chunk), chunk)
+        changes.record_ids(models.Category, 'update', changed)
+    if changed:
+        cache.invalidate(cache.invalidate_catalogue)
+    return len(changed)
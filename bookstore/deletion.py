@@ -0,0 +1,115 @@
+"""
+Fast deletion of Categories and their Books.
+
+Category.delete() cascades to Book through Django's collector, which loads
+every Book of the category into memory first. The functions here delete the
+books with set-based SQL instead, a bounded batch of ids at a time, and then
+delete the (by then childless) Category through the ORM so that its signals
+still fire.
+"""
+from django.conf import settings
+from django.db import connections, router, transaction
+
+from bookstore import cache, changes, counters, jobs, models, queries
+
+# the number of books removed per DELETE statement
+DEFAULT_BATCH_SIZE = queries.LOOKUP_BATCH_SIZE
+# categories with more books than this are deleted in the background unless
+# the BOOKSTORE_DEFERRED_DELETE_THRESHOLD setting says otherwise
+DEFAULT_DEFERRED_THRESHOLD = 10000
+
+
+def delete_ids(model, ids, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Deletes the rows of `model` with the primary keys `ids` with set-based
+    DELETE statements of `batch_size` ids, without loading them or sending
+    model signals, and records the deletes in the change feed.
+    """
+    using = router.db_for_write(model)
+    connection = connections[using]
+    sql = 'DELETE FROM {0} WHERE {1} IN ({2})'
+    for chunk in queries.chunks(ids, batch_size):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                sql.format(
+                    connection.ops.quote_name(model._meta.db_table),
+                    connection.ops.quote_name(model._meta.pk.column),
+                    ', '.join(['%s'] * len(chunk))),
+                chunk
+            )
+        changes.record_ids(model, 'delete', chunk)
+
+
+def delete_books(category_id, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Deletes every Book of a Category without loading the books, `batch_size`
+    at a time, and returns the number of books deleted.
+    """
+    using = router.db_for_write(models.Book)
+    deleted = 0
+    books = models.Book.objects.using(using).filter(category_id=category_id)
+    while True:
+        ids = list(books.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        delete_ids(models.Book, ids, batch_size)
+        deleted += len(ids)
+
+
+def delete_category(category, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Deletes a Category and all of its Books in one transaction.
+    """
+    with transaction.atomic(using=router.db_for_write(models.Category)):
+        deleted = delete_books(category.pk, batch_size)
+        category.delete()
+    return deleted
+
+
+def delete_category_in_batches(category, batch_size=DEFAULT_BATCH_SIZE,
+                               progress=None):
+    """
+    Deletes a Category and all of its Books, committing every batch of
+    `batch_size` books on its own together with the book counter of the
+    category. `progress`, when given, is called with the number of books
+    deleted so far within the transaction of every batch; an exception it
+    raises rolls the batch back and leaves the category with its remaining
+    books. Returns the number of books deleted.
+    """
+    using = router.db_for_write(models.Book)
+    deleted = 0
+    books = models.Book.objects.using(using).filter(category_id=category.pk)
+    while True:
+        with transaction.atomic(using=using):
+            ids = list(books.values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            delete_ids(models.Book, ids, batch_size)
+            counters.adjust(category.pk, -len(ids))
+            # raw deletes send no model signals
+            cache.invalidate(cache.invalidate_catalogue)
+            deleted += len(ids)
+            if progress is not None:
+                progress(deleted)
+    category.delete()
+    return deleted
+
+
+def should_defer(category):
+    """
+    Checks whether a Category has too many books to be deleted within the
+    request.
+    """
+    threshold = getattr(
+        settings, 'BOOKSTORE_DEFERRED_DELETE_THRESHOLD',
+        DEFAULT_DEFERRED_THRESHOLD)
+    return threshold is not None and category.book_count > threshold
+
+
+def delete_category_deferred(category, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Queues the deletion of a Category and its Books as a background job (see
+    bookstore.jobs) and returns the Job without waiting for it.
+    """
+    return jobs.enqueue('delete_category', {
+        'category_id': category.pk, 'batch_size': batch_size})
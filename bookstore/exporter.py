@@ -0,0 +1,78 @@
+"""
+Streaming export of Books, joined with the names of their Categories, as CSV
+or JSON Lines.
+
+Books are read in primary key order one chunk at a time, so an export holds
+at most one chunk in memory and can start producing output immediately.
+The output columns (`id`, `title`, `category`) can be fed back to
+bookstore.importer.
+"""
+import csv
+import json
+
+from bookstore import models
+
+DEFAULT_CHUNK_SIZE = 2000
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+FIELDS = ('id', 'title', 'category')
+
+
+def iter_books(chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields an (id, title, category name) tuple for every Book, ordered by id.
+
+    Each chunk is fetched with a keyset (`id > last id`) query so the cost of
+    a chunk does not depend on how far into the table it is.
+    """
+    queryset = models.Book.objects.order_by('id').values_list(
+        'id', 'title', 'category__name')
+    last_id = None
+    while True:
+        chunk = queryset
+        if last_id is not None:
+            chunk = chunk.filter(id__gt=last_id)
+        rows = list(chunk[:chunk_size])
+        for row in rows:
+            yield row
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1][0]
+
+
+class _Echo(object):
+    """
+    A file-like object whose write() returns what it is given, letting
+    csv.writer produce lines one at a time.
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    """Yields the header and then one CSV line per row."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(FIELDS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def jsonl_lines(rows):
+    """Yields one JSON object per row, each on its own line."""
+    for row in rows:
+        yield json.dumps(dict(zip(FIELDS, row))) + '\n'
+
+
+def export_lines(fmt, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields the lines of an export of every Book in the given format.
+    """
+    if fmt == 'csv':
+        return csv_lines(iter_books(chunk_size))
+    if fmt == 'jsonl':
+        return jsonl_lines(iter_books(chunk_size))
+    raise ValueError('Unknown export format: {0}'.format(fmt))
@@ -1,6 +1,6 @@
-from django.forms import ModelForm
+from django.forms import ChoiceField, FileField, Form, ModelForm
 
-from bookstore import models
+from bookstore import cache, models
 
 
 class CategoryForm(ModelForm):
@@ -16,8 +16,34 @@ class CategoryForm(ModelForm):
 class BookForm(ModelForm):
     """
     The form that is used for creating Books.
+
+    The category choices are read from bookstore.cache rather than from the
+    Category table, so rendering the form does not query the database.
     """
 
     class Meta:
         model = models.Book
-        fields = ['category', 'title']
\ No newline at end of file
+        fields = ['category', 'title']
+
+    def __init__(self, *args, **kwargs):
+        super(BookForm, self).__init__(*args, **kwargs)
+        field = self.fields['category']
+        choices = list(cache.category_choices())
+        if field.empty_label is not None:
+            choices.insert(0, ('', field.empty_label))
+        field.choices = choices
+
+
+class ImportForm(Form):
+    """
+    The form that is used for uploading a CSV or JSON Lines file of Books.
+    """
+    file = FileField()
+    format = ChoiceField(
+        choices=[
+            ('', 'Guess from the file name'),
+            ('csv', 'CSV'),
+            ('jsonl', 'JSON Lines'),
+        ],
+        required=False
+    )
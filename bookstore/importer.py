@@ -0,0 +1,214 @@
+"""
+Bulk import of Books (and their Categories) from CSV or JSON Lines input.
+
+Rows are streamed through generators and written in fixed-size batches with
+bulk_create(), each batch in its own transaction together with its entries
+in the change feed, so importing a feed needs memory proportional to the
+batch size rather than to the size of the feed.
+"""
+import csv
+import json
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from bookstore import cache, changes, counters, jobs, models, queries
+from bookstore.batch import bulk_insert
+
+DEFAULT_BATCH_SIZE = 1000
+# uploads larger than this many bytes are imported by a background job unless
+# the BOOKSTORE_DEFERRED_IMPORT_SIZE setting says otherwise
+DEFAULT_DEFERRED_SIZE = 1024 * 1024
+FORMATS = ('csv', 'jsonl')
+
+TITLE_MAX_LENGTH = models.Book._meta.get_field('title').max_length
+NAME_MAX_LENGTH = models.Category._meta.get_field('name').max_length
+
+
+class ImportResult(object):
+    """
+    The outcome of an import: how many rows were read, imported and skipped,
+    how many categories were created and how long it took.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.skipped = 0
+        self.categories_created = 0
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self):
+        """The number of input rows processed per second."""
+        if not self.seconds:
+            return 0.0
+        return self.rows / self.seconds
+
+    def __str__(self):
+        return (
+            'Imported {0} books ({1} skipped) and created {2} categories in '
+            '{3:.2f}s ({4:.0f} rows/s)'.format(
+                self.imported, self.skipped, self.categories_created,
+                self.seconds, self.rows_per_second)
+        )
+
+
+def guess_format(filename):
+    """
+    Returns the input format implied by the extension of `filename`.
+    """
+    if filename.lower().endswith(('.jsonl', '.json', '.ndjson')):
+        return 'jsonl'
+    return 'csv'
+
+
+def read_rows(lines, fmt):
+    """
+    Yields a (title, category name) tuple for every record in `lines`, an
+    iterable of text lines in the given format.
+
+    CSV input must have a header row with `title` and `category` columns;
+    JSON Lines input must hold one object with those keys per line, and
+    raises ValueError at the first line that does not.
+    """
+    if fmt == 'csv':
+        for record in csv.DictReader(lines):
+            yield record.get('title'), record.get('category')
+    elif fmt == 'jsonl':
+        for number, line in enumerate(lines, 1):
+            if line.strip():
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError(
+                        'line {0}: expected an object'.format(number))
+                yield record.get('title'), record.get('category')
+    else:
+        raise ValueError('Unknown import format: {0}'.format(fmt))
+
+
+def batches(iterable, size):
+    """
+    Yields lists of at most `size` consecutive items of `iterable`.
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _valid(title, category):
+    """Checks that a row can be stored without violating the models."""
+    return (
+        isinstance(title, str) and isinstance(category, str) and
+        bool(title) and bool(category) and
+        len(title) <= TITLE_MAX_LENGTH and len(category) <= NAME_MAX_LENGTH
+    )
+
+
+def _map_categories(names, category_map):
+    """
+    Adds the ids of the existing categories named in `names` to
+    `category_map`.
+    """
+    for chunk in batches(names, queries.LOOKUP_BATCH_SIZE):
+        existing = models.Category.objects.filter(name__in=chunk)
+        for pk, name in existing.order_by('-id').values_list('id', 'name'):
+            category_map[name] = pk
+
+
+def _category_ids(names, category_map, result):
+    """
+    Adds the ids of the categories in `names` to `category_map`, creating
+    the categories that do not exist yet with a single bulk insert.
+    """
+    missing = set(names) - set(category_map)
+    if not missing:
+        return
+    # categories created since the map was loaded (e.g. by another import)
+    _map_categories(missing, category_map)
+    missing -= set(category_map)
+    if not missing:
+        return
+    models.Category.objects.bulk_create(
+        models.Category(name=name) for name in missing)
+    result.categories_created += len(missing)
+    _map_categories(missing, category_map)
+    changes.record_ids(
+        models.Category, 'create', [category_map[name] for name in missing])
+
+
+def import_books(rows, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Imports the (title, category name) tuples yielded by `rows`.
+
+    Category names are resolved to ids through an in-memory map; categories
+    that do not exist are created in bulk. Books are inserted `batch_size` at
+    a time, each batch in a transaction. Rows without a title or a category,
+    or with values too long for the models, are skipped. `progress`, when
+    given, is called with the ImportResult within the transaction of every
+    batch, so that what it records commits or rolls back with the batch.
+    """
+    result = ImportResult()
+    started = time.time()
+    # when a name is shared by several categories the oldest one wins
+    category_map = dict(
+        (name, pk) for pk, name in
+        models.Category.objects.order_by('-id').values_list('id', 'name')
+    )
+
+    for batch in batches(rows, batch_size):
+        result.rows += len(batch)
+        valid = [(title, name) for title, name in batch if _valid(title, name)]
+        result.skipped += len(batch) - len(valid)
+
+        with transaction.atomic():
+            _category_ids(
+                [name for _, name in valid], category_map, result)
+            books = [
+                models.Book(title=title, category_id=category_map[name])
+                for title, name in valid
+            ]
+            bulk_insert(models.Book, books)
+            changes.record(books, 'create')
+            counters.adjust_many(counters.count_books(books))
+            # bulk_create() does not send the signals that invalidate caches
+            cache.invalidate(cache.invalidate_catalogue)
+            result.imported += len(valid)
+            result.seconds = time.time() - started
+            if progress is not None:
+                progress(result)
+
+    result.seconds = time.time() - started
+    return result
+
+
+def should_defer(upload):
+    """
+    Checks whether an uploaded file is too large to be imported within the
+    request.
+    """
+    threshold = getattr(
+        settings, 'BOOKSTORE_DEFERRED_IMPORT_SIZE', DEFAULT_DEFERRED_SIZE)
+    return threshold is not None and upload.size > threshold
+
+
+def import_books_deferred(upload, fmt, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Saves an uploaded file among the files of the job queue and queues its
+    import as a background job (see bookstore.jobs). Returns the Job.
+    """
+    handle, path = tempfile.mkstemp(
+        prefix='import-', suffix='.' + fmt, dir=jobs.files_dir())
+    with os.fdopen(handle, 'wb') as spool:
+        for chunk in upload.chunks():
+            spool.write(chunk)
+    return jobs.enqueue('import_books', {
+        'input': path, 'format': fmt, 'batch_size': batch_size})
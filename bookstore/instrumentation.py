@@ -0,0 +1,273 @@
+"""
+Per-request query and timing instrumentation.
+
+bookstore.middleware.InstrumentationMiddleware starts a RequestStats for every
+request. While it is active:
+
+* every SQL statement runs through TimedCursorWrapper, which the middleware
+  installs on each database connection the way connection.execute_wrapper()
+  hooks work in later versions of Django, and which counts and times it;
+* every template rendered through the TimedDjangoTemplates backend (see
+  TEMPLATES in inventory/settings.py) is timed.
+
+Finished requests are added to `registry`, which keeps per-URL-name
+histograms and renders them for the /metrics endpoint in the Prometheus text
+format. Recording costs a couple of clock reads per statement, so the
+instrumentation can stay on under load.
+"""
+import bisect
+import heapq
+import threading
+import time
+
+from django.db.backends.utils import CursorWrapper
+from django.template.backends.django import DjangoTemplates
+
+# the number of slowest statements kept per request and per URL name
+SLOWEST_KEPT = 5
+# the upper bounds, in milliseconds, of the histogram buckets
+BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# SQL is truncated to this many characters in the slowest statement lists
+SQL_PREVIEW_LENGTH = 200
+
+_state = threading.local()
+
+
+class RequestStats(object):
+    """
+    The queries and timings recorded for one request.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.view_seconds = 0.0
+        self.total_seconds = 0.0
+        # a min-heap of (seconds, sql) holding the slowest statements
+        self.slowest = []
+
+    def add_query(self, sql, seconds):
+        self.queries += 1
+        self.sql_seconds += seconds
+        entry = (seconds, sql)
+        if len(self.slowest) < SLOWEST_KEPT:
+            heapq.heappush(self.slowest, entry)
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def server_timing(self):
+        """
+        Returns the value of the Server-Timing header for the request.
+        """
+        return ', '.join([
+            'sql;dur={0:.2f};desc="{1} queries"'.format(
+                self.sql_seconds * 1000, self.queries),
+            'tpl;dur={0:.2f}'.format(self.template_seconds * 1000),
+            'view;dur={0:.2f}'.format(self.view_seconds * 1000),
+            'total;dur={0:.2f}'.format(self.total_seconds * 1000),
+        ])
+
+
+def start_request():
+    """Starts recording for the current thread and returns the stats."""
+    _state.stats = RequestStats()
+    return _state.stats
+
+
+def finish_request():
+    """Stops recording for the current thread and returns the stats."""
+    stats = getattr(_state, 'stats', None)
+    _state.stats = None
+    if stats is not None:
+        stats.total_seconds = time.perf_counter() - stats.started
+    return stats
+
+
+def current_stats():
+    """Returns the stats being recorded on this thread, if any."""
+    return getattr(_state, 'stats', None)
+
+
+class TimedCursorWrapper(CursorWrapper):
+    """
+    Wraps a database cursor and records the time each statement takes in the
+    stats of the current request.
+    """
+
+    def _timed(self, method, sql, *args):
+        stats = current_stats()
+        if stats is None:
+            return method(sql, *args)
+        started = time.perf_counter()
+        try:
+            return method(sql, *args)
+        finally:
+            stats.add_query(sql, time.perf_counter() - started)
+
+    def execute(self, sql, params=None):
+        return self._timed(super(TimedCursorWrapper, self).execute,
+                           sql, params)
+
+    def executemany(self, sql, param_list):
+        return self._timed(super(TimedCursorWrapper, self).executemany,
+                           sql, param_list)
+
+
+def install(connection):
+    """
+    Makes every cursor of `connection` a TimedCursorWrapper. Connections are
+    per thread, so this is done once for each thread and alias.
+    """
+    if getattr(connection, 'bookstore_instrumented', False):
+        return
+    make_cursor = connection.make_cursor
+    make_debug_cursor = connection.make_debug_cursor
+    connection.make_cursor = lambda cursor: TimedCursorWrapper(
+        make_cursor(cursor), connection)
+    connection.make_debug_cursor = lambda cursor: TimedCursorWrapper(
+        make_debug_cursor(cursor), connection)
+    connection.bookstore_instrumented = True
+
+
+class TimedTemplate(object):
+    """
+    Wraps a template of the Django template backend and records the time it
+    takes to render in the stats of the current request.
+    """
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, attr):
+        return getattr(self.template, attr)
+
+    def render(self, context=None, request=None):
+        stats = current_stats()
+        if stats is None:
+            return self.template.render(context, request)
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            stats.template_seconds += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend, with every template wrapped in a
+    TimedTemplate.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(
+            super(TimedDjangoTemplates, self).from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(
+            super(TimedDjangoTemplates, self).get_template(template_name))
+
+
+class Histogram(object):
+    """
+    A cumulative histogram of durations in milliseconds.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.total = 0.0
+        self.samples = 0
+
+    def observe(self, milliseconds):
+        self.counts[bisect.bisect_left(BUCKETS_MS, milliseconds)] += 1
+        self.total += milliseconds
+        self.samples += 1
+
+
+class Registry(object):
+    """
+    Aggregates the stats of finished requests per URL name.
+    """
+    METRICS = (
+        ('total', 'Time spent handling the request.'),
+        ('view', 'Time spent in the view, including SQL and templates.'),
+        ('sql', 'Time spent executing SQL.'),
+        ('template', 'Time spent rendering templates.'),
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.queries = {}
+            self.slowest = {}
+
+    def add(self, url_name, stats):
+        durations = {
+            'total': stats.total_seconds * 1000,
+            'view': stats.view_seconds * 1000,
+            'sql': stats.sql_seconds * 1000,
+            'template': stats.template_seconds * 1000,
+        }
+        with self._lock:
+            if url_name not in self.histograms:
+                self.histograms[url_name] = dict(
+                    (metric, Histogram()) for metric, _ in self.METRICS)
+                self.queries[url_name] = 0
+                self.slowest[url_name] = []
+            for metric, milliseconds in durations.items():
+                self.histograms[url_name][metric].observe(milliseconds)
+            self.queries[url_name] += stats.queries
+            slowest = self.slowest[url_name]
+            for entry in stats.slowest:
+                if len(slowest) < SLOWEST_KEPT:
+                    heapq.heappush(slowest, entry)
+                elif entry[0] > slowest[0][0]:
+                    heapq.heapreplace(slowest, entry)
+
+    def render(self):
+        """
+        Returns the aggregated metrics in the Prometheus text format.
+        """
+        lines = []
+        with self._lock:
+            names = sorted(self.histograms)
+            for metric, description in self.METRICS:
+                family = 'bookstore_{0}_duration_ms'.format(metric)
+                lines.append('# HELP {0} {1}'.format(family, description))
+                lines.append('# TYPE {0} histogram'.format(family))
+                for name in names:
+                    histogram = self.histograms[name][metric]
+                    cumulative = 0
+                    bounds = [str(bound) for bound in BUCKETS_MS] + ['+Inf']
+                    for bound, count in zip(bounds, histogram.counts):
+                        cumulative += count
+                        lines.append(
+                            '{0}_bucket{{url_name="{1}",le="{2}"}} {3}'.format(
+                                family, name, bound, cumulative))
+                    lines.append('{0}_sum{{url_name="{1}"}} {2:.3f}'.format(
+                        family, name, histogram.total))
+                    lines.append('{0}_count{{url_name="{1}"}} {2}'.format(
+                        family, name, histogram.samples))
+
+            lines.append(
+                '# HELP bookstore_queries_total SQL statements executed.')
+            lines.append('# TYPE bookstore_queries_total counter')
+            for name in names:
+                lines.append('bookstore_queries_total{{url_name="{0}"}} {1}'
+                             .format(name, self.queries[name]))
+
+            lines.append('# Slowest statements per URL name (ms, SQL):')
+            for name in names:
+                for seconds, sql in sorted(self.slowest[name], reverse=True):
+                    lines.append('# {0} {1:.2f} {2}'.format(
+                        name, seconds * 1000,
+                        ' '.join(sql[:SQL_PREVIEW_LENGTH].split())))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
@@ -0,0 +1,261 @@
+"""
+A job queue for the heavy bookstore operations, kept in the Job table.
+
+Views and the JSON API enqueue() a job and return at once; the workers of
+`manage.py run_workers` claim queued jobs and run the tasks registered for
+their kind in bookstore.tasks, in processes of their own. A worker claims a
+job with a conditional UPDATE, so two workers never run the same job and no
+broker or lock server is needed.
+
+A task is called with a Progress and the payload of its job, and returns the
+result of the job. Calling the Progress records how far the task has got and
+raises Cancelled once cancel() has been called for the job, so a long task
+stops at its next report. A task that raises JobFailed fails at once; other
+exceptions are retried with an exponential backoff until the job has run
+max_attempts times.
+
+The file named by the `input` of a payload belongs to the job: it is removed
+when the job succeeds, fails for good or is cancelled.
+"""
+import json
+import logging
+import os
+import socket
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from bookstore import models
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ATTEMPTS = 3
+# the delay before the second attempt of a job, doubled for every later one
+RETRY_DELAY = 5
+# how long an idle worker waits before looking for queued jobs again
+POLL_INTERVAL = 1.0
+# the number of queued jobs a worker tries to claim before giving up, when
+# other workers claim them first
+CLAIM_CANDIDATES = 10
+
+TASKS = {}
+
+
+class Cancelled(Exception):
+    """
+    Raised by Progress when the cancellation of its job has been requested.
+    """
+
+
+class JobFailed(Exception):
+    """
+    Raised by a task for a failure that retrying the job cannot fix.
+    """
+
+
+def task(kind):
+    """
+    Registers the decorated function as the task that runs jobs of `kind`.
+    """
+    def register(func):
+        TASKS[kind] = func
+        return func
+    return register
+
+
+def files_dir():
+    """
+    Returns the directory holding the input and output files of jobs,
+    creating it if needed.
+    """
+    path = settings.BOOKSTORE_JOB_FILES
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    return path
+
+
+def worker_name(pid=None):
+    """Returns the name of the worker running in process `pid`."""
+    return '{0}:{1}'.format(socket.gethostname(), pid or os.getpid())
+
+
+class Progress(object):
+    """
+    Records the progress of a running job and stops it once its cancellation
+    has been requested. `done` starts from the progress of the previous
+    attempts, so that a retried task can resume where they stopped.
+    """
+
+    def __init__(self, job):
+        self.job_id = job.pk
+        self.done = job.done
+
+    def __call__(self, done, total=None):
+        self.done = done
+        updated = models.Job.objects.filter(
+            pk=self.job_id, status=models.Job.RUNNING, cancel_requested=False
+        ).update(done=done, total=total)
+        if not updated:
+            raise Cancelled
+
+
+def enqueue(kind, payload=None, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """
+    Queues a job of `kind` with the arguments `payload` and returns it.
+    """
+    if kind not in TASKS:
+        raise ValueError('Unknown job kind: {0}'.format(kind))
+    return models.Job.objects.create(
+        kind=kind, payload=json.dumps(payload or {}),
+        run_after=timezone.now(), max_attempts=max_attempts)
+
+
+def cancel(job_id):
+    """
+    Cancels a queued job at once, or asks a running job to stop at its next
+    progress report. Returns whether the job was still unfinished.
+    """
+    queued = models.Job.objects.filter(pk=job_id, status=models.Job.QUEUED)
+    job = queued.values_list('payload', flat=True).first()
+    if job is not None and queued.update(
+            status=models.Job.CANCELLED, finished=timezone.now()):
+        _remove_input(json.loads(job))
+        return True
+    return bool(models.Job.objects.filter(
+        pk=job_id, status=models.Job.RUNNING).update(cancel_requested=True))
+
+
+def claim(worker):
+    """
+    Marks the oldest queued job that is due as run by `worker` and returns
+    it, or returns None when there is none.
+    """
+    now = timezone.now()
+    due = models.Job.objects.filter(
+        status=models.Job.QUEUED, run_after__lte=now)
+    candidates = due.order_by('run_after', 'id').values_list(
+        'id', flat=True)[:CLAIM_CANDIDATES]
+    for pk in list(candidates):
+        # only one of the workers racing for a job sees its update succeed
+        if due.filter(pk=pk).update(
+                status=models.Job.RUNNING, worker=worker, started=now,
+                attempts=F('attempts') + 1):
+            return models.Job.objects.get(pk=pk)
+    return None
+
+
+def _remove_input(payload):
+    path = payload.get('input')
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+def _finish(job, status, payload, **fields):
+    """
+    Records the final `status` of a running job and removes its input.
+    """
+    models.Job.objects.filter(pk=job.pk, status=models.Job.RUNNING).update(
+        status=status, finished=timezone.now(), **fields)
+    _remove_input(payload)
+
+
+def _retry_or_fail(job, payload, error):
+    """
+    Queues a job that failed with `error` again after a backoff, or fails it
+    for good once it has run max_attempts times.
+    """
+    if job.attempts >= job.max_attempts:
+        _finish(job, models.Job.FAILED, payload, error=error)
+        return
+    delay = RETRY_DELAY * 2 ** (job.attempts - 1)
+    retried = models.Job.objects.filter(
+        pk=job.pk, status=models.Job.RUNNING, cancel_requested=False
+    ).update(
+        status=models.Job.QUEUED, worker='', error=error,
+        run_after=timezone.now() + timedelta(seconds=delay))
+    if not retried:
+        _finish(job, models.Job.CANCELLED, payload, error=error)
+
+
+def run(job):
+    """
+    Runs a claimed job and records its outcome.
+    """
+    payload = json.loads(job.payload)
+    try:
+        func = TASKS.get(job.kind)
+        if func is None:
+            raise JobFailed('Unknown job kind: {0}'.format(job.kind))
+        result = func(Progress(job), **payload)
+    except Cancelled:
+        _finish(job, models.Job.CANCELLED, payload)
+    except JobFailed as error:
+        _finish(job, models.Job.FAILED, payload, error=str(error))
+    except Exception as error:
+        logger.exception('Job %s (%s) failed', job.pk, job.kind)
+        _retry_or_fail(job, payload, '{0}: {1}'.format(
+            type(error).__name__, error))
+    else:
+        _finish(job, models.Job.SUCCEEDED, payload,
+                result=json.dumps(result, separators=(',', ':')))
+
+
+def work(worker=None, burst=False, should_stop=None):
+    """
+    Claims and runs jobs until `should_stop()` returns true, or with `burst`
+    until no job is due. Returns the number of jobs run.
+    """
+    worker = worker or worker_name()
+    processed = 0
+    while should_stop is None or not should_stop():
+        job = claim(worker)
+        if job is not None:
+            run(job)
+            processed += 1
+        elif burst:
+            break
+        else:
+            time.sleep(POLL_INTERVAL)
+        # like the request handler, drop connections that went bad or old
+        close_old_connections()
+    return processed
+
+
+def requeue_abandoned(workers):
+    """
+    Queues the jobs left running by the exited `workers` again, or fails the
+    ones that have used up their attempts, and returns how many were queued.
+    """
+    running = models.Job.objects.filter(
+        status=models.Job.RUNNING, worker__in=list(workers))
+    running.filter(attempts__gte=F('max_attempts')).update(
+        status=models.Job.FAILED, finished=timezone.now(),
+        error='The worker running the job exited.')
+    return running.update(
+        status=models.Job.QUEUED, worker='', run_after=timezone.now())
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def abandoned_workers():
+    """
+    Returns the workers of this host that are recorded as running a job but
+    whose process no longer exists.
+    """
+    prefix = '{0}:'.format(socket.gethostname())
+    workers = models.Job.objects.filter(
+        status=models.Job.RUNNING, worker__startswith=prefix
+    ).values_list('worker', flat=True).distinct()
+    return [
+        worker for worker in workers
+        if not _is_alive(int(worker.rsplit(':', 1)[1]))]
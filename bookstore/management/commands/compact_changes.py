@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bookstore import changes
+
+
+class Command(BaseCommand):
+    """
+    Drops the changes of the feed superseded by a later change of the same
+    object, e.g.
+
+        ./manage.py compact_changes
+        ./manage.py compact_changes --until 120000
+    """
+    help = 'Compacts the change feed of books and categories.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--until', type=int,
+            help='Only compact the changes up to this sequence number, e.g. '
+                 'the one every consumer has read.')
+
+    def handle(self, *args, **options):
+        if options['until'] is not None and options['until'] < 0:
+            raise CommandError('--until must be a non-negative integer.')
+        deleted = changes.compact(options['until'])
+        self.stdout.write(self.style.SUCCESS(
+            'Deleted {0} superseded changes.'.format(deleted)))
@@ -0,0 +1,44 @@
+import io
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bookstore import exporter, importer
+
+
+class Command(BaseCommand):
+    """
+    Exports every book with its category name as CSV or JSON Lines, e.g.
+
+        ./manage.py export_books catalogue.csv
+        ./manage.py export_books --format jsonl - | gzip > catalogue.jsonl.gz
+    """
+    help = 'Exports every book (with its category) to a CSV or JSONL file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', help='The file to write, or - to write standard output.')
+        parser.add_argument(
+            '--format', choices=exporter.FORMATS,
+            help='The output format. Guessed from the file extension if '
+                 'omitted.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=exporter.DEFAULT_CHUNK_SIZE,
+            help='The number of books read from the database at a time.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or importer.guess_format(path)
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be a positive integer.')
+
+        lines = exporter.export_lines(fmt, options['chunk_size'])
+        if path == '-':
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        try:
+            output = io.open(path, 'w', encoding='utf-8', newline='')
+        except IOError as error:
+            raise CommandError(error)
+        with output:
+            output.writelines(lines)
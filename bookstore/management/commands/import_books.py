@@ -0,0 +1,59 @@
+import csv
+import io
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bookstore import importer
+
+
+class Command(BaseCommand):
+    """
+    Imports books from a CSV or JSON Lines file, e.g.
+
+        ./manage.py import_books feed.csv
+        ./manage.py import_books --format jsonl - < feed.jsonl
+    """
+    help = 'Imports books (and their categories) from a CSV or JSONL file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', help='The file to import, or - to read standard input.')
+        parser.add_argument(
+            '--format', choices=importer.FORMATS,
+            help='The input format. Guessed from the file extension if '
+                 'omitted.')
+        parser.add_argument(
+            '--batch-size', type=int, default=importer.DEFAULT_BATCH_SIZE,
+            help='The number of books inserted per transaction.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or importer.guess_format(path)
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be a positive integer.')
+
+        def progress(result):
+            if options['verbosity'] >= 2:
+                self.stdout.write('{0} rows ({1:.0f} rows/s)'.format(
+                    result.rows, result.rows_per_second))
+
+        if path == '-':
+            lines = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+            result = self._import(lines, fmt, options['batch_size'], progress)
+        else:
+            try:
+                lines = io.open(path, encoding='utf-8', newline='')
+            except IOError as error:
+                raise CommandError(error)
+            with lines:
+                result = self._import(
+                    lines, fmt, options['batch_size'], progress)
+        self.stdout.write(self.style.SUCCESS(str(result)))
+
+    def _import(self, lines, fmt, batch_size, progress):
+        try:
+            return importer.import_books(
+                importer.read_rows(lines, fmt), batch_size, progress)
+        except (ValueError, csv.Error) as error:
+            raise CommandError('Malformed input: {0}'.format(error))
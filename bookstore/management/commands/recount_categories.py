@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from bookstore import counters
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the denormalized book counts of every category, for instance
+    after books have been written with raw SQL:
+
+        ./manage.py recount_categories
+    """
+    help = 'Recomputes the number of books in every category.'
+
+    def handle(self, *args, **options):
+        counters.recount()
+        self.stdout.write(self.style.SUCCESS('Category book counts rebuilt.'))
@@ -0,0 +1,101 @@
+import multiprocessing
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from bookstore import jobs
+
+
+def _work(stop, burst):
+    """Runs jobs in a worker process until `stop` is set."""
+    # the supervisor turns an interrupt or SIGTERM into `stop`, letting the
+    # running jobs finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    jobs.work(burst=burst, should_stop=lambda: stop.value)
+
+
+class Command(BaseCommand):
+    """
+    Runs the jobs of the job queue on a pool of worker processes, restarting
+    the workers that exit unexpectedly, e.g.
+
+        ./manage.py run_workers
+        ./manage.py run_workers --processes 4
+        ./manage.py run_workers --processes 0 --burst
+
+    An interrupt or SIGTERM lets the running jobs finish and then stops the
+    workers.
+    """
+    help = 'Runs the background jobs of the bookstore.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=settings.BOOKSTORE_JOB_WORKERS,
+            help='The number of worker processes; 0 runs the jobs in this '
+                 'process.')
+        parser.add_argument(
+            '--burst', action='store_true',
+            help='Stop once no job is due instead of waiting for new ones.')
+
+    def handle(self, *args, **options):
+        processes = options['processes']
+        if processes < 0:
+            raise CommandError('--processes must be a non-negative integer.')
+        requeued = jobs.requeue_abandoned(jobs.abandoned_workers())
+        if requeued:
+            self.stdout.write('Queued {0} abandoned jobs again.'.format(
+                requeued))
+        if not processes:
+            ran = jobs.work(burst=options['burst'])
+            self.stdout.write(self.style.SUCCESS('Ran {0} jobs.'.format(ran)))
+            return
+        self.supervise(processes, options['burst'])
+
+    def supervise(self, processes, burst):
+        """
+        Keeps `processes` workers running until an interrupt or SIGTERM, or
+        with `burst` until every worker has stopped.
+        """
+        context = multiprocessing.get_context('fork')
+        # a flag in shared memory rather than an Event, whose lock a worker
+        # killed at the wrong time would leave held
+        stop = context.RawValue('b', 0)
+        workers = {}
+
+        def start():
+            # the workers must not share the connections of the supervisor
+            connections.close_all()
+            process = context.Process(target=_work, args=(stop, burst))
+            process.start()
+            workers[process.pid] = process
+
+        def shutdown(signum, frame):
+            stop.value = 1
+
+        signal.signal(signal.SIGTERM, shutdown)
+        for _ in range(processes):
+            start()
+        self.stdout.write('Started {0} workers.'.format(processes))
+        try:
+            while workers:
+                time.sleep(jobs.POLL_INTERVAL)
+                for pid, process in list(workers.items()):
+                    if process.is_alive():
+                        continue
+                    del workers[pid]
+                    if process.exitcode:
+                        jobs.requeue_abandoned([jobs.worker_name(pid)])
+                        self.stderr.write(
+                            'Worker {0} exited with code {1}.'.format(
+                                pid, process.exitcode))
+                        if not stop.value:
+                            start()
+        except KeyboardInterrupt:
+            stop.value = 1
+            for process in workers.values():
+                process.join()
+        self.stdout.write(self.style.SUCCESS('Workers stopped.'))
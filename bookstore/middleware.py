@@ -0,0 +1,94 @@
+import time
+
+from django.db import connections
+
+from bookstore import admission, instrumentation, routers
+
+
+class InstrumentationMiddleware(object):
+    """
+    Records the number of queries, the SQL, template and view times of every
+    request, reports them in a Server-Timing header and aggregates them in
+    bookstore.instrumentation.registry for the /metrics endpoint.
+
+    It should come first in MIDDLEWARE so that the time spent in the other
+    middleware is included in the total.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        for connection in connections.all():
+            instrumentation.install(connection)
+        stats = instrumentation.start_request()
+        try:
+            response = self.get_response(request)
+            view_started = getattr(request, 'bookstore_view_started', None)
+            if view_started is not None:
+                # includes the response phase of the inner middleware, which
+                # is negligible next to the view itself
+                stats.view_seconds = time.perf_counter() - view_started
+        finally:
+            instrumentation.finish_request()
+
+        response['Server-Timing'] = stats.server_timing()
+        match = getattr(request, 'resolver_match', None)
+        url_name = match.url_name if match and match.url_name else 'unknown'
+        instrumentation.registry.add(url_name, stats)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.bookstore_view_started = time.perf_counter()
+
+
+class ReplicaRoutingMiddleware(object):
+    """
+    Lets the listings and category choices of GET and HEAD requests be read
+    from the read replicas (see bookstore.routers). Other requests read
+    everything from the primary.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            return self.get_response(request)
+        with routers.allow_replicas():
+            return self.get_response(request)
+
+
+class AdmissionControlMiddleware(object):
+    """
+    Runs the views of the routes listed in the BOOKSTORE_ADMISSION setting
+    within the concurrency limit of their route, shedding the requests that
+    cannot be admitted.
+
+    It is not applied to the async views of bookstore.asgi, whose
+    concurrency is bounded by the thread pool. See bookstore.admission.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            held = getattr(request, 'bookstore_admission', None)
+            if held is not None:
+                held.release()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        url_name = request.resolver_match.url_name
+        route = admission.limiter(url_name)
+        if route is None:
+            return None
+        outcome = route.acquire()
+        if outcome is None:
+            admission.admission_counts.add(url_name, 'shed')
+            return admission.overloaded(url_name)
+        admission.admission_counts.add(url_name, outcome)
+        request.bookstore_admission = route
+        return None
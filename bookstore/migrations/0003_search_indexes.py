@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 05:50
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# an external content FTS5 index over bookstore_book.title, kept in sync by
+# triggers so that bulk_create() and raw SQL writes are indexed too
+CREATE_FTS = [
+    "CREATE VIRTUAL TABLE bookstore_book_fts USING fts5("
+    "title, content='bookstore_book', content_rowid='id', "
+    "tokenize='trigram')",
+    "CREATE TRIGGER bookstore_book_fts_insert AFTER INSERT ON bookstore_book "
+    "BEGIN INSERT INTO bookstore_book_fts(rowid, title) "
+    "VALUES (new.id, new.title); END",
+    "CREATE TRIGGER bookstore_book_fts_delete AFTER DELETE ON bookstore_book "
+    "BEGIN INSERT INTO bookstore_book_fts(bookstore_book_fts, rowid, title) "
+    "VALUES ('delete', old.id, old.title); END",
+    "CREATE TRIGGER bookstore_book_fts_update AFTER UPDATE ON bookstore_book "
+    "BEGIN INSERT INTO bookstore_book_fts(bookstore_book_fts, rowid, title) "
+    "VALUES ('delete', old.id, old.title); "
+    "INSERT INTO bookstore_book_fts(rowid, title) "
+    "VALUES (new.id, new.title); END",
+    "INSERT INTO bookstore_book_fts(bookstore_book_fts) VALUES ('rebuild')",
+]
+
+DROP_FTS = [
+    "DROP TRIGGER IF EXISTS bookstore_book_fts_insert",
+    "DROP TRIGGER IF EXISTS bookstore_book_fts_delete",
+    "DROP TRIGGER IF EXISTS bookstore_book_fts_update",
+    "DROP TABLE IF EXISTS bookstore_book_fts",
+]
+
+
+def fts_supported(connection):
+    """
+    Checks whether the database is SQLite built with FTS5 and the trigram
+    tokenizer (SQLite 3.34+).
+    """
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute(
+                "CREATE VIRTUAL TABLE temp.bookstore_fts_probe "
+                "USING fts5(title, tokenize='trigram')")
+        except Exception:
+            return False
+        cursor.execute("DROP TABLE temp.bookstore_fts_probe")
+    return True
+
+
+def create_fts(apps, schema_editor):
+    if not fts_supported(schema_editor.connection):
+        return
+    for statement in CREATE_FTS:
+        schema_editor.execute(statement)
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in DROP_FTS:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookstore', '0002_book'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='book',
+            name='title',
+            field=models.CharField(db_index=True, max_length=200),
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='name',
+            field=models.CharField(db_index=True, max_length=200),
+        ),
+        migrations.AlterIndexTogether(
+            name='book',
+            index_together=set([('category', 'title')]),
+        ),
+        migrations.RunPython(create_fts, drop_fts),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 05:51
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def count_books(apps, schema_editor):
+    schema_editor.execute(
+        'UPDATE bookstore_category SET book_count = (SELECT COUNT(*) '
+        'FROM bookstore_book WHERE bookstore_book.category_id = '
+        'bookstore_category.id)'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookstore', '0003_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='book_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_books, migrations.RunPython.noop),
+    ]
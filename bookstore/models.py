@@ -1,28 +1,143 @@
-from django.db import models
+from django.db import models, router, transaction
 
 # Create your models here.
 
 
-class Category(models.Model):
+class ChangeLogged(models.Model):
+    """
+    A model whose saves and deletes are recorded in the Change feed by the
+    receivers in bookstore.signals.
+
+    Saves run in a transaction, so that the Change written by the post_save
+    receiver commits or rolls back together with the save itself. Deletes
+    already send post_delete within their transaction.
+    """
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(
+            type(self), instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            super(ChangeLogged, self).save(*args, **kwargs)
+
+
+class Category(ChangeLogged):
     """
     The model for book Categories.
     """
     id = models.AutoField(primary_key=True)
-    name = models.CharField(max_length=200)
+    name = models.CharField(max_length=200, db_index=True)
+    # maintained by bookstore.counters; rebuilt by `manage.py
+    # recount_categories`
+    book_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         """Customizes the string representation of the Category model."""
         return '{0}'.format(self.name)
         
 
-class Book(models.Model):
+class Book(ChangeLogged):
     """
     The model for Books.
     """
     id = models.AutoField(primary_key=True)
-    title = models.CharField(max_length=200)
+    title = models.CharField(max_length=200, db_index=True)
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
 
+    class Meta:
+        # serves the listing of a category's books ordered by title
+        index_together = [('category', 'title')]
+
     def __str__(self):
         """Customizes the string representation of the Book model."""
-        return '{0}'.format(self.title)
\ No newline at end of file
+        return '{0}'.format(self.title)
+
+
+class Change(models.Model):
+    """
+    An entry of the append-only feed of changes to Books and Categories,
+    written by bookstore.changes in the transaction of the change itself.
+    """
+    ACTIONS = (
+        ('create', 'create'),
+        ('update', 'update'),
+        ('delete', 'delete'),
+    )
+    # increases with every change; consumers resume from the last one seen
+    seq = models.AutoField(primary_key=True)
+    model = models.CharField(max_length=20)
+    object_id = models.IntegerField()
+    action = models.CharField(max_length=6, choices=ACTIONS)
+    # the fields of the object after the change as JSON; null for deletes
+    data = models.TextField(null=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # serves the compaction of the feed to the last change per object
+        index_together = [('model', 'object_id')]
+
+    def __str__(self):
+        """Customizes the string representation of the Change model."""
+        return '{0} {1} {2} {3}'.format(
+            self.seq, self.action, self.model, self.object_id)
+
+
+class FeedLock(models.Model):
+    """
+    The single row that the transactions appending to the Change feed lock
+    first, on databases that run writers concurrently, so that changes
+    commit in the order of their sequence numbers (see bookstore.changes).
+    """
+
+    def __str__(self):
+        """Customizes the string representation of the FeedLock model."""
+        return 'feed lock {0}'.format(self.pk)
+
+
+class Job(models.Model):
+    """
+    A unit of background work, run by the workers of `manage.py run_workers`
+    (see bookstore.jobs).
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    STATUSES = (
+        (QUEUED, 'queued'),
+        (RUNNING, 'running'),
+        (SUCCEEDED, 'succeeded'),
+        (FAILED, 'failed'),
+        (CANCELLED, 'cancelled'),
+    )
+    kind = models.CharField(max_length=50)
+    # the arguments of the task as JSON
+    payload = models.TextField(default='{}')
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    # queued jobs are not claimed before this time, which delays retries
+    run_after = models.DateTimeField()
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    # the host and process id of the worker running the job
+    worker = models.CharField(max_length=100, blank=True)
+    cancel_requested = models.BooleanField(default=False)
+    done = models.PositiveIntegerField(default=0)
+    # null when the amount of work is not known in advance
+    total = models.PositiveIntegerField(null=True)
+    # the outcome of the task as JSON, and the last error
+    result = models.TextField(null=True)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True)
+    finished = models.DateTimeField(null=True)
+
+    class Meta:
+        # serves the workers looking for the next job to claim
+        index_together = [('status', 'run_after')]
+
+    def __str__(self):
+        """Customizes the string representation of the Job model."""
+        return '{0} {1} ({2})'.format(self.pk, self.kind, self.status)
@@ -0,0 +1,119 @@
+from collections import namedtuple
+from operator import attrgetter, itemgetter
+
+from bookstore import models
+
+# the number of rows shown on a listing page when no limit is requested.
+DEFAULT_PAGE_SIZE = 100
+# the largest number of rows a client may request for one listing page.
+MAX_PAGE_SIZE = 1000
+# the range of the ids that the databases can compare against, as signed
+# 64-bit integers.
+MIN_ID = -2 ** 63
+MAX_ID = 2 ** 63 - 1
+# the largest number of ids looked up with one IN clause, which keeps the
+# statements below the SQLite limit on query parameters.
+LOOKUP_BATCH_SIZE = 500
+
+# The read models of the listings: immutable records without a per-instance
+# __dict__, built from values_list() rows without instantiating models or
+# sending their signals.
+BookRecord = namedtuple('BookRecord', ['id', 'title', 'category'])
+CategoryRecord = namedtuple('CategoryRecord', ['id', 'name', 'book_count'])
+RECORDS = {models.Book: BookRecord, models.Category: CategoryRecord}
+
+
+def book_listing():
+    """
+    Returns the queryset used to list Books on the book-create.html template.
+
+    The category of every book is joined in the same query and only the
+    columns that the template renders are fetched, so listing the books costs
+    a single query regardless of how many books exist. The rows are
+    (id, title, category name) tuples, which listing_page() turns into
+    BookRecords.
+    """
+    return models.Book.objects.values_list(
+        'id', 'title', 'category__name').order_by('id')
+
+
+def category_listing():
+    """
+    Returns the queryset used to list Categories on the category-create.html
+    template, as (id, name, book count) tuples that listing_page() turns into
+    CategoryRecords.
+    """
+    return models.Category.objects.values_list(
+        'id', 'name', 'book_count').order_by('id')
+
+
+def chunks(items, size):
+    """
+    Yields consecutive lists of at most `size` of `items`, e.g. the ids of
+    one IN clause of LOOKUP_BATCH_SIZE ids at a time.
+    """
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def parse_id(value):
+    """
+    Returns `value` as an integer id, or raises ValueError when it is not an
+    integer or lies outside the range that the databases can compare
+    against.
+    """
+    pk = int(value)
+    if not MIN_ID <= pk <= MAX_ID:
+        raise ValueError('Id out of range: {0}'.format(value))
+    return pk
+
+
+def page_params(params):
+    """
+    Reads the `after` and `limit` keyset pagination parameters from a query
+    string dict, falling back to the first page of the default size when they
+    are missing or invalid.
+    """
+    try:
+        after = parse_id(params['after'])
+    except (KeyError, ValueError):
+        after = None
+    try:
+        limit = int(params['limit'])
+    except (KeyError, ValueError):
+        limit = DEFAULT_PAGE_SIZE
+    return after, max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def keyset_page(queryset, after=None, limit=DEFAULT_PAGE_SIZE,
+                id_of=attrgetter('id')):
+    """
+    Returns one page of `queryset` ordered by primary key, starting after the
+    row whose id is `after`.
+
+    The page is located with an indexed `id > after` lookup rather than an
+    OFFSET, so deep pages cost as much as the first one. The return value is
+    a tuple of the rows on the page and the id to pass as `after` to get the
+    next page (None on the last page). `id_of` reads the id of a row, for
+    querysets that do not return model instances.
+    """
+    if after is not None:
+        queryset = queryset.filter(id__gt=after)
+    # fetch one extra row to find out whether another page follows this one
+    rows = list(queryset.order_by('id')[:limit + 1])
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, id_of(rows[-1])
+    return rows, None
+
+
+def listing_page(queryset, after=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Returns one page of a book_listing() or category_listing() queryset, like
+    keyset_page(), as BookRecords or CategoryRecords.
+    """
+    make = RECORDS[queryset.model]._make
+    rows, next_after = keyset_page(
+        queryset, after, limit, id_of=itemgetter(0))
+    return [make(row) for row in rows], next_after
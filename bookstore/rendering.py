@@ -0,0 +1,27 @@
+"""
+Compilation of the bookstore templates ahead of the first request.
+
+With the cached template loader of the production configuration every
+template is found and parsed once per process, on its first render. prewarm()
+moves that work to startup, so that the first requests a process serves are
+as fast as the rest.
+"""
+import os
+
+from django.template import engines
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), 'templates')
+# the storefront pages only: the admin templates under templates/admin load
+# tag libraries of django.contrib.admin, which the lean profile leaves out
+TEMPLATE_NAMES = sorted(
+    name for name in os.listdir(TEMPLATE_DIR) if name.endswith('.html'))
+
+
+def prewarm(names=TEMPLATE_NAMES):
+    """
+    Loads the templates `names`, by default all the bookstore page
+    templates, with every configured Django template engine.
+    """
+    for engine in engines.all():
+        for name in names:
+            engine.get_template(name)
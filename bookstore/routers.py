@@ -0,0 +1,116 @@
+"""
+Routing of the listing reads of the bookstore to read replicas.
+
+The BOOKSTORE_REPLICAS setting lists the database aliases that replicate the
+default database. Replicas may only be read inside allow_replicas(), which
+bookstore.middleware.ReplicaRoutingMiddleware enters for GET and HEAD
+requests, and there only by the Book and Category queries run inside
+catalogue_reads(): the listings of the create pages and the category choices
+of BookForm (see bookstore.cache.replica_reads()). Everything else, including
+sessions, auth, jobs, the change feed, the API endpoints, management commands
+and background threads, reads from the primary.
+
+bookstore.cache only reads a replica that has replayed the generation of the
+catalogue that it caches the result under, so a lagging replica, e.g. right
+after a write and the redirect that follows it, never fills the cache with
+old data. The first write inside catalogue_reads() pins the rest of the
+block to the primary.
+"""
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from bookstore import models
+
+# the models whose reads catalogue_reads() sends to a replica
+CATALOGUE_MODELS = (models.Book, models.Category)
+
+_state = threading.local()
+
+
+def replicas():
+    """
+    Returns the aliases of the configured read replicas.
+    """
+    return list(getattr(settings, 'BOOKSTORE_REPLICAS', ()))
+
+
+@contextmanager
+def allow_replicas():
+    """
+    Lets the catalogue_reads() blocks of the current thread read from the
+    replicas until the block exits.
+    """
+    previous = getattr(_state, 'allowed', False)
+    _state.allowed = True
+    try:
+        yield
+    finally:
+        _state.allowed = previous
+
+
+def choose_replica():
+    """
+    Returns a random replica when the current thread may read from one, or
+    None.
+    """
+    aliases = replicas()
+    if getattr(_state, 'allowed', False) and aliases:
+        return random.choice(aliases)
+    return None
+
+
+@contextmanager
+def catalogue_reads(alias):
+    """
+    Sends the Book and Category reads of the current thread to the database
+    `alias`, or to the primary when it is None, until the block exits or the
+    first write pins it to the primary.
+    """
+    previous = getattr(_state, 'alias', None)
+    _state.alias = alias
+    try:
+        yield
+    finally:
+        _state.alias = previous
+
+
+def pin_to_primary():
+    """
+    Sends the remaining reads of the current catalogue_reads() block to the
+    primary.
+    """
+    _state.alias = None
+
+
+def reading_from_replicas():
+    """
+    Returns True if the catalogue reads of the current thread go to a
+    replica.
+    """
+    return getattr(_state, 'alias', None) is not None
+
+
+class ReplicaRouter(object):
+    """
+    Sends the Book and Category reads inside catalogue_reads() to its
+    replica, and every write, and the reads that follow it, to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model in CATALOGUE_MODELS:
+            return getattr(_state, 'alias', None)
+        return None
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS}.union(replicas())
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
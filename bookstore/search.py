@@ -0,0 +1,77 @@
+"""
+Title search for Books.
+
+On SQLite builds with FTS5 and the trigram tokenizer, migration
+0003_search_indexes maintains the bookstore_book_fts full-text index and
+substring searches are answered from it. Everywhere else, and for terms
+too short to form a trigram, substring searches scan the titles with a
+case-insensitive LIKE, which the listings bound by reading one page at a
+time. Prefix searches are answered from the index on Book.title.
+"""
+from django.db import connections
+
+from bookstore import queries
+
+FTS_TABLE = 'bookstore_book_fts'
+MODES = ('prefix', 'contains')
+# the trigram tokenizer cannot match terms shorter than one trigram
+MIN_FTS_LENGTH = 3
+
+
+def fts_available(using='default'):
+    """
+    Checks (once per connection) whether the full-text index exists.
+    """
+    connection = connections[using]
+    available = getattr(connection, 'bookstore_fts_available', None)
+    if available is None:
+        available = (
+            connection.vendor == 'sqlite' and
+            FTS_TABLE in connection.introspection.table_names()
+        )
+        connection.bookstore_fts_available = available
+    return available
+
+
+def _fts_match(term):
+    """Quotes `term` as an FTS5 phrase so it is matched literally."""
+    return '"{0}"'.format(term.replace('"', '""'))
+
+
+def filter_titles(books, term, mode='contains'):
+    """
+    Restricts the Book queryset `books` to the Books whose title starts with
+    (mode `prefix`) or contains (mode `contains`) `term`. Prefix searches
+    and, where the full-text index exists, substring searches of at least
+    MIN_FTS_LENGTH characters are answered from an index.
+    """
+    if (mode == 'contains' and len(term) >= MIN_FTS_LENGTH and
+            fts_available(books.db)):
+        return books.extra(
+            where=[
+                'bookstore_book.id IN (SELECT rowid FROM {0} WHERE {0} '
+                'MATCH %s)'.format(FTS_TABLE)
+            ],
+            params=[_fts_match(term)]
+        )
+    if mode == 'prefix':
+        # a range over the title index rather than LIKE, which SQLite only
+        # serves from an index under special collation settings
+        return books.filter(title__gte=term, title__lt=term + u'\uffff')
+    # no trigram to look up: the listings read the matches in id order one
+    # page at a time, so the scan stops once a page is filled
+    return books.filter(title__icontains=term)
+
+
+def search_books(term, mode='contains', category_id=None):
+    """
+    Returns the book_listing() rows of the Books whose title starts with
+    (mode `prefix`) or contains (mode `contains`) `term`, optionally
+    restricted to one Category.
+    """
+    books = queries.book_listing()
+    if category_id is not None:
+        books = books.filter(category_id=category_id)
+    if not term:
+        return books
+    return filter_titles(books, term, mode)
@@ -0,0 +1,58 @@
+"""
+Signal receivers that keep the bookstore caches consistent with the database
+and record every change in the change feed (see bookstore.changes).
+
+The receivers are connected when the app is loaded, in
+bookstore.apps.BookstoreConfig.ready().
+"""
+from django.core.signals import request_finished, request_started
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from bookstore import cache, changes, models
+
+
+@receiver(post_save, sender=models.Category)
+@receiver(post_delete, sender=models.Category)
+@receiver(post_save, sender=models.Book)
+@receiver(post_delete, sender=models.Book)
+def catalogue_changed(sender, **kwargs):
+    """
+    Makes this process see the new generation of the catalogue at once
+    whenever a Book or Category is created, edited or deleted.
+    """
+    cache.invalidate(cache.invalidate_catalogue)
+
+
+@receiver(post_save, sender=models.Category)
+@receiver(post_save, sender=models.Book)
+def record_save(sender, instance, created, raw=False, **kwargs):
+    """
+    Records a created or edited Book or Category in the change feed, within
+    the transaction of the save (see models.ChangeLogged).
+    """
+    if not raw:
+        changes.record([instance], 'create' if created else 'update')
+
+
+@receiver(post_delete, sender=models.Category)
+@receiver(post_delete, sender=models.Book)
+def record_delete(sender, instance, **kwargs):
+    """
+    Records a deleted Book or Category in the change feed, within the
+    transaction of the delete.
+    """
+    changes.record([instance], 'delete')
+
+
+@receiver(request_started)
+def request_started_handler(sender, **kwargs):
+    """
+    Lets the request read the generation of the cached pages once.
+    """
+    cache.start_request()
+
+
+@receiver(request_finished)
+def request_finished_handler(sender, **kwargs):
+    cache.finish_request()
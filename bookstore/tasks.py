@@ -0,0 +1,118 @@
+"""
+The heavy bookstore operations as tasks of the job queue (see bookstore.jobs).
+
+The tasks are registered when the app is loaded, in
+bookstore.apps.BookstoreConfig.ready().
+"""
+import csv
+import io
+import itertools
+import os
+
+from django.db.models import Sum
+
+from bookstore import counters, deletion, exporter, importer, jobs, models
+
+
+@jobs.task('import_books')
+def import_books(progress, input, format,
+                 batch_size=importer.DEFAULT_BATCH_SIZE):
+    """
+    Imports the books of the file `input`. Every batch commits on its own
+    together with the progress of the job, so a retried import skips exactly
+    the rows that the previous attempts imported.
+    """
+    skip = progress.done
+
+    def report(result):
+        progress(skip + result.rows)
+
+    try:
+        with io.open(input, encoding='utf-8', newline='') as lines:
+            rows = itertools.islice(
+                importer.read_rows(lines, format), skip, None)
+            result = importer.import_books(rows, batch_size, report)
+    except (ValueError, csv.Error, IOError) as error:
+        raise jobs.JobFailed('Import failed: {0}'.format(error))
+    return {
+        'rows': skip + result.rows,
+        'imported': result.imported,
+        'skipped': result.skipped,
+        'categories_created': result.categories_created,
+        'seconds': round(result.seconds, 3),
+    }
+
+
+@jobs.task('delete_category')
+def delete_category(progress, category_id,
+                    batch_size=deletion.DEFAULT_BATCH_SIZE):
+    """
+    Deletes a Category and all of its Books, a batch at a time. Progress is
+    reported, and cancellation checked, once per batch; a retried deletion
+    carries on with the books that the previous attempts left.
+    """
+    try:
+        category = models.Category.objects.get(pk=category_id)
+    except models.Category.DoesNotExist:
+        raise jobs.JobFailed(
+            'Category of id {0} does not exist!'.format(category_id))
+    skip = progress.done
+    # the counter of the category drops with every committed batch
+    total = skip + category.book_count
+    progress(skip, total)
+
+    def report(deleted):
+        progress(skip + deleted, total)
+
+    deleted = deletion.delete_category_in_batches(
+        category, batch_size, report)
+    return {'books_deleted': skip + deleted}
+
+
+def export_path(job_id, fmt):
+    """Returns the file that the export job `job_id` writes."""
+    return os.path.join(
+        jobs.files_dir(), 'export-{0}.{1}'.format(job_id, fmt))
+
+
+@jobs.task('export_books')
+def export_books(progress, format='csv',
+                 chunk_size=exporter.DEFAULT_CHUNK_SIZE):
+    """
+    Exports every book to a file of the job, reporting progress once per
+    chunk. The file only appears under its name once it is complete.
+    """
+    writers = {'csv': exporter.csv_lines, 'jsonl': exporter.jsonl_lines}
+    if format not in writers:
+        raise jobs.JobFailed('Unknown export format: {0}'.format(format))
+    total = models.Category.objects.aggregate(
+        total=Sum('book_count'))['total'] or 0
+
+    def counted(rows):
+        done = 0
+        for done, row in enumerate(rows, 1):
+            yield row
+            if done % chunk_size == 0:
+                progress(done, total)
+        progress(done, total)
+
+    path = export_path(progress.job_id, format)
+    partial = path + '.partial'
+    try:
+        with io.open(partial, 'w', encoding='utf-8', newline='') as output:
+            output.writelines(
+                writers[format](counted(exporter.iter_books(chunk_size))))
+    except Exception:
+        os.remove(partial)
+        raise
+    os.rename(partial, path)
+    return {'path': path, 'rows': progress.done}
+
+
+@jobs.task('recount_categories')
+def recount_categories(progress):
+    """
+    Rebuilds the denormalized book counts of every category.
+    """
+    counters.recount()
+    return {}
@@ -0,0 +1,34 @@
+"""
+Template filters for rendering long listings.
+
+A `{% for %}` loop costs tens of microseconds per row in the Django template
+language: a context push, the forloop bookkeeping and a variable resolution
+and conditional_escape() per field. format_rows renders every row with a
+single str.format() call instead.
+"""
+from django import template
+from django.utils.safestring import mark_safe
+
+register = template.Library()
+
+
+def _escape(value):
+    """
+    Escapes a value for HTML like django.utils.html.escape(), without its
+    per-call overhead.
+    """
+    return str(value).replace('&', '&amp;').replace('<', '&lt;').replace(
+        '>', '&gt;').replace('"', '&quot;').replace("'", '&#39;')
+
+
+@register.filter(is_safe=True)
+def format_rows(rows, row_format):
+    """
+    Renders each tuple in `rows` with the str.format() string `row_format`,
+    whose positional fields are the HTML-escaped values of the tuple, e.g.
+
+        {{ books|format_rows:'<li>{1} ({2})</li>' }}
+    """
+    return mark_safe(''.join([
+        row_format.format(*[_escape(value) for value in row])
+        for row in rows]))
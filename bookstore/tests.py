@@ -1,7 +1,40 @@
-from django.test import TestCase, Client
-from django.core.urlresolvers import reverse
+import asyncio
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock
 
-from bookstore import models
+from django.conf import settings
+from django.contrib.admin import site as admin_site
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.models.signals import post_init
+from django.middleware.csrf import get_token
+from django.http import HttpResponse
+from django.template import engines
+from django.test import (
+    TestCase, TransactionTestCase, Client, RequestFactory, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.core.urlresolvers import get_resolver, reverse
+from django.utils import timezone
+
+from inventory import settings_lean
+from inventory.backends.sqlite3.base import DatabaseWrapper
+
+from bookstore import (
+    admin, admission, asgi, batch, cache, changes, counters, deletion, forms,
+    importer, instrumentation, jobs, models, queries, rendering, routers,
+    warmup)
+from bookstore.templatetags.listings import format_rows
 
 
 class BookstoreTests(TestCase):
@@ -92,14 +125,14 @@ class BookstoreTests(TestCase):
         response = self.client.get(create_url)
         self.assertContains(
             response,
-            '<li>{0}</li>'.format(scifi['name']),
+            '<li>{0} (0)</li>'.format(scifi['name']),
             count=1,
             status_code=200,
             html=True
         )
         self.assertContains(
             response,
-            '<li>{0}</li>'.format(programming['name']),
+            '<li>{0} (0)</li>'.format(programming['name']),
             count=1,
             status_code=200,
             html=True
@@ -188,7 +221,7 @@ class BookstoreTests(TestCase):
         # assert that the category is listed amongst available categories
         self.assertContains(
             response,
-            '<li>{0}</li>'.format(cs['name']),
+            '<li>{0} (0)</li>'.format(cs['name']),
             count=1,
             status_code=201,
             html=True
@@ -215,7 +248,7 @@ class BookstoreTests(TestCase):
         response = self.client.get(create_url)
         self.assertNotContains(
             response,
-            '<li>{0}</li>'.format(cs['name']),
+            '<li>{0} (0)</li>'.format(cs['name']),
             status_code=200,
             html=True
         )
@@ -443,4 +476,2581 @@ class BookstoreTests(TestCase):
             '<li>{0} ({1})</li>'.format(jhtp4['title'], programming['name']),
             status_code=200,
             html=True
-        )
\ No newline at end of file
+        )
+
+
+class BookListingQueryTests(TestCase):
+    """
+    This class contains query-count regression tests for the book listing.
+    """
+
+    def setUp(self):
+        """
+        This method runs before the execution of each test case.
+        """
+        self.client = Client()
+        self.create_book_url = reverse('book-create')
+
+    def add_books(self, count):
+        """
+        Creates a new category with `count` books in it.
+        """
+        category = models.Category.objects.create(
+            name='Category {0}'.format(models.Category.objects.count()))
+        models.Book.objects.bulk_create(
+            models.Book(title='Book {0}'.format(i), category=category)
+            for i in range(count)
+        )
+
+    def count_listing_queries(self):
+        """
+        Fetches the create-book page and returns the number of queries made.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.create_book_url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_book_listing_query_count_is_constant(self):
+        """
+        This test asserts that the number of queries made when listing books
+        does not grow with the number of books (or categories) listed.
+        """
+        self.add_books(1)
+        baseline = self.count_listing_queries()
+
+        self.add_books(20)
+        self.add_books(20)
+        self.assertEqual(self.count_listing_queries(), baseline)
+
+    def test_book_listing_renders_category_names(self):
+        """
+        This test asserts that the joined listing still renders each book
+        together with the name of its category.
+        """
+        self.add_books(2)
+        response = self.client.get(self.create_book_url)
+        self.assertContains(
+            response,
+            '<li>Book 1 (Category 0)</li>',
+            count=1,
+            status_code=200,
+            html=True
+        )
+
+
+class ListingPaginationTests(TestCase):
+    """
+    This class contains tests for the keyset pagination of the listings.
+    """
+
+    def setUp(self):
+        """
+        This method runs before the execution of each test case.
+        """
+        self.client = Client()
+        self.category = models.Category.objects.create(name='Programming')
+        models.Book.objects.bulk_create(
+            models.Book(title='Book {0}'.format(i), category=self.category)
+            for i in range(5)
+        )
+        counters.recount()
+
+    def test_user_can_page_through_books(self):
+        """
+        This test pages through five books two at a time and asserts that;
+            1. each page lists only the books after the cursor.
+            2. every page but the last links to the next one.
+            3. a deep page costs as many queries as the first page.
+        """
+        create_book_url = reverse('book-create')
+        books = list(models.Book.objects.order_by('id'))
+        # warm up the cached category choices so both pages are comparable
+        self.client.get(create_book_url)
+
+        with CaptureQueriesContext(connection) as first_page:
+            response = self.client.get(create_book_url, {'limit': 2})
+        self.assertContains(
+            response, '<li>Book 1 (Programming)</li>', html=True)
+        self.assertNotContains(
+            response, '<li>Book 2 (Programming)</li>', html=True)
+        self.assertContains(
+            response, '?after={0}&amp;limit=2'.format(books[1].id))
+
+        with CaptureQueriesContext(connection) as deep_page:
+            response = self.client.get(
+                create_book_url, {'after': books[3].id, 'limit': 2})
+        self.assertContains(
+            response, '<li>Book 4 (Programming)</li>', count=1, html=True)
+        self.assertNotContains(
+            response, '<li>Book 3 (Programming)</li>', html=True)
+        self.assertNotContains(response, 'Next page')
+
+        self.assertEqual(len(deep_page), len(first_page))
+
+    def test_user_can_page_through_categories(self):
+        """
+        This test asserts that the category listing honours the cursor and
+        that invalid pagination parameters fall back to the first page.
+        """
+        other = models.Category.objects.create(name='Science Fiction')
+        create_url = reverse('category-create')
+
+        response = self.client.get(
+            create_url, {'after': self.category.id, 'limit': 1})
+        self.assertContains(
+            response, '<li>{0} (0)</li>'.format(other.name), count=1,
+            html=True)
+        self.assertNotContains(
+            response, '<li>{0} (5)</li>'.format(self.category.name),
+            html=True)
+
+        response = self.client.get(
+            create_url, {'after': 'first', 'limit': 'all'})
+        self.assertContains(
+            response, '<li>{0} (5)</li>'.format(self.category.name),
+            html=True)
+        self.assertContains(
+            response, '<li>{0} (0)</li>'.format(other.name), html=True)
+
+    def test_out_of_range_cursors_return_the_first_page(self):
+        """
+        This test asserts that a cursor beyond the range of the database
+        integers is treated like any other invalid cursor, on the listing
+        and the search pages.
+        """
+        after = '1' + '0' * 30
+        for url in (
+                reverse('category-create'), reverse('book-create'),
+                reverse('book-search')):
+            response = self.client.get(url, {'after': after, 'q': 'a'})
+            self.assertEqual(response.status_code, 200)
+        response = self.client.get(
+            reverse('category-create'), {'after': '-' + after})
+        self.assertContains(
+            response, '<li>{0} (5)</li>'.format(self.category.name),
+            html=True)
+
+
+class CategoryChoicesCacheTests(TestCase):
+    """
+    This class contains tests for the cached category choices of BookForm.
+    """
+
+    def setUp(self):
+        """
+        This method runs before the execution of each test case.
+        """
+        self.client = Client()
+        self.category = models.Category.objects.create(name='Programming')
+
+    def test_book_form_renders_without_queries_once_cached(self):
+        """
+        This test asserts that the category choices are read from the
+        database once and then served from the cache, which only reads the
+        generation of the catalogue.
+        """
+        str(forms.BookForm())
+        with self.assertNumQueries(1):
+            html = str(forms.BookForm())
+        self.assertIn(
+            '<option value="{0}">Programming</option>'.format(
+                self.category.id),
+            html
+        )
+
+    def test_category_views_invalidate_the_choices(self):
+        """
+        This test asserts that creating, editing and deleting a category
+        through its views is reflected in the choices of BookForm.
+        """
+        str(forms.BookForm())
+
+        self.client.post(reverse('category-create'), {'name': 'Poetry'})
+        self.assertIn('Poetry', str(forms.BookForm()))
+
+        edit_url = reverse(
+            'category-edit', kwargs={'categ_id': self.category.id})
+        self.client.post(edit_url, {'name': 'Software'})
+        html = str(forms.BookForm())
+        self.assertIn('Software', html)
+        self.assertNotIn('Programming', html)
+
+        delete_url = reverse(
+            'category-delete', kwargs={'categ_id': self.category.id})
+        self.client.post(delete_url)
+        self.assertNotIn('Software', str(forms.BookForm()))
+
+
+class BookImportTests(TestCase):
+    """
+    This class contains tests for the bulk import of books.
+    """
+
+    def setUp(self):
+        """
+        This method runs before the execution of each test case.
+        """
+        self.client = Client()
+        self.programming = models.Category.objects.create(name='Programming')
+
+    def test_import_books_command_reads_csv(self):
+        """
+        This test imports a CSV file through the import_books command and
+        asserts that;
+            1. books are added to existing categories.
+            2. missing categories are created once.
+            3. rows without a title or category are skipped.
+            4. the created categories show up in the BookForm choices.
+        """
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(handle, 'w') as feed:
+            feed.write(
+                'title,category\n'
+                'Java How To Program,Programming\n'
+                'Dune,Science Fiction\n'
+                'Foundation,Science Fiction\n'
+                ',Science Fiction\n'
+            )
+        self.addCleanup(os.remove, path)
+        str(forms.BookForm())
+
+        out = io.StringIO()
+        call_command('import_books', path, batch_size=2, stdout=out)
+        self.assertIn('rows/s', out.getvalue())
+
+        self.assertEqual(
+            models.Book.objects.filter(category=self.programming).count(), 1)
+        scifi = models.Category.objects.filter(name='Science Fiction')
+        self.assertEqual(len(scifi), 1)
+        self.assertEqual(
+            models.Book.objects.filter(category=scifi[0]).count(), 2)
+        self.assertEqual(scifi[0].book_count, 2)
+        self.assertEqual(models.Book.objects.count(), 3)
+        self.assertIn('Science Fiction', str(forms.BookForm()))
+
+    def test_user_can_upload_jsonl_feed(self):
+        """
+        This test uploads a JSON Lines file to the book-import page and
+        asserts that the books are created and that feedback is displayed.
+        """
+        feed = SimpleUploadedFile(
+            'feed.jsonl',
+            b'{"title": "SICP", "category": "Programming"}\n'
+            b'{"title": "Dune", "category": "Science Fiction"}\n'
+        )
+        response = self.client.post(reverse('book-import'), {'file': feed})
+
+        self.assertContains(
+            response, 'Imported 2 books (0 skipped)', status_code=201)
+        self.assertTemplateUsed(response, 'book-import.html')
+        self.assertTrue(models.Book.objects.filter(
+            title='SICP', category=self.programming))
+        self.assertTrue(models.Book.objects.filter(
+            title='Dune', category__name='Science Fiction'))
+
+        malformed = SimpleUploadedFile('feed.jsonl', b'{"title": \n')
+        response = self.client.post(
+            reverse('book-import'), {'file': malformed})
+        self.assertContains(response, 'Import failed', status_code=400)
+
+    def test_jsonl_records_of_the_wrong_type_are_rejected(self):
+        """
+        This test asserts that a JSON Lines upload with a line that is not an
+        object fails with a message, and that rows whose title or category
+        is not a string are skipped.
+        """
+        feed = SimpleUploadedFile(
+            'feed.jsonl',
+            b'{"title": "SICP", "category": "Programming"}\n[1, 2]\n')
+        response = self.client.post(reverse('book-import'), {'file': feed})
+        self.assertContains(
+            response, 'Import failed: line 2: expected an object',
+            status_code=400)
+
+        feed = SimpleUploadedFile(
+            'feed.jsonl',
+            b'{"title": 12, "category": "Programming"}\n'
+            b'{"title": "Dune", "category": ["Fiction"]}\n'
+            b'{"title": "SICP", "category": "Programming"}\n')
+        response = self.client.post(reverse('book-import'), {'file': feed})
+        self.assertContains(
+            response, 'Imported 1 books (2 skipped)', status_code=201)
+
+
+class BookExportTests(TestCase):
+    """
+    This class contains tests for the streaming export of books.
+    """
+
+    def setUp(self):
+        """
+        This method runs before the execution of each test case.
+        """
+        self.client = Client()
+        self.programming = models.Category.objects.create(name='Programming')
+        models.Book.objects.bulk_create(
+            models.Book(title='Book {0}'.format(i), category=self.programming)
+            for i in range(5)
+        )
+
+    def test_user_can_stream_csv_export(self):
+        """
+        This test asserts that the export endpoint streams a CSV header and
+        one line per book, read in several chunks.
+        """
+        response = self.client.get(reverse('book-export'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,title,category')
+        self.assertEqual(len(lines), 6)
+        self.assertTrue(lines[-1].endswith(',Book 4,Programming'))
+
+        response = self.client.get(reverse('book-export'), {'format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_books_command_round_trips_through_import(self):
+        """
+        This test exports the books as JSON Lines in small chunks and asserts
+        that every book is exported exactly once and can be imported again.
+        """
+        out = io.StringIO()
+        call_command(
+            'export_books', '-', format='jsonl', chunk_size=2, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(len(set(lines)), 5)
+
+        models.Book.objects.all().delete()
+        result = importer.import_books(importer.read_rows(lines, 'jsonl'))
+        self.assertEqual(result.imported, 5)
+        self.assertEqual(
+            models.Book.objects.filter(category=self.programming).count(), 5)
+
+
+class BookSearchTests(TestCase):
+    """
+    This class contains tests for searching books by title.
+    """
+
+    def setUp(self):
+        """
+        This method runs before the execution of each test case.
+        """
+        self.client = Client()
+        self.search_url = reverse('book-search')
+        self.programming = models.Category.objects.create(name='Programming')
+        self.scifi = models.Category.objects.create(name='Science Fiction')
+        models.Book.objects.create(
+            title='Java, How To Program', category=self.programming)
+        models.Book.objects.create(
+            title='Programming Pearls', category=self.programming)
+        models.Book.objects.create(
+            title='Children of Dune', category=self.scifi)
+
+    def test_user_can_search_titles_by_prefix(self):
+        """
+        This test asserts that a prefix search only lists books whose title
+        starts with the search term.
+        """
+        response = self.client.get(
+            self.search_url, {'q': 'Programming', 'mode': 'prefix'})
+        self.assertTemplateUsed(response, 'book-search.html')
+        self.assertContains(
+            response, '<li>Programming Pearls (Programming)</li>',
+            count=1, status_code=200, html=True)
+        self.assertNotContains(response, 'Java, How To Program')
+
+    def test_user_can_search_titles_by_substring(self):
+        """
+        This test asserts that a substring search matches the term anywhere
+        in the title, is kept up to date on edits, and can be restricted to
+        a category.
+        """
+        response = self.client.get(self.search_url, {'q': 'Dune'})
+        self.assertContains(
+            response, '<li>Children of Dune (Science Fiction)</li>',
+            count=1, status_code=200, html=True)
+
+        models.Book.objects.filter(title='Children of Dune').update(
+            title='God Emperor of Dune')
+        response = self.client.get(
+            self.search_url, {'q': 'Dune', 'category': self.scifi.id})
+        self.assertContains(response, 'God Emperor of Dune')
+        self.assertNotContains(response, 'Children of Dune')
+
+        response = self.client.get(
+            self.search_url, {'q': 'Dune', 'category': self.programming.id})
+        self.assertContains(response, 'No books found.')
+
+    def test_short_substring_searches_ignore_case(self):
+        """
+        This test asserts that a substring search for a term too short for
+        the full-text index still matches the term anywhere in the title,
+        regardless of case.
+        """
+        response = self.client.get(self.search_url, {'q': 'du'})
+        self.assertContains(
+            response, '<li>Children of Dune (Science Fiction)</li>',
+            count=1, status_code=200, html=True)
+        self.assertNotContains(response, 'Programming Pearls')
+
+        response = self.client.get(self.search_url, {'q': 'of'})
+        self.assertContains(response, 'Children of Dune')
+        self.assertNotContains(response, 'Java, How To Program')
+
+
+class CategoryBookCountTests(TestCase):
+    """
+    This class contains tests for the denormalized book counts of categories.
+    """
+
+    def setUp(self):
+        """
+        This method runs before the execution of each test case.
+        """
+        self.client = Client()
+        self.english = models.Category.objects.create(name='English')
+        self.maths = models.Category.objects.create(name='Mathematics')
+
+    def book_counts(self):
+        """
+        Returns the stored book counts of the English and Mathematics
+        categories.
+        """
+        counts = dict(models.Category.objects.values_list('id', 'book_count'))
+        return counts[self.english.id], counts[self.maths.id]
+
+    def test_book_views_maintain_book_counts(self):
+        """
+        This test creates, moves and deletes a book through the book views and
+        asserts that the counts of the affected categories follow, and that
+        the counts are listed on the category-create.html template.
+        """
+        self.client.post(
+            reverse('book-create'),
+            {'category': self.maths.id, 'title': 'English Aid'})
+        self.assertEqual(self.book_counts(), (0, 1))
+
+        book = models.Book.objects.get(title='English Aid')
+        self.client.post(
+            reverse('book-edit', kwargs={'book_id': book.id}),
+            {'category': self.english.id, 'title': 'English Aid'})
+        self.assertEqual(self.book_counts(), (1, 0))
+
+        response = self.client.get(reverse('category-create'))
+        self.assertContains(
+            response, '<li>English (1)</li>', count=1, html=True)
+
+        self.client.post(reverse('book-delete', kwargs={'book_id': book.id}))
+        self.assertEqual(self.book_counts(), (0, 0))
+
+    def test_deleting_a_book_twice_decrements_once(self):
+        """
+        This test deletes a book that a concurrent request removes between
+        the view's lookup and its delete, and asserts that the category count
+        is decremented only once.
+        """
+        book = models.Book.objects.create(title='Algebra', category=self.maths)
+        counters.recount()
+        original_delete = models.Book.delete
+
+        def racing_delete(instance, *args, **kwargs):
+            models.Book.objects.filter(pk=instance.pk).delete()
+            counters.adjust(instance.category_id, -1)
+            return original_delete(instance, *args, **kwargs)
+
+        with mock.patch.object(models.Book, 'delete', racing_delete):
+            self.client.post(
+                reverse('book-delete', kwargs={'book_id': book.id}))
+        self.assertEqual(self.book_counts(), (0, 0))
+
+    def test_recount_categories_command_rebuilds_counts(self):
+        """
+        This test writes books behind the counters' back and asserts that the
+        recount_categories command fixes the counts.
+        """
+        models.Book.objects.bulk_create(
+            models.Book(title='Book {0}'.format(i), category=self.maths)
+            for i in range(3)
+        )
+        self.assertEqual(self.book_counts(), (0, 0))
+
+        call_command('recount_categories', stdout=io.StringIO())
+        self.assertEqual(self.book_counts(), (0, 3))
+
+
+class CategoryDeletionTests(TestCase):
+    """
+    This class contains tests for the set-based deletion of categories.
+    """
+
+    def setUp(self):
+        """
+        This method runs before the execution of each test case.
+        """
+        self.client = Client()
+        self.scifi = models.Category.objects.create(name='Science Fiction')
+        self.poetry = models.Category.objects.create(name='Poetry')
+        for category in (self.scifi, self.poetry):
+            models.Book.objects.bulk_create(
+                models.Book(title='Book {0}'.format(i), category=category)
+                for i in range(7)
+            )
+        counters.recount()
+        self.scifi.refresh_from_db()
+
+    def test_delete_category_removes_books_in_batches(self):
+        """
+        This test deletes a category three books at a time and asserts that
+        only its own books are removed, without loading them as models.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            deleted = deletion.delete_category(self.scifi, batch_size=3)
+        self.assertEqual(deleted, 7)
+        self.assertFalse(models.Category.objects.filter(pk=self.scifi.pk))
+        self.assertFalse(models.Book.objects.filter(category=self.scifi.pk))
+        self.assertEqual(
+            models.Book.objects.filter(category=self.poetry).count(), 7)
+
+        batches = [
+            query['sql'] for query in queries
+            if query['sql'].startswith(
+                'DELETE FROM "bookstore_book" WHERE "id" IN')
+        ]
+        self.assertEqual(len(batches), 3)
+
+    @override_settings(BOOKSTORE_DEFERRED_DELETE_THRESHOLD=5)
+    def test_large_categories_are_deleted_in_the_background(self):
+        """
+        This test asserts that the category-delete page hands categories
+        with more books than the threshold to the background deletion and
+        still gives the usual feedback.
+        """
+        delete_url = reverse(
+            'category-delete', kwargs={'categ_id': self.scifi.id})
+        with mock.patch.object(
+                deletion, 'delete_category_deferred') as deferred:
+            response = self.client.post(delete_url)
+
+        deferred.assert_called_once_with(self.scifi)
+        self.assertContains(
+            response,
+            '<p>Category of id {0} does not exist!</p>'.format(self.scifi.id),
+            count=1,
+            status_code=200,
+            html=True
+        )
+
+
+class BookEditQueryTests(TestCase):
+    """
+    This class contains query-count tests for editing books.
+    """
+
+    def setUp(self):
+        """
+        This method runs before the execution of each test case.
+        """
+        self.client = Client()
+        self.english = models.Category.objects.create(name='English')
+        self.maths = models.Category.objects.create(name='Mathematics')
+        self.book = models.Book.objects.create(
+            title='English Aid', category=self.english)
+        self.edit_url = reverse('book-edit', kwargs={'book_id': self.book.id})
+        # warm up the cached category choices rendered by BookForm
+        str(forms.BookForm())
+
+    def edit(self, data):
+        """
+        Posts `data` to the edit page, asserts that the edit succeeded and
+        returns the SQL statements that it ran.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.edit_url, data)
+        self.assertContains(
+            response, '<p>Edit successful!</p>', count=1, html=True)
+        return [query['sql'] for query in queries]
+
+    def test_unchanged_edit_does_not_write(self):
+        """
+        This test asserts that submitting the current values only reads the
+        book and the generation of the cached category choices.
+        """
+        statements = self.edit(
+            {'title': 'English Aid', 'category': self.english.id})
+        self.assertEqual(len(statements), 2)
+        self.assertTrue(all(sql.startswith('SELECT') for sql in statements))
+
+    def test_title_edit_updates_only_the_title(self):
+        """
+        This test asserts that a title-only edit reads the book and updates
+        its title column alone.
+        """
+        statements = self.edit(
+            {'title': 'English Aid, 2nd Edition', 'category': self.english.id})
+        statements = [sql for sql in statements if 'SAVEPOINT' not in sql]
+        # the book, the generation of the cached category choices, the
+        # update and its entry in the change feed
+        self.assertEqual(len(statements), 4)
+        self.assertIn('SET "title" = ', statements[2])
+        self.assertNotIn('"category_id" = %s', statements[2])
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.title, 'English Aid, 2nd Edition')
+
+    def test_category_edit_validates_and_updates_only_the_category(self):
+        """
+        This test asserts that a category-only edit checks that the category
+        exists without loading it, updates only the category column and moves
+        the book between the category counters.
+        """
+        statements = self.edit(
+            {'title': 'English Aid', 'category': self.maths.id})
+        # the book, the generation of the cached category choices, the
+        # category check, three updates and the entry in the change feed, in
+        # a transaction
+        self.assertEqual(
+            len([sql for sql in statements if 'SAVEPOINT' not in sql]), 7)
+        updates = [sql for sql in statements if sql.startswith('UPDATE')]
+        self.assertEqual(len(updates), 3)
+        self.assertIn('SET "category_id" = ', updates[0])
+        self.assertNotIn('"title"', updates[0])
+        self.assertFalse([
+            sql for sql in statements
+            if sql.startswith('SELECT "bookstore_category"."id", '
+                              '"bookstore_category"."name"')
+        ])
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.category_id, self.maths.id)
+
+    def test_edit_with_unknown_category_is_rejected(self):
+        """
+        This test asserts that an unknown category, including an id beyond
+        the range of the database integers, leaves the book untouched.
+        """
+        response = self.client.post(
+            self.edit_url, {'title': 'Renamed', 'category': 999})
+        self.assertContains(
+            response, '<p>Category of id 999 does not exist!</p>',
+            count=1, status_code=400, html=True)
+        huge = '9' * 30
+        response = self.client.post(
+            self.edit_url, {'title': 'Renamed', 'category': huge})
+        self.assertContains(
+            response, '<p>Category of id {0} does not exist!</p>'.format(huge),
+            count=1, status_code=400, html=True)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.title, 'English Aid')
+
+
+class JsonApiTests(TestCase):
+    """
+    This class contains tests for the read-only JSON API.
+    """
+
+    def setUp(self):
+        """
+        This method runs before the execution of each test case.
+        """
+        self.client = Client()
+        self.programming = models.Category.objects.create(name='Programming')
+        self.books = [
+            models.Book.objects.create(
+                title='Book {0}'.format(i), category=self.programming)
+            for i in range(3)
+        ]
+
+    def test_user_can_page_through_books(self):
+        """
+        This test asserts that the book list returns compact rows with the
+        category name and links to the next page.
+        """
+        response = self.client.get(reverse('api-book-list'), {'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content.decode())
+        self.assertEqual(data['results'][0], {
+            'id': self.books[0].id,
+            'title': 'Book 0',
+            'category_id': self.programming.id,
+            'category': 'Programming'
+        })
+        self.assertEqual(len(data['results']), 2)
+
+        data = json.loads(self.client.get(data['next']).content.decode())
+        self.assertEqual(
+            [row['title'] for row in data['results']], ['Book 2'])
+        self.assertIsNone(data['next'])
+
+    def test_out_of_range_category_filter_is_rejected(self):
+        """
+        This test asserts that filtering the book list by a category id
+        beyond the range of the database integers is answered with a 400.
+        """
+        url = reverse('api-book-list')
+        response = self.client.get(url, {'category': '9' * 30})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('category id', response.json()['error'])
+        response = self.client.get(url, {'category': self.programming.id})
+        self.assertEqual(len(response.json()['results']), 3)
+
+    def test_detail_endpoints(self):
+        """
+        This test asserts that the detail endpoints return a single row, and
+        a 404 for unknown ids.
+        """
+        response = self.client.get(reverse(
+            'api-category-detail', kwargs={'categ_id': self.programming.id}))
+        self.assertEqual(json.loads(response.content.decode()), {
+            'id': self.programming.id,
+            'name': 'Programming',
+            'book_count': 0
+        })
+        response = self.client.get(
+            reverse('api-book-detail', kwargs={'book_id': 999}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_conditional_get_returns_304_until_catalogue_changes(self):
+        """
+        This test asserts that repeating a request with the ETag received is
+        answered with an empty 304 after reading the generation of the
+        catalogue alone, until a book changes.
+        """
+        url = reverse('api-category-list')
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        self.client.post(reverse(
+            'book-delete', kwargs={'book_id': self.books[0].id}))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    @override_settings(BOOKSTORE_GENERATION_TTL=60)
+    def test_validators_follow_the_writes_of_other_processes(self):
+        """
+        This test asserts that the ETag is the same in every process and
+        changes with a write made by another process, even when the pages
+        may reuse the generation.
+        """
+        url = reverse('api-book-list')
+        etag = self.client.get(url)['ETag']
+        # another worker keeps nothing of this process in memory
+        cache._local_values.clear()
+        cache.invalidate_catalogue()
+        self.assertEqual(self.client.get(url)['ETag'], etag)
+
+        # what another process does: write the rows and the change feed
+        book = self.books[0]
+        models.Book.objects.filter(pk=book.pk).update(title='Renamed')
+        changes.record_ids(models.Book, 'update', [book.pk])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['results'][0]['title'], 'Renamed')
+
+
+class InstrumentationTests(TestCase):
+    """
+    This class contains tests for the per-request instrumentation.
+    """
+
+    def setUp(self):
+        """
+        This method runs before the execution of each test case.
+        """
+        self.client = Client()
+        instrumentation.registry.reset()
+        self.programming = models.Category.objects.create(name='Programming')
+
+    def test_responses_carry_server_timing(self):
+        """
+        This test asserts that a page reports its query count and SQL,
+        template, view and total times in a Server-Timing header.
+        """
+        response = self.client.get(reverse('book-create'))
+        timing = response['Server-Timing']
+        for metric in ('sql;dur=', 'tpl;dur=', 'view;dur=', 'total;dur='):
+            self.assertIn(metric, timing)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('book-create'))
+        self.assertIn(
+            'desc="{0} queries"'.format(len(queries)),
+            response['Server-Timing'])
+
+    def test_metrics_aggregate_requests_per_url_name(self):
+        """
+        This test asserts that the metrics endpoint exposes histograms and
+        query totals per URL name, and the slowest statements.
+        """
+        for _ in range(3):
+            self.client.get(reverse('category-create'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn(
+            'bookstore_total_duration_ms_count{url_name="category-create"} 3',
+            body)
+        self.assertIn(
+            'bookstore_total_duration_ms_bucket{url_name="category-create",'
+            'le="+Inf"} 3', body)
+        # the listing is served from the fragment cache after the first GET;
+        # every GET reads the generation of the catalogue
+        self.assertIn(
+            'bookstore_queries_total{url_name="category-create"} 4', body)
+        self.assertIn('# category-create ', body)
+
+
+class ListingCacheTests(TestCase):
+    """
+    This class contains tests for the fragment and response caches.
+    """
+
+    def setUp(self):
+        """
+        This method runs before the execution of each test case.
+        """
+        self.client = Client()
+        self.programming = models.Category.objects.create(name='Programming')
+        models.Book.objects.create(title='SICP', category=self.programming)
+
+    def test_listing_fragments_are_cached_until_the_catalogue_changes(self):
+        """
+        This test asserts that a repeated GET of the book-create page only
+        reads the generation of the catalogue, and that creating a book
+        through the view refreshes the cached listing.
+        """
+        create_book_url = reverse('book-create')
+        self.client.get(create_book_url)
+        with self.assertNumQueries(1):
+            response = self.client.get(create_book_url)
+        self.assertContains(
+            response, '<li>SICP (Programming)</li>', count=1, html=True)
+
+        self.client.post(
+            create_book_url,
+            {'category': self.programming.id, 'title': 'Dune'})
+        response = self.client.get(create_book_url)
+        self.assertContains(
+            response, '<li>Dune (Programming)</li>', count=1, html=True)
+
+    def test_search_responses_are_cached_per_url(self):
+        """
+        This test asserts that search results are served from the response
+        cache until a book changes.
+        """
+        search_url = reverse('book-search')
+        self.client.get(search_url, {'q': 'SIC'})
+        with self.assertNumQueries(1):
+            response = self.client.get(search_url, {'q': 'SIC'})
+        self.assertContains(response, '<li>SICP (Programming)</li>', html=True)
+
+        models.Book.objects.create(title='SICM', category=self.programming)
+        response = self.client.get(search_url, {'q': 'SIC'})
+        self.assertContains(response, '<li>SICM (Programming)</li>', html=True)
+
+    def test_writes_of_other_processes_refresh_the_cached_pages(self):
+        """
+        This test asserts that a write recorded in the change feed by
+        another process, which cannot reach the memory of this one, moves
+        the generation of the cached pages.
+        """
+        create_book_url = reverse('book-create')
+        self.client.get(create_book_url)
+        book = models.Book.objects.get()
+        # what another process does: write the rows and the change feed
+        models.Book.objects.filter(pk=book.pk).update(title='SICP, 2nd ed.')
+        changes.record_ids(models.Book, 'update', [book.pk])
+        response = self.client.get(create_book_url)
+        self.assertContains(
+            response, '<li>SICP, 2nd ed. (Programming)</li>', html=True)
+
+    @override_settings(BOOKSTORE_GENERATION_TTL=60)
+    def test_generation_ttl_lets_a_process_reuse_the_generation(self):
+        """
+        This test asserts that BOOKSTORE_GENERATION_TTL lets a process serve
+        cached values without reading the generation, until its own writes.
+        """
+        cache.invalidate_catalogue()
+        cache.fragment('ttl-test', lambda: 'first')
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                cache.fragment('ttl-test', lambda: 'second'), 'first')
+        models.Book.objects.create(title='Dune', category=self.programming)
+        self.assertEqual(
+            cache.fragment('ttl-test', lambda: 'third'), 'third')
+
+    def test_responses_using_the_csrf_token_are_not_cached(self):
+        """
+        This test asserts that responses that embed the CSRF token of the
+        client are never served to another client.
+        """
+        calls = []
+
+        @cache.cached_get
+        def view(request):
+            calls.append(request)
+            return HttpResponse(get_token(request))
+
+        factory = RequestFactory()
+        view(factory.get('/with-token'))
+        view(factory.get('/with-token'))
+        self.assertEqual(len(calls), 2)
+
+    def test_local_cache_is_bounded(self):
+        """
+        This test asserts that the local LRU evicts the least recently used
+        entries beyond its entry and size limits.
+        """
+        lru = cache.LRUCache(max_entries=2, max_bytes=10)
+        lru.set('a', 'aaa')
+        lru.set('b', 'bbb')
+        lru.get('a')
+        lru.set('c', 'ccc')
+        self.assertEqual(lru.get('b'), None)
+        self.assertEqual(lru.get('a'), 'aaa')
+        lru.set('d', 'dddddddd')
+        self.assertEqual(len(lru), 1)
+        self.assertLessEqual(lru.bytes, 10)
+
+
+class ProductionDatabaseBackendTests(TestCase):
+    """
+    This class contains tests for the SQLite backend of the production
+    database mode.
+    """
+
+    def setUp(self):
+        """
+        This method runs before the execution of each test case.
+        """
+        handle, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        for suffix in ('-wal', '-shm'):
+            self.addCleanup(
+                lambda name: os.path.exists(name) and os.remove(name),
+                path + suffix)
+        settings_dict = dict(connection.settings_dict)
+        settings_dict.update({
+            'ENGINE': 'inventory.backends.sqlite3',
+            'NAME': path,
+            'OPTIONS': {'timeout': 20},
+        })
+        self.wrapper = DatabaseWrapper(settings_dict, alias='production')
+        self.addCleanup(self.wrapper.close)
+
+    def pragma(self, name):
+        """
+        Returns the value of a pragma on the production connection.
+        """
+        with self.wrapper.cursor() as cursor:
+            cursor.execute('PRAGMA {0}'.format(name))
+            return cursor.fetchone()[0]
+
+    def test_connections_are_tuned(self):
+        """
+        This test asserts that new connections run in WAL mode with the busy
+        timeout and cache sizes of the production mode.
+        """
+        self.assertEqual(self.pragma('journal_mode'), 'wal')
+        self.assertEqual(self.pragma('synchronous'), 1)
+        self.assertEqual(self.pragma('busy_timeout'), 20000)
+        self.assertEqual(self.pragma('cache_size'), -65536)
+
+    def test_transactions_take_the_write_lock_up_front(self):
+        """
+        This test asserts that atomic blocks begin with BEGIN IMMEDIATE, so
+        the write lock is waited for with the busy timeout.
+        """
+        self.wrapper.ensure_connection()
+        with CaptureQueriesContext(self.wrapper) as queries:
+            self.wrapper._start_transaction_under_autocommit()
+        self.addCleanup(self.wrapper.rollback)
+        self.assertEqual(queries[0]['sql'], 'BEGIN IMMEDIATE')
+        self.assertTrue(self.wrapper.connection.in_transaction)
+
+
+@override_settings(BOOKSTORE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TestCase):
+    """
+    This class contains tests for routing the listing queries to a read
+    replica, with a second SQLite file standing in for the replica.
+    """
+
+    def setUp(self):
+        """
+        This method runs before the execution of each test case.
+        """
+        self.client = Client()
+
+        handle, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        connections.databases['replica'] = dict(
+            connection.settings_dict, NAME=path)
+        self.addCleanup(connections.databases.pop, 'replica')
+        self.addCleanup(delattr, connections._connections, 'replica')
+        self.addCleanup(lambda: connections['replica'].close())
+        with connections['replica'].schema_editor() as editor:
+            editor.create_model(models.Category)
+            editor.create_model(models.Book)
+            editor.create_model(models.Change)
+
+        self.primary = models.Category.objects.create(name='Primary')
+        self.replica = models.Category.objects.using('replica').create(
+            name='Replica')
+
+    def replay(self):
+        """
+        Copies the change feed of the primary to the replica, as a replica
+        that has caught up with the primary would have it.
+        """
+        replica = models.Change.objects.using('replica')
+        replica.all().delete()
+        feed = list(models.Change.objects.all())
+        created = [(change.seq, change.created) for change in feed]
+        # bulk_create() stamps the changes with the current time
+        replica.bulk_create(feed)
+        for seq, time in created:
+            replica.filter(seq=seq).update(created=time)
+
+    def test_listing_pages_read_from_the_replica(self):
+        """
+        This test asserts that GET requests list the categories and category
+        choices of a replica that has caught up with the primary, and read
+        everything else from the primary.
+        """
+        self.replay()
+        response = self.client.get(reverse('category-create'))
+        self.assertContains(response, '<li>Replica (0)</li>', html=True)
+        self.assertNotContains(response, '<li>Primary (0)</li>', html=True)
+
+        response = self.client.get(reverse('book-create'))
+        self.assertContains(response, '>Replica</option>')
+        self.assertNotContains(response, '>Primary</option>')
+
+        response = self.client.get(reverse(
+            'category-delete', kwargs={'categ_id': self.primary.id}))
+        self.assertContains(response, '<strong>Name:</strong>Primary')
+
+    def test_other_reads_of_get_requests_go_to_the_primary(self):
+        """
+        This test asserts that the API endpoints, the change feed and the
+        job endpoints of GET requests read from the primary.
+        """
+        self.replay()
+        job = jobs.enqueue('recount_categories')
+        response = self.client.get(
+            reverse('api-job-detail', kwargs={'job_id': job.pk}))
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(reverse('api-category-list'))
+        self.assertEqual(
+            [row['name'] for row in response.json()['results']],
+            ['Primary'])
+
+        models.Change.objects.using('replica').all().delete()
+        response = self.client.get(reverse('api-changes'))
+        self.assertTrue(response.json()['changes'])
+
+    def test_lagging_replica_is_not_read(self):
+        """
+        This test asserts that the listing fetched right after a write, which
+        the replica has not replayed yet, is read from the primary.
+        """
+        self.replay()
+        response = self.client.get(reverse('category-create'))
+        self.assertContains(response, '<li>Replica (0)</li>', html=True)
+
+        response = self.client.post(
+            reverse('category-create') + '?response=redirect',
+            {'name': 'Written'}, follow=True)
+        self.assertEqual(response.redirect_chain[0][1], 303)
+        self.assertContains(response, '<li>Written (0)</li>', html=True)
+        self.assertContains(response, '<li>Primary (0)</li>', html=True)
+        self.assertNotContains(response, '<li>Replica (0)</li>', html=True)
+
+    def test_writes_go_to_the_primary(self):
+        """
+        This test asserts that POST requests write to and read from the
+        primary.
+        """
+        self.replay()
+        response = self.client.post(
+            reverse('category-create'), {'name': 'Written'})
+        self.assertContains(
+            response, '<li>Written (0)</li>', status_code=201, html=True)
+        self.assertContains(
+            response, '<li>Primary (0)</li>', status_code=201, html=True)
+        self.assertTrue(
+            models.Category.objects.filter(name='Written').exists())
+        self.assertFalse(models.Category.objects.using('replica').filter(
+            name='Written').exists())
+
+    def test_reads_after_a_write_are_pinned_to_the_primary(self):
+        """
+        This test asserts that only Book and Category reads go to the
+        replica inside catalogue_reads(), and that the first write sends the
+        reads that follow it to the primary.
+        """
+        router = routers.ReplicaRouter()
+        with routers.catalogue_reads('replica'):
+            self.assertIsNone(router.db_for_read(models.Job))
+            self.assertIsNone(router.db_for_read(models.Change))
+            self.assertEqual(
+                list(models.Category.objects.values_list('name', flat=True)),
+                ['Replica'])
+            models.Category.objects.create(name='Written')
+            self.assertEqual(
+                list(models.Category.objects.values_list('name', flat=True)),
+                ['Primary', 'Written'])
+        self.assertFalse(routers.reading_from_replicas())
+
+
+class AsgiTests(TransactionTestCase):
+    """
+    This class contains tests for the ASGI handler and the async views. The
+    async views query from pool threads, so the data they read is committed.
+    """
+
+    def setUp(self):
+        """
+        This method runs before the execution of each test case.
+        """
+        # the cache outlives the flushed tables of earlier tests
+        cache.invalidate_catalogue()
+        self.application = asgi.ASGIHandler()
+        self.category = models.Category.objects.create(name='Programming')
+        models.Book.objects.create(title='SICP', category=self.category)
+
+    def request(self, method, path, body=b'', headers=()):
+        """
+        Sends a request to the ASGI application and returns its status, its
+        headers as a list of pairs and its body.
+        """
+        received = [{'type': 'http.request', 'body': body}]
+        sent = []
+        scope = {
+            'type': 'http',
+            'method': method,
+            'path': path,
+            'query_string': b'',
+            'headers': [(b'host', b'testserver')] + list(headers),
+        }
+
+        async def receive():
+            return received.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(self.application(scope, receive, send))
+        headers = [
+            (name.decode('latin1'), value.decode('latin1'))
+            for name, value in sent[0]['headers']]
+        content = b''.join(message.get('body', b'') for message in sent[1:])
+        return sent[0]['status'], headers, content.decode('utf-8')
+
+    def test_async_book_create_lists_books_and_choices(self):
+        """
+        This test asserts that the async book-create page renders the book
+        listing and the category choices, and sets the CSRF cookie.
+        """
+        status, headers, content = self.request('GET', reverse('book-create'))
+        self.assertEqual(status, 200)
+        self.assertInHTML('<li>SICP (Programming)</li>', content)
+        self.assertIn(
+            '<option value="{0}">Programming</option>'.format(
+                self.category.id),
+            content)
+        self.assertIn('csrftoken=', dict(headers)['Set-Cookie'])
+
+    def test_async_book_create_saves_books_with_csrf_protection(self):
+        """
+        This test asserts that a POST to the async book-create view needs the
+        CSRF token and then creates the book.
+        """
+        data = 'category={0}&title=Dune'.format(self.category.id)
+        form = [(b'content-type', b'application/x-www-form-urlencoded')]
+        status, headers, content = self.request(
+            'POST', reverse('book-create'), data.encode(), form)
+        self.assertEqual(status, 403)
+        self.assertFalse(models.Book.objects.filter(title='Dune').exists())
+
+        status, headers, content = self.request('GET', reverse('book-create'))
+        token = dict(headers)['Set-Cookie'].split(';')[0].split('=')[1]
+        data += '&csrfmiddlewaretoken={0}'.format(token)
+        cookie = [(b'cookie', 'csrftoken={0}'.format(token).encode())]
+        status, headers, content = self.request(
+            'POST', reverse('book-create'), data.encode(), form + cookie)
+        self.assertEqual(status, 201)
+        self.assertInHTML('<li>Dune (Programming)</li>', content)
+        self.assertTrue(models.Book.objects.filter(title='Dune').exists())
+
+    def test_other_views_are_served_by_the_wsgi_handler(self):
+        """
+        This test asserts that views without an async variant, and unknown
+        URLs, are served with the whole middleware stack.
+        """
+        status, headers, content = self.request(
+            'GET', reverse('api-book-list'))
+        self.assertEqual(status, 200)
+        self.assertIn('Server-Timing', dict(headers))
+        self.assertEqual(json.loads(content)['results'][0]['title'], 'SICP')
+
+        status, headers, content = self.request('GET', '/no/such/page')
+        self.assertEqual(status, 404)
+
+
+@override_settings(BOOKSTORE_API_TOKENS=['back-office'])
+class BatchWriteTests(TestCase):
+    """
+    This class contains tests for the batch write endpoint.
+    """
+
+    def setUp(self):
+        """
+        This method runs before the execution of each test case.
+        """
+        self.client = Client(
+            enforce_csrf_checks=True, HTTP_AUTHORIZATION='Bearer back-office')
+        self.url = reverse('api-batch')
+        self.programming = models.Category.objects.create(name='Programming')
+        self.fiction = models.Category.objects.create(name='Fiction')
+        self.sicp = models.Book.objects.create(
+            title='SICP', category=self.programming)
+        self.dune = models.Book.objects.create(
+            title='Dune', category=self.programming)
+        counters.recount()
+
+    def post(self, operations):
+        """
+        Posts a batch of operations and returns the response.
+        """
+        return self.client.post(
+            self.url, json.dumps({'operations': operations}),
+            content_type='application/json')
+
+    def test_batch_is_applied_in_one_request(self):
+        """
+        This test asserts that creations, edits and deletions of books and
+        categories are applied together, with a result for each operation
+        and up to date book counts.
+        """
+        response = self.post([
+            {'action': 'create', 'model': 'category',
+             'data': {'name': 'Poetry'}},
+            {'action': 'create', 'model': 'book',
+             'data': {'title': 'Hyperion', 'category': self.fiction.id}},
+            {'action': 'update', 'model': 'book', 'id': self.dune.id,
+             'data': {'category': self.fiction.id}},
+            {'action': 'update', 'model': 'category', 'id': self.fiction.id,
+             'data': {'name': 'Science Fiction'}},
+            {'action': 'delete', 'model': 'book', 'id': self.sicp.id},
+        ])
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        poetry = models.Category.objects.get(name='Poetry')
+        hyperion = models.Book.objects.get(title='Hyperion')
+        self.assertEqual(results, [
+            {'id': poetry.id, 'status': 'created'},
+            {'id': hyperion.id, 'status': 'created'},
+            {'id': self.dune.id, 'status': 'updated'},
+            {'id': self.fiction.id, 'status': 'updated'},
+            {'id': self.sicp.id, 'status': 'deleted'},
+        ])
+        self.assertEqual(hyperion.category_id, self.fiction.id)
+        self.assertFalse(models.Book.objects.filter(pk=self.sicp.id).exists())
+        self.assertEqual(
+            dict(models.Category.objects.values_list('name', 'book_count')),
+            {'Programming': 0, 'Science Fiction': 2, 'Poetry': 0})
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        """
+        This test asserts that creating and editing many books takes the same
+        number of queries as creating and editing a few.
+        """
+        self.post([])  # warms the cached category choices of BookForm
+        books = [
+            models.Book(title='Book {0}'.format(number),
+                        category=self.programming)
+            for number in range(50)]
+        models.Book.objects.bulk_create(books)
+        ids = list(models.Book.objects.filter(
+            title__startswith='Book ').values_list('id', flat=True))
+        operations = [
+            {'action': 'create', 'model': 'book',
+             'data': {'title': 'New {0}'.format(number),
+                      'category': self.fiction.id}}
+            for number in range(50)
+        ] + [
+            {'action': 'update', 'model': 'book', 'id': pk,
+             'data': {'title': 'Renamed {0}'.format(pk)}}
+            for pk in ids
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(operations)
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(len(queries), 15)
+        self.assertEqual(
+            models.Book.objects.filter(title__startswith='Renamed ').count(),
+            50)
+        self.assertEqual(
+            models.Category.objects.get(pk=self.fiction.id).book_count, 50)
+
+    def test_deleting_a_category_after_moving_its_books(self):
+        """
+        This test asserts that books can be moved out of a category that is
+        deleted in the same batch, and that the remaining books are deleted
+        with it.
+        """
+        response = self.post([
+            {'action': 'delete', 'model': 'category',
+             'id': self.programming.id},
+            {'action': 'update', 'model': 'book', 'id': self.dune.id,
+             'data': {'category': self.fiction.id}},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(models.Book.objects.values_list('title', 'category')),
+            [('Dune', self.fiction.id)])
+        self.assertFalse(
+            models.Category.objects.filter(pk=self.programming.id).exists())
+
+    def test_invalid_batches_change_nothing(self):
+        """
+        This test asserts that a batch with invalid operations is rejected as
+        a whole with the errors of each invalid operation.
+        """
+        response = self.post([
+            {'action': 'create', 'model': 'category',
+             'data': {'name': 'Poetry'}},
+            {'action': 'create', 'model': 'book',
+             'data': {'title': 'x' * 201, 'category': 999}},
+            {'action': 'delete', 'model': 'book', 'id': 999},
+            {'action': 'update', 'model': 'book', 'id': self.dune.id,
+             'data': {'category': self.programming.id}},
+            {'action': 'delete', 'model': 'category',
+             'id': self.programming.id},
+            {'action': 'publish', 'model': 'book'},
+        ])
+        self.assertEqual(response.status_code, 400)
+        errors = {
+            error['index']: error['errors']
+            for error in response.json()['errors']}
+        self.assertEqual(sorted(errors), [1, 2, 3, 5])
+        self.assertEqual(sorted(errors[1]), ['category', 'title'])
+        self.assertEqual(
+            errors[2], {'__all__': ['Book of id 999 does not exist!']})
+        self.assertIn('category', errors[3])
+        self.assertIn('action', errors[5])
+        self.assertFalse(
+            models.Category.objects.filter(name='Poetry').exists())
+        self.assertEqual(models.Book.objects.count(), 2)
+
+        response = self.client.post(
+            self.url, 'not json', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_is_validated_in_the_transaction_of_its_writes(self):
+        """
+        This test asserts that the objects named by a batch are read in the
+        transaction that applies it, so that the counters cannot drift.
+        """
+        depths = []
+        validate = batch.validate
+
+        def recording_validate(operations):
+            depths.append(len(connection.savepoint_ids))
+            return validate(operations)
+
+        depth = len(connection.savepoint_ids)
+        with mock.patch.object(batch, 'validate', recording_validate):
+            response = self.post([
+                {'action': 'delete', 'model': 'book', 'id': self.dune.id}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(depths, [depth + 1])
+        self.assertEqual(
+            models.Category.objects.get(pk=self.programming.id).book_count,
+            1)
+
+    def test_batches_require_an_api_token(self):
+        """
+        This test asserts that clients without a valid API token cannot
+        apply batches.
+        """
+        operations = json.dumps({'operations': [
+            {'action': 'delete', 'model': 'book', 'id': self.dune.id}]})
+        for client in (
+                Client(enforce_csrf_checks=True),
+                Client(HTTP_AUTHORIZATION='Bearer guess')):
+            response = client.post(
+                self.url, operations, content_type='application/json')
+            self.assertEqual(response.status_code, 401)
+        self.assertTrue(models.Book.objects.filter(pk=self.dune.id).exists())
+
+    def test_new_ids_are_set_without_bulk_insert_ids(self):
+        """
+        This test asserts that the ids of created objects are set on
+        databases that neither return nor predictably number the ids of bulk
+        inserts, without recording the inserts twice.
+        """
+        start = changes.head()
+        with mock.patch.object(connection, 'vendor', 'mysql'):
+            response = self.post([
+                {'action': 'create', 'model': 'category',
+                 'data': {'name': 'Poetry'}},
+                {'action': 'create', 'model': 'book',
+                 'data': {'title': 'Emma', 'category': self.fiction.id}},
+            ])
+        results = response.json()['results']
+        self.assertEqual(
+            models.Category.objects.get(pk=results[0]['id']).name, 'Poetry')
+        self.assertEqual(
+            models.Book.objects.get(pk=results[1]['id']).title, 'Emma')
+        self.assertEqual(
+            models.Change.objects.filter(seq__gt=start).count(), 2)
+
+
+class TemplateRenderingTests(TestCase):
+    """
+    This class contains tests for the compiled template cache and the lean
+    rendering of the listings.
+    """
+
+    def test_format_rows_escapes_every_value(self):
+        """
+        This test asserts that format_rows escapes the values of each row
+        like the Django template language does.
+        """
+        html = format_rows(
+            [(1, '<b>Tom & "Jerry"</b>', "O'Reilly")], '<li>{1} ({2})</li>')
+        self.assertEqual(
+            html,
+            '<li>&lt;b&gt;Tom &amp; &quot;Jerry&quot;&lt;/b&gt; '
+            '(O&#39;Reilly)</li>')
+
+    @override_settings(TEMPLATES=[{
+        'BACKEND': 'bookstore.instrumentation.TimedDjangoTemplates',
+        'OPTIONS': {
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
+        },
+    }])
+    def test_prewarm_compiles_the_bookstore_templates(self):
+        """
+        This test asserts that prewarm() leaves every bookstore template
+        compiled in the cached loader.
+        """
+        rendering.prewarm()
+        loader = engines.all()[0].engine.template_loaders[0]
+        self.assertEqual(
+            sorted(loader.get_template_cache), rendering.TEMPLATE_NAMES)
+        self.assertIn('book-listing.html', rendering.TEMPLATE_NAMES)
+
+
+class ListingRecordTests(TestCase):
+    """
+    This class contains tests for the read models of the listings.
+    """
+
+    def setUp(self):
+        """
+        This method runs before the execution of each test case.
+        """
+        self.client = Client()
+        self.programming = models.Category.objects.create(name='Programming')
+        self.sicp = models.Book.objects.create(
+            title='SICP', category=self.programming)
+
+    def test_listing_pages_are_records(self):
+        """
+        This test asserts that listing pages hold records with the fields
+        that the templates render.
+        """
+        books, next_after = queries.listing_page(queries.book_listing())
+        self.assertEqual(
+            books, [queries.BookRecord(self.sicp.id, 'SICP', 'Programming')])
+        self.assertEqual(books[0].category, 'Programming')
+        self.assertIsNone(next_after)
+
+        categories, next_after = queries.listing_page(
+            queries.category_listing())
+        self.assertEqual(categories[0].name, 'Programming')
+
+    def test_listings_do_not_instantiate_models(self):
+        """
+        This test asserts that rendering the listing pages creates no Book or
+        Category instances besides the empty instance of each ModelForm.
+        """
+        models.Book.objects.bulk_create(
+            models.Book(title='Book {0}'.format(i), category=self.programming)
+            for i in range(20))
+        instantiated = []
+
+        def count(sender, **kwargs):
+            instantiated.append(sender)
+
+        post_init.connect(count, sender=models.Book)
+        post_init.connect(count, sender=models.Category)
+        self.addCleanup(post_init.disconnect, count, sender=models.Book)
+        self.addCleanup(post_init.disconnect, count, sender=models.Category)
+
+        response = self.client.get(reverse('book-create'))
+        self.assertContains(
+            response, '<li>SICP (Programming)</li>', count=1, html=True)
+        response = self.client.get(reverse('category-create'))
+        self.assertContains(
+            response, '<li>Programming (0)</li>', count=1, html=True)
+        self.assertEqual(instantiated, [models.Book, models.Category])
+
+
+class LightweightCreateResponseTests(TestCase):
+    """
+    This class contains tests for the lightweight responses to creates.
+    """
+
+    def setUp(self):
+        """
+        This method runs before the execution of each test case.
+        """
+        self.client = Client()
+        self.programming = models.Category.objects.create(name='Programming')
+        models.Book.objects.create(title='SICP', category=self.programming)
+
+    def test_json_response_holds_only_the_created_book(self):
+        """
+        This test asserts that a create asking for JSON gets the created book
+        and the feedback without the listing, without querying the listing.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse('book-create'),
+                {'category': self.programming.id, 'title': 'Dune'},
+                HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 201)
+        book = models.Book.objects.get(title='Dune')
+        self.assertEqual(response.json(), {
+            'id': book.id,
+            'title': 'Dune',
+            'category_id': self.programming.id,
+            'category': 'Programming',
+            'feedback': 'Dune added to Programming category!'
+        })
+        self.assertFalse(any(
+            query['sql'].startswith('SELECT') and
+            'FROM "bookstore_book"' in query['sql'] for query in queries))
+
+    def test_query_flag_selects_json_for_categories(self):
+        """
+        This test asserts that the `response` query parameter selects the
+        JSON response of category-create.
+        """
+        response = self.client.post(
+            reverse('category-create') + '?response=json',
+            {'name': 'Fiction'})
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(data['name'], 'Fiction')
+        self.assertEqual(data['feedback'], 'Category: Fiction created!')
+        self.assertTrue(
+            models.Category.objects.filter(pk=data['id']).exists())
+
+    def test_redirect_mode_redirects_to_the_listing(self):
+        """
+        This test asserts that the redirect mode answers a create with a 303
+        to the listing page.
+        """
+        response = self.client.post(
+            reverse('book-create') + '?response=redirect',
+            {'category': self.programming.id, 'title': 'Dune'})
+        self.assertEqual(response.status_code, 303)
+        self.assertTrue(response['Location'].endswith(reverse('book-create')))
+        response = self.client.get(response['Location'])
+        self.assertContains(
+            response, '<li>Dune (Programming)</li>', count=1, html=True)
+
+    def test_invalid_categories_are_rejected_in_every_mode(self):
+        """
+        This test asserts that a category create with an invalid name is
+        answered with its errors: as JSON in the json mode, and on the HTML
+        page with the form in the redirect mode.
+        """
+        response = self.client.post(
+            reverse('category-create') + '?response=json', {'name': ''})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.json()['errors']), ['name'])
+
+        response = self.client.post(
+            reverse('category-create') + '?response=redirect',
+            {'name': 'x' * 201})
+        self.assertContains(
+            response, 'Ensure this value has at most 200 characters',
+            status_code=400)
+        self.assertEqual(models.Category.objects.count(), 1)
+
+    def test_invalid_books_are_rejected_in_every_mode(self):
+        """
+        This test asserts that a book create naming an unknown category is
+        answered with its errors: as JSON in the json mode, and on the HTML
+        page with the form in the redirect mode.
+        """
+        response = self.client.post(
+            reverse('book-create'), {'category': 999, 'title': 'Dune'},
+            HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.json()['errors']), ['category'])
+
+        response = self.client.post(
+            reverse('book-create') + '?response=redirect',
+            {'category': 999, 'title': 'Dune'})
+        self.assertContains(
+            response, 'Select a valid choice', status_code=400)
+        self.assertFalse(models.Book.objects.filter(title='Dune').exists())
+        self.assertEqual(
+            models.Category.objects.get(pk=self.programming.id).book_count,
+            0)
+
+    def test_html_remains_the_default(self):
+        """
+        This test asserts that a create without a response mode still renders
+        the whole listing.
+        """
+        response = self.client.post(
+            reverse('category-create'), {'name': 'Fiction'},
+            HTTP_ACCEPT='text/html,application/json')
+        self.assertContains(
+            response, '<li>Programming (0)</li>', status_code=201, html=True)
+
+
+class ChangeFeedTests(TestCase):
+    """
+    This class contains tests for the change feed of books and categories.
+    """
+
+    def setUp(self):
+        """
+        This method runs before the execution of each test case.
+        """
+        self.client = Client()
+        self.url = reverse('api-changes')
+        self.programming = models.Category.objects.create(name='Programming')
+        self.sicp = models.Book.objects.create(
+            title='SICP', category=self.programming)
+
+    def feed(self, **params):
+        """
+        Reads the change feed with `params` and returns the decoded response.
+        """
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def summary(self, since=0):
+        """
+        Returns the (model, id, action, data) of the changes after `since`.
+        """
+        return [
+            (change['model'], change['id'], change['action'], change['data'])
+            for change in changes.since(since, changes.MAX_LIMIT)]
+
+    def test_saves_and_deletes_are_recorded_in_order(self):
+        """
+        This test asserts that creating, editing and deleting books and
+        categories appends their changes to the feed in order.
+        """
+        self.sicp.title = 'SICP, 2nd Edition'
+        self.sicp.save(update_fields=['title'])
+        self.client.post(
+            reverse('book-delete', kwargs={'book_id': self.sicp.id}))
+        self.assertEqual(self.summary(), [
+            ('category', self.programming.id, 'create',
+             {'name': 'Programming'}),
+            ('book', self.sicp.id, 'create',
+             {'title': 'SICP', 'category_id': self.programming.id}),
+            ('book', self.sicp.id, 'update',
+             {'title': 'SICP, 2nd Edition',
+              'category_id': self.programming.id}),
+            ('book', self.sicp.id, 'delete', None),
+        ])
+
+    def test_bulk_writes_are_recorded(self):
+        """
+        This test asserts that batches, imports and set-based deletes, which
+        send no model signals, record their changes too.
+        """
+        start = changes.head()
+        with self.settings(BOOKSTORE_API_TOKENS=['back-office']):
+            response = self.client.post(
+                reverse('api-batch'), json.dumps({'operations': [
+                    {'action': 'create', 'model': 'category',
+                     'data': {'name': 'Fiction'}},
+                    {'action': 'update', 'model': 'book', 'id': self.sicp.id,
+                     'data': {'title': 'SICP, 2nd Edition'}},
+                ]}), content_type='application/json',
+                HTTP_AUTHORIZATION='Bearer back-office')
+        fiction = response.json()['results'][0]['id']
+        importer.import_books([('Dune', 'Fiction'), ('Emma', 'Classics')])
+        dune = models.Book.objects.get(title='Dune')
+        emma = models.Book.objects.get(title='Emma')
+        classics = emma.category_id
+        deletion.delete_books(fiction)
+        self.assertEqual(self.summary(start), [
+            ('category', fiction, 'create', {'name': 'Fiction'}),
+            ('book', self.sicp.id, 'update',
+             {'title': 'SICP, 2nd Edition',
+              'category_id': self.programming.id}),
+            ('category', classics, 'create', {'name': 'Classics'}),
+            ('book', dune.id, 'create',
+             {'title': 'Dune', 'category_id': fiction}),
+            ('book', emma.id, 'create',
+             {'title': 'Emma', 'category_id': classics}),
+            ('book', dune.id, 'delete', None),
+        ])
+
+    def test_feed_is_read_in_pages(self):
+        """
+        This test asserts that the endpoint returns the changes after
+        `since`, at most `limit` at a time, with the sequence number to read
+        from next.
+        """
+        first = self.feed(limit=1)
+        self.assertEqual(len(first['changes']), 1)
+        self.assertEqual(first['changes'][0]['model'], 'category')
+        self.assertTrue(first['more'])
+        second = self.feed(since=first['next'], limit=1)
+        self.assertEqual(second['changes'][0]['id'], self.sicp.id)
+        self.assertFalse(second['more'])
+        last = self.feed(since=second['next'])
+        self.assertEqual(last, {
+            'changes': [], 'next': second['next'], 'more': False})
+
+    def test_feed_parameters_are_validated(self):
+        """
+        This test asserts that invalid parameters are rejected.
+        """
+        for params in ({'since': 'x'}, {'limit': 0}, {'wait': 3600}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400)
+
+    def test_waiting_consumer_times_out_without_changes(self):
+        """
+        This test asserts that a consumer waiting for new changes gets an
+        empty page once its wait is over.
+        """
+        head = changes.head()
+        with mock.patch.object(changes, 'POLL_INTERVAL', 0.01):
+            data = self.feed(since=head, wait=0.05)
+        self.assertEqual(data['changes'], [])
+        self.assertEqual(data['next'], head)
+
+    def test_compaction_keeps_the_latest_change_of_each_object(self):
+        """
+        This test asserts that compaction drops the superseded changes only
+        up to the given sequence number, with DELETE statements that MySQL
+        accepts: without a subquery on the feed itself.
+        """
+        for title in ('A', 'B', 'C'):
+            self.sicp.title = title
+            self.sicp.save()
+        until = changes.head() - 1
+        out = io.StringIO()
+        call_command('compact_changes', until=until, stdout=out)
+        self.assertIn('Deleted 2 superseded changes.', out.getvalue())
+        self.assertEqual(
+            [(model, action, data and data.get('title'))
+             for model, pk, action, data in self.summary()],
+            [('category', 'create', None),
+             ('book', 'update', 'B'),
+             ('book', 'update', 'C')])
+        with CaptureQueriesContext(connection) as queries:
+            changes.compact()
+        self.assertEqual(
+            [data.get('title') for model, pk, action, data in self.summary()
+             if model == 'book'], ['C'])
+        deletes = [
+            query['sql'] for query in queries
+            if query['sql'].startswith('DELETE')]
+        self.assertEqual(len(deletes), 1)
+        self.assertNotIn('SELECT', deletes[0])
+
+    def test_appends_lock_the_feed_where_writers_run_concurrently(self):
+        """
+        This test asserts that on databases that run writers concurrently a
+        change is appended only once its transaction holds the lock of the
+        feed, which is created again when it is missing.
+        """
+        models.FeedLock.objects.all().delete()
+        # SQLite runs the statements without the FOR UPDATE clause
+        with mock.patch.object(
+                connection.features, 'has_select_for_update', True), \
+                mock.patch.object(
+                    connection.ops, 'for_update_sql', return_value=''), \
+                CaptureQueriesContext(connection) as queries:
+            self.sicp.title = 'SICP, 2nd Edition'
+            self.sicp.save()
+        statements = [query['sql'] for query in queries]
+        locks = [
+            position for position, sql in enumerate(statements)
+            if 'bookstore_feedlock' in sql]
+        insert = [
+            position for position, sql in enumerate(statements)
+            if sql.startswith('INSERT INTO "bookstore_change"')]
+        self.assertTrue(locks)
+        self.assertLess(max(locks), insert[0])
+        self.assertTrue(models.FeedLock.objects.filter(
+            pk=changes.LOCK_ID).exists())
+
+
+@override_settings(BOOKSTORE_API_TOKENS=['back-office'])
+class JobQueueTests(TestCase):
+    """
+    This class contains tests for the background job queue.
+    """
+
+    def setUp(self):
+        """
+        This method runs before the execution of each test case.
+        """
+        self.client = Client()
+        # the back-office client of the API endpoints that write
+        self.api = Client(
+            enforce_csrf_checks=True, HTTP_AUTHORIZATION='Bearer back-office')
+        self.programming = models.Category.objects.create(name='Programming')
+        models.Book.objects.create(title='SICP', category=self.programming)
+        models.Book.objects.create(title='HtDP', category=self.programming)
+        counters.recount()
+        files = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, files)
+        settings = override_settings(BOOKSTORE_JOB_FILES=files)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def run_jobs(self):
+        """
+        Runs the jobs that are due in this process and returns their number.
+        """
+        # like the test client, keep the connection of the test transaction
+        with mock.patch.object(jobs, 'close_old_connections'):
+            return jobs.work(burst=True)
+
+    def job(self, job_id):
+        """
+        Returns the status of a job from the job endpoint.
+        """
+        response = self.client.get(
+            reverse('api-job-detail', kwargs={'job_id': job_id}))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    @override_settings(BOOKSTORE_DEFERRED_IMPORT_SIZE=10)
+    def test_large_import_is_queued_and_run_by_a_worker(self):
+        """
+        This test asserts that a large upload is imported by a job, with its
+        progress and result reported by the job endpoint.
+        """
+        feed = SimpleUploadedFile(
+            'feed.csv', b'title,category\nDune,Fiction\nEmma,Classics\n')
+        response = self.client.post(reverse('book-import'), {'file': feed})
+        self.assertContains(response, 'Import queued as job', status_code=202)
+        job = models.Job.objects.get()
+        self.assertEqual(job.kind, 'import_books')
+        self.assertFalse(models.Book.objects.filter(title='Dune'))
+
+        self.assertEqual(self.run_jobs(), 1)
+        status = self.job(job.pk)
+        self.assertEqual(status['status'], 'succeeded')
+        self.assertEqual(status['progress'], {'done': 2, 'total': None})
+        self.assertEqual(status['result']['imported'], 2)
+        self.assertTrue(models.Book.objects.filter(title='Dune'))
+        self.assertFalse(os.path.exists(json.loads(job.payload)['input']))
+
+    def test_export_job_output_can_be_downloaded(self):
+        """
+        This test asserts that an export queued through the API writes every
+        book to a file that can be downloaded once the job has succeeded.
+        """
+        response = self.api.post(
+            reverse('api-job-create'),
+            json.dumps({'kind': 'export_books', 'data': {'format': 'csv'}}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()['id']
+        output_url = reverse('api-job-output', kwargs={'job_id': job_id})
+        self.assertEqual(self.client.get(output_url).status_code, 404)
+
+        self.run_jobs()
+        self.assertEqual(
+            self.job(job_id)['progress'], {'done': 2, 'total': 2})
+        response = self.client.get(output_url)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,title,category')
+        self.assertEqual(len(lines), 3)
+
+        response = self.api.post(
+            reverse('api-job-create'),
+            json.dumps({'kind': 'import_books', 'data': {'input': '/etc'}}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_failing_job_is_retried_until_its_last_attempt(self):
+        """
+        This test asserts that a job whose task raises is queued again after
+        a delay, and fails for good on its last attempt.
+        """
+        def flaky(progress):
+            raise RuntimeError('database unavailable')
+
+        with mock.patch.dict(jobs.TASKS, {'flaky': flaky}):
+            job = jobs.enqueue('flaky', max_attempts=2)
+            with mock.patch.object(jobs.logger, 'exception'):
+                self.run_jobs()
+                job.refresh_from_db()
+                self.assertEqual(job.status, 'queued')
+                self.assertGreater(job.run_after, timezone.now())
+                self.assertEqual(self.run_jobs(), 0)
+
+                models.Job.objects.update(
+                    run_after=timezone.now() - timedelta(seconds=1))
+                self.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(job.error, 'RuntimeError: database unavailable')
+
+    def test_jobs_can_be_cancelled(self):
+        """
+        This test asserts that a queued job is cancelled at once, that a
+        running job stops at its next progress report and that finished jobs
+        cannot be cancelled.
+        """
+        queued = jobs.enqueue('recount_categories')
+        cancel_url = reverse('api-job-cancel', kwargs={'job_id': queued.pk})
+        response = self.api.post(cancel_url)
+        self.assertEqual(response.json()['status'], 'cancelled')
+        self.assertEqual(self.run_jobs(), 0)
+        self.assertEqual(self.api.post(cancel_url).status_code, 409)
+
+        def long_running(progress):
+            jobs.cancel(progress.job_id)
+            progress(1, 10)
+            self.fail('the job was not stopped')
+
+        with mock.patch.dict(jobs.TASKS, {'long_running': long_running}):
+            running = jobs.enqueue('long_running')
+            self.run_jobs()
+        running.refresh_from_db()
+        self.assertEqual(running.status, 'cancelled')
+        self.assertTrue(running.cancel_requested)
+
+    def test_interrupted_import_resumes_after_its_last_committed_batch(self):
+        """
+        This test asserts that the progress of an import job commits with
+        each batch, so that a retry after a crash imports no book twice.
+        """
+        path = os.path.join(jobs.files_dir(), 'import-feed.csv')
+        with open(path, 'w') as feed:
+            feed.write('title,category\nDune,Fiction\nEmma,Classics\n'
+                       'Ulysses,Classics\n')
+        job = jobs.enqueue('import_books', {
+            'input': path, 'format': 'csv', 'batch_size': 1})
+        record = jobs.Progress.__call__
+
+        def crash_on_second_batch(progress, done, total=None):
+            record(progress, done, total)
+            if done == 2:
+                raise RuntimeError('worker killed')
+
+        with mock.patch.object(
+                jobs.Progress, '__call__', crash_on_second_batch), \
+                mock.patch.object(jobs.logger, 'exception'):
+            self.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'queued')
+        self.assertEqual(job.done, 1)
+        self.assertFalse(models.Book.objects.filter(title='Emma'))
+
+        models.Job.objects.update(
+            run_after=timezone.now() - timedelta(seconds=1))
+        self.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'succeeded')
+        self.assertEqual(job.done, 3)
+        for title in ('Dune', 'Emma', 'Ulysses'):
+            self.assertEqual(
+                models.Book.objects.filter(title=title).count(), 1)
+
+    def test_import_job_fails_at_once_on_records_of_the_wrong_type(self):
+        """
+        This test asserts that an import job fails without retries on a line
+        that is not an object, and skips rows whose values are not strings.
+        """
+        path = os.path.join(jobs.files_dir(), 'import-feed.jsonl')
+        with open(path, 'w') as feed:
+            feed.write('{"title": 12, "category": "Classics"}\n[1, 2]\n')
+        job = jobs.enqueue('import_books', {'input': path, 'format': 'jsonl'})
+        self.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 1))
+        self.assertIn('line 2: expected an object', job.error)
+
+        path = os.path.join(jobs.files_dir(), 'import-feed.jsonl')
+        with open(path, 'w') as feed:
+            feed.write('{"title": 12, "category": "Classics"}\n'
+                       '{"title": "Emma", "category": "Classics"}\n')
+        job = jobs.enqueue('import_books', {'input': path, 'format': 'jsonl'})
+        self.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'succeeded')
+        self.assertEqual(json.loads(job.result)['skipped'], 1)
+        self.assertTrue(models.Book.objects.filter(title='Emma'))
+
+    def test_category_deletion_reports_and_stops_per_batch(self):
+        """
+        This test asserts that a category deletion job reports its progress
+        after every batch and stops at the batch after its cancellation,
+        keeping the committed batches and the book counter.
+        """
+        job = jobs.enqueue('delete_category', {
+            'category_id': self.programming.pk, 'batch_size': 1})
+        reports = []
+        record = jobs.Progress.__call__
+
+        def cancel_after_first_batch(progress, done, total=None):
+            record(progress, done, total)
+            reports.append((done, total))
+            if done == 1:
+                jobs.cancel(progress.job_id)
+
+        with mock.patch.object(
+                jobs.Progress, '__call__', cancel_after_first_batch):
+            self.run_jobs()
+        self.assertEqual(reports, [(0, 2), (1, 2)])
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'cancelled')
+        self.assertEqual(job.done, 1)
+        self.programming.refresh_from_db()
+        self.assertEqual(self.programming.book_count, 1)
+        self.assertEqual(self.programming.book_set.count(), 1)
+
+    def test_writes_of_workers_refresh_the_pages_of_other_processes(self):
+        """
+        This test asserts that the catalogue writes of a job reach the cached
+        pages without the invalidation of the worker process.
+        """
+        listing = '<li>Programming (2)</li>'
+        response = self.client.get(reverse('category-create'))
+        self.assertContains(response, listing, html=True)
+
+        jobs.enqueue('delete_category', {'category_id': self.programming.pk})
+        # the worker runs in a process of its own
+        with mock.patch.object(cache, 'invalidate_catalogue'):
+            self.assertEqual(self.run_jobs(), 1)
+        response = self.client.get(reverse('category-create'))
+        self.assertNotContains(response, listing, html=True)
+
+    def test_job_endpoints_require_an_api_token(self):
+        """
+        This test asserts that clients without a valid API token cannot
+        queue or cancel jobs, and that clients with one need no CSRF token.
+        """
+        create_url = reverse('api-job-create')
+        data = json.dumps({'kind': 'recount_categories'})
+        for client in (
+                Client(enforce_csrf_checks=True),
+                Client(HTTP_AUTHORIZATION='Bearer guess')):
+            response = client.post(
+                create_url, data, content_type='application/json')
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(response['WWW-Authenticate'], 'Bearer')
+        self.assertFalse(models.Job.objects.exists())
+
+        response = self.api.post(
+            create_url, data, content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        cancel_url = reverse(
+            'api-job-cancel', kwargs={'job_id': response.json()['id']})
+        self.assertEqual(Client().post(cancel_url).status_code, 401)
+        self.assertEqual(self.api.post(cancel_url).status_code, 200)
+
+    @override_settings(BOOKSTORE_DEFERRED_DELETE_THRESHOLD=1)
+    def test_large_category_is_deleted_by_a_job(self):
+        """
+        This test asserts that the category-delete page queues the deletion
+        of a large category, which the run_workers command carries out.
+        """
+        self.client.post(reverse(
+            'category-delete', kwargs={'categ_id': self.programming.id}))
+        self.assertTrue(models.Category.objects.filter(
+            pk=self.programming.id))
+
+        out = io.StringIO()
+        with mock.patch.object(jobs, 'close_old_connections'):
+            call_command('run_workers', processes=0, burst=True, stdout=out)
+        self.assertIn('Ran 1 jobs.', out.getvalue())
+        self.assertFalse(models.Category.objects.filter(
+            pk=self.programming.id))
+        self.assertFalse(models.Book.objects.exists())
+        self.assertEqual(
+            models.Job.objects.get().result, '{"books_deleted":2}')
+
+    def test_jobs_of_exited_workers_are_queued_again(self):
+        """
+        This test asserts that the jobs left running by a worker process that
+        no longer exists are queued again.
+        """
+        job = jobs.enqueue('recount_categories')
+        models.Job.objects.update(
+            status='running', worker=jobs.worker_name(pid=2 ** 22 + 1),
+            attempts=1)
+        self.assertEqual(
+            jobs.abandoned_workers(), [jobs.worker_name(pid=2 ** 22 + 1)])
+        self.assertEqual(jobs.requeue_abandoned(jobs.abandoned_workers()), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker), ('queued', ''))
+
+
+@override_settings(
+    INSTALLED_APPS=settings_lean.INSTALLED_APPS,
+    MIDDLEWARE=settings_lean.MIDDLEWARE,
+    ROOT_URLCONF=settings_lean.ROOT_URLCONF,
+    TEMPLATES=settings_lean.TEMPLATES)
+class LeanProfileTests(TestCase):
+    """
+    This class contains tests for the lean worker profile.
+    """
+
+    def setUp(self):
+        """
+        This method runs before the execution of each test case.
+        """
+        self.client = Client(enforce_csrf_checks=True)
+        self.programming = models.Category.objects.create(name='Programming')
+
+    def test_profile_loads_only_the_bookstore(self):
+        """
+        This test asserts that the lean profile leaves out the contrib apps
+        without changing the full settings it is based on.
+        """
+        self.assertEqual(settings_lean.INSTALLED_APPS, ['bookstore'])
+        self.assertFalse([
+            name for name in settings_lean.MIDDLEWARE
+            if name.startswith('django.contrib.')])
+        from inventory import settings as full
+        self.assertIn(
+            'django.contrib.auth.context_processors.auth',
+            full.TEMPLATES[0]['OPTIONS']['context_processors'])
+
+    def test_pages_work_without_sessions_or_auth(self):
+        """
+        This test asserts that the bookstore pages render and accept forms,
+        CSRF protection included, with the lean middlewares and URLconf.
+        """
+        response = self.client.get(reverse('book-create'))
+        self.assertContains(response, 'Programming')
+        token = response.cookies['csrftoken'].value
+        response = self.client.post(
+            reverse('book-create'),
+            {'title': 'SICP', 'category': self.programming.id,
+             'csrfmiddlewaretoken': token})
+        self.assertContains(
+            response, 'SICP added to Programming category!', status_code=201)
+        response = self.client.post(
+            reverse('category-create'), {'name': 'Fiction'})
+        self.assertEqual(response.status_code, 403)
+
+    def test_prewarm_prepares_urls_templates_and_connections(self):
+        """
+        This test asserts that prewarm() builds the URL resolver, compiles
+        the templates and opens the persistent database connections.
+        """
+        with mock.patch.dict(
+                connection.settings_dict, {'CONN_MAX_AGE': 600}), \
+                mock.patch.object(connection, 'ensure_connection') as connect:
+            warmup.prewarm()
+        connect.assert_called_once_with()
+        self.assertTrue(get_resolver()._populated)
+
+    def test_prewarm_compiles_the_pages_with_the_lean_apps(self):
+        """
+        This test asserts that prewarm() compiles every page template when
+        only the bookstore app is installed, leaving out the admin templates.
+        """
+        warmup.prewarm()
+        self.assertIn('book-create.html', rendering.TEMPLATE_NAMES)
+        self.assertFalse([
+            name for name in rendering.TEMPLATE_NAMES
+            if name.startswith('admin')])
+
+    def test_lean_entry_point_loads_no_contrib_app(self):
+        """
+        This test asserts that importing inventory.wsgi_lean in a new process
+        prewarms the worker without loading any contrib app.
+        """
+        handle, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        environ = dict(os.environ, INVENTORY_DB_NAME=path)
+        environ.pop('DJANGO_SETTINGS_MODULE', None)
+        script = (
+            'import sys\n'
+            'import inventory.wsgi_lean\n'
+            'from django.core.urlresolvers import get_resolver\n'
+            'print(get_resolver()._populated)\n'
+            'print([name for name in sys.modules\n'
+            '       if name.startswith("django.contrib.")])\n')
+        output = subprocess.check_output(
+            [sys.executable, '-c', script], cwd=settings.BASE_DIR,
+            env=environ)
+        self.assertEqual(output.decode().split('\n'), ['True', '[]', ''])
+
+
+class CoalescingAdmissionTests(TestCase):
+    """
+    This class contains tests for request coalescing and admission control.
+    """
+
+    def setUp(self):
+        """
+        This method runs before the execution of each test case.
+        """
+        self.client = Client()
+        admission.coalescing_counts.reset()
+        admission.admission_counts.reset()
+        models.Category.objects.create(name='Programming')
+
+    def run_concurrently(self, func, count):
+        """
+        Calls `func` on `count` threads at once and returns their results.
+        """
+        results = [None] * count
+
+        def call(index):
+            results[index] = func()
+
+        threads = [
+            threading.Thread(target=call, args=(index,))
+            for index in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    @override_settings(BOOKSTORE_GENERATION_TTL=60)
+    def test_concurrent_misses_share_one_computation(self):
+        """
+        This test asserts that concurrent requests for the same uncached
+        fragment render it once and all get the result.
+        """
+        # the threads cannot see the data of the test transaction, so they
+        # reuse the generation read here
+        cache.invalidate_catalogue()
+        cache.catalogue_version()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def render():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return '<ul></ul>'
+
+        def request_fragment():
+            return cache.fragment('coalesced-listing', render)
+
+        leader = threading.Thread(target=request_fragment)
+        leader.start()
+        started.wait(5)
+        waiting = threading.Timer(0.1, release.set)
+        waiting.start()
+        results = self.run_concurrently(request_fragment, 3)
+        leader.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['<ul></ul>'] * 3)
+        self.assertEqual(
+            admission.coalescing_counts.get('fragment', 'computed'), 1)
+        self.assertEqual(
+            admission.coalescing_counts.get('fragment', 'joined'), 3)
+
+    def test_waiting_callers_get_the_error_of_the_computation(self):
+        """
+        This test asserts that a failed computation fails the callers that
+        waited for it, and is attempted again by the next caller.
+        """
+        flights = admission.SingleFlight()
+        started = threading.Event()
+        errors = []
+
+        def fail():
+            started.set()
+            threading.Event().wait(0.1)
+            raise ValueError('database unavailable')
+
+        def call():
+            try:
+                flights.do('listing', fail)
+            except ValueError as error:
+                errors.append(error)
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait(5)
+        self.run_concurrently(call, 2)
+        leader.join(5)
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(flights.do('listing', lambda: 'ok'), ('ok', False))
+
+    @override_settings(BOOKSTORE_ADMISSION={'book-create': {
+        'concurrency': 1, 'queue': 1, 'timeout': 0.05, 'retry_after': 2}})
+    def test_requests_over_the_limit_wait_then_are_shed(self):
+        """
+        This test asserts that a request of a saturated route waits for a
+        slot, and is answered with a 503 and Retry-After when none frees up.
+        """
+        route = admission.limiter('book-create')
+        self.assertEqual(route.acquire(), admission.Limiter.ADMITTED)
+        try:
+            response = self.client.get(reverse('book-create'))
+        finally:
+            route.release()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '2')
+
+        self.assertEqual(route.acquire(), admission.Limiter.ADMITTED)
+        threading.Timer(0.01, route.release).start()
+        response = self.client.get(reverse('book-create'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            admission.admission_counts.get('book-create', 'shed'), 1)
+        self.assertEqual(
+            admission.admission_counts.get('book-create', 'waited'), 1)
+
+        response = self.client.get(reverse('book-create'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            admission.admission_counts.get('book-create', 'admitted'), 1)
+        self.assertEqual(route.acquire(), admission.Limiter.ADMITTED)
+        route.release()
+
+    @override_settings(BOOKSTORE_ADMISSION={'book-create': {
+        'concurrency': 1, 'queue': 0}})
+    def test_full_queue_sheds_at_once_and_counters_are_exported(self):
+        """
+        This test asserts that a request finding the queue full is shed
+        without waiting, and that the counters appear in /metrics.
+        """
+        route = admission.limiter('book-create')
+        route.acquire()
+        try:
+            response = self.client.get(reverse('book-create'))
+        finally:
+            route.release()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+        self.client.get(reverse('category-create'))
+        metrics = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn(
+            'bookstore_admission_total{url_name="book-create",'
+            'outcome="shed"} 1', metrics)
+        self.assertIn(
+            'bookstore_coalesced_total{cache="fragment",outcome="computed"}',
+            metrics)
+
+
+class ScalableAdminTests(TestCase):
+    """
+    This class contains tests for the admin of books and categories.
+    """
+
+    def setUp(self):
+        """
+        This method runs before the execution of each test case.
+        """
+        self.client = Client()
+        User.objects.create_superuser('staff', 'staff@example.com', 'secret')
+        self.client.login(username='staff', password='secret')
+        self.fiction = models.Category.objects.create(name='Fiction')
+        self.poetry = models.Category.objects.create(name='Poetry')
+        self.books = [
+            models.Book.objects.create(title=title, category=self.fiction)
+            for title in ('Dune', 'Emma', 'Ulysses')]
+        counters.recount()
+
+    def book_counts(self):
+        """
+        Returns the book counts of Fiction and Poetry.
+        """
+        counts = dict(models.Category.objects.values_list('id', 'book_count'))
+        return counts[self.fiction.pk], counts[self.poetry.pk]
+
+    def run_action(self, model, action, ids, **data):
+        """
+        Posts the changelist action `action` for the objects `ids` of
+        `model`.
+        """
+        data.update({
+            'action': action, 'index': 0, ACTION_CHECKBOX_NAME: ids})
+        return self.client.post(
+            reverse('admin:bookstore_{0}_changelist'.format(model)), data)
+
+    def test_book_changelist_runs_no_count_or_query_per_row(self):
+        """
+        This test asserts that the book changelist counts the books from the
+        category counters and joins their categories in the listing query.
+        """
+        url = reverse('admin:bookstore_book_changelist')
+        with CaptureQueriesContext(connection) as queries_run:
+            response = self.client.get(url)
+        self.assertContains(response, 'Ulysses')
+        self.assertContains(response, '3 books')
+        book_queries = [
+            query['sql'] for query in queries_run
+            if 'FROM "bookstore_book"' in query['sql']]
+        self.assertEqual(len(book_queries), 1)
+        self.assertNotIn('COUNT(', book_queries[0])
+        self.assertIn('INNER JOIN "bookstore_category"', book_queries[0])
+
+    def test_filtered_counts_are_bounded(self):
+        """
+        This test asserts that filtered changelists count at most
+        MAX_EXACT_COUNT rows.
+        """
+        books = models.Book.objects.filter(category=self.fiction)
+        self.assertEqual(admin.estimated_count(books), 3)
+        with mock.patch.object(admin, 'MAX_EXACT_COUNT', 2):
+            self.assertEqual(admin.estimated_count(books), 2)
+            paginator = admin.EstimatedCountPaginator(books, 1)
+            self.assertEqual(paginator.num_pages, 2)
+
+    def test_searches_use_indexed_lookups(self):
+        """
+        This test asserts that admin searches match ids exactly and names by
+        prefix.
+        """
+        url = reverse('admin:bookstore_book_changelist')
+        response = self.client.get(url, {'q': str(self.books[1].pk)})
+        self.assertContains(response, 'Emma')
+        self.assertNotContains(response, 'Dune')
+
+        response = self.client.get(
+            reverse('admin:bookstore_category_changelist'), {'q': 'Poe'})
+        self.assertContains(response, 'Poetry')
+        self.assertNotContains(response, 'Fiction')
+
+    def test_moving_books_keeps_counters_cache_and_feed_consistent(self):
+        """
+        This test asserts that the move action updates the books, their
+        category counters, the catalogue version and the change feed.
+        """
+        version = cache.catalogue_version()
+        head = changes.head()
+        ids = [self.books[0].pk, self.books[2].pk]
+        response = self.run_action(
+            'book', 'move_to_category', ids, category=self.poetry.pk)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.book_counts(), (1, 2))
+        self.assertEqual(models.Book.objects.filter(
+            category=self.poetry).count(), 2)
+        self.assertNotEqual(cache.catalogue_version(), version)
+        self.assertEqual(
+            [(change['id'], change['action'], change['data']['category_id'])
+             for change in changes.since(head)],
+            [(pk, 'update', self.poetry.pk) for pk in ids])
+
+        self.run_action('book', 'move_to_category', ids, category=999)
+        self.assertEqual(self.book_counts(), (1, 2))
+
+    def test_deleting_books_asks_for_confirmation(self):
+        """
+        This test asserts that the delete action of the books lists no books
+        before it is confirmed, and then deletes them with their counters.
+        """
+        ids = [self.books[0].pk, self.books[1].pk]
+        response = self.run_action('book', 'delete_selected', ids)
+        self.assertContains(response, 'delete the 2 selected books')
+        self.assertNotContains(response, 'Dune')
+        self.assertEqual(models.Book.objects.count(), 3)
+
+        head = changes.head()
+        response = self.run_action(
+            'book', 'delete_selected', ids, post='yes')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            list(models.Book.objects.values_list('title', flat=True)),
+            ['Ulysses'])
+        self.assertEqual(self.book_counts(), (1, 0))
+        self.assertEqual(
+            [change['action'] for change in changes.since(head)],
+            ['delete', 'delete'])
+
+    @override_settings(BOOKSTORE_DEFERRED_DELETE_THRESHOLD=2)
+    def test_deleting_categories_defers_large_ones(self):
+        """
+        This test asserts that the delete action of the categories deletes
+        small categories with their books and queues the large ones, and
+        that their delete view is disabled.
+        """
+        response = self.client.get(reverse(
+            'admin:bookstore_category_delete', args=[self.poetry.pk]))
+        self.assertEqual(response.status_code, 403)
+
+        self.run_action(
+            'category', 'delete_selected',
+            [self.fiction.pk, self.poetry.pk], post='yes')
+        self.assertFalse(
+            models.Category.objects.filter(pk=self.poetry.pk).exists())
+        self.assertEqual(models.Book.objects.count(), 3)
+        job = models.Job.objects.get()
+        self.assertEqual(job.kind, 'delete_category')
+        self.assertEqual(
+            json.loads(job.payload)['category_id'], self.fiction.pk)
+
+    def test_book_form_updates_counters(self):
+        """
+        This test asserts that adding and editing books through the admin
+        forms keeps the category counters up to date.
+        """
+        self.client.post(reverse('admin:bookstore_book_add'), {
+            'title': 'Odes', 'category': self.poetry.pk})
+        self.assertEqual(self.book_counts(), (3, 1))
+        self.client.post(
+            reverse('admin:bookstore_book_change', args=[self.books[0].pk]),
+            {'title': 'Dune', 'category': self.poetry.pk})
+        self.assertEqual(self.book_counts(), (2, 2))
+        self.client.post(
+            reverse('admin:bookstore_book_delete', args=[self.books[0].pk]),
+            {'post': 'yes'})
+        self.assertEqual(self.book_counts(), (2, 1))
+
+        models.Category.objects.filter(pk=self.fiction.pk).update(
+            book_count=0)
+        self.run_action('category', 'recount_books', [self.fiction.pk])
+        self.assertEqual(self.book_counts(), (2, 1))
+
+    def test_deleting_a_deleted_book_keeps_counters(self):
+        """
+        This test asserts that deleting a book a concurrent request already
+        deleted does not decrement its category counter again.
+        """
+        book_admin = admin.BookAdmin(models.Book, admin_site)
+        stale = models.Book.objects.get(pk=self.books[0].pk)
+        book_admin.delete_model(None, self.books[0])
+        book_admin.delete_model(None, stale)
+        self.assertEqual(self.book_counts(), (2, 0))
@@ -1,16 +1,35 @@
 from django.conf.urls import url
 
-from bookstore import views
+from bookstore import api, views
 
 urlpatterns = [
-    url(r'^category/create', views.category_create, name='category-create'),
+    url(r'^category/create$', views.category_create, name='category-create'),
     url(r'^category/edit/(?P<categ_id>[0-9]+)$',
         views.category_edit, name='category-edit'),
     url(r'^category/delete/(?P<categ_id>[0-9]+)$',
         views.category_delete, name='category-delete'),
-    url(r'^book/create', views.book_create, name='book-create'),
+    url(r'^book/create$', views.book_create, name='book-create'),
     url(r'^book/edit/(?P<book_id>[0-9]+)$',
         views.book_edit, name='book-edit'),
     url(r'^book/delete/(?P<book_id>[0-9]+)$',
         views.book_delete, name='book-delete'),
+    url(r'^book/import$', views.book_import, name='book-import'),
+    url(r'^book/export$', views.book_export, name='book-export'),
+    url(r'^book/search$', views.book_search, name='book-search'),
+    url(r'^metrics$', views.metrics, name='metrics'),
+    url(r'^api/categories$', api.category_list, name='api-category-list'),
+    url(r'^api/categories/(?P<categ_id>[0-9]+)$',
+        api.category_detail, name='api-category-detail'),
+    url(r'^api/books$', api.book_list, name='api-book-list'),
+    url(r'^api/books/(?P<book_id>[0-9]+)$',
+        api.book_detail, name='api-book-detail'),
+    url(r'^api/batch$', api.batch_write, name='api-batch'),
+    url(r'^api/changes$', api.change_feed, name='api-changes'),
+    url(r'^api/jobs$', api.job_create, name='api-job-create'),
+    url(r'^api/jobs/(?P<job_id>[0-9]+)$',
+        api.job_detail, name='api-job-detail'),
+    url(r'^api/jobs/(?P<job_id>[0-9]+)/cancel$',
+        api.job_cancel, name='api-job-cancel'),
+    url(r'^api/jobs/(?P<job_id>[0-9]+)/output$',
+        api.job_output, name='api-job-output'),
 ]
\ No newline at end of file
@@ -1,24 +1,126 @@
+import codecs
+import csv
+
+from django.db import transaction
+from django.core.urlresolvers import reverse
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.http import (
+    HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse)
 
-from bookstore import forms, models
+from bookstore import (
+    admission, cache, counters, deletion, exporter, forms, importer,
+    instrumentation, models, queries, search)
 
 # Create your views here.
 
+# the lightweight responses to a successful create that a client can ask for
+# with the `response` query parameter; `Accept: application/json` selects json
+RESPONSE_MODES = ('json', 'redirect')
+
+
+def _listing_page(request, queryset, context, key):
+    """
+    Adds the requested page of `queryset` to `context` under `key`, together
+    with the cursor and limit needed to link to the next page.
+    """
+    after, limit = queries.page_params(request.GET)
+    context[key], context['next_after'] = queries.listing_page(
+        queryset, after, limit)
+    context['limit'] = limit
+
+
+def _cached_listing(request, template, queryset, key):
+    """
+    Returns the requested page of `queryset` rendered with the `template`
+    fragment, from the fragment cache unless the catalogue changed since the
+    page was last rendered. `queryset` is only evaluated on a cache miss,
+    from a read replica when cache.replica_reads() allows it.
+    """
+    after, limit = queries.page_params(request.GET)
+
+    def render_listing():
+        context = {'limit': limit}
+        with cache.replica_reads():
+            context[key], context['next_after'] = queries.listing_page(
+                queryset, after, limit)
+        return render_to_string(template, context)
+
+    return cache.fragment(
+        '{0}:{1}:{2}'.format(template, after, limit), render_listing)
+
+
+def _response_mode(request):
+    """
+    Returns the lightweight response mode requested for a create, or None for
+    the default HTML page with the whole listing.
+    """
+    mode = request.GET.get('response')
+    if mode in RESPONSE_MODES:
+        return mode
+    accept = request.META.get('HTTP_ACCEPT', '')
+    if accept.split(',')[0].split(';')[0].strip() == 'application/json':
+        return 'json'
+    return None
+
+
+def _created(request, mode, data, feedback):
+    """
+    Returns the lightweight response to a create: the created object and the
+    feedback as JSON, or a redirect to the (cached) listing page.
+    """
+    if mode == 'redirect':
+        response = HttpResponseRedirect(request.path)
+        # See Other: the listing is fetched with a GET
+        response.status_code = 303
+        return response
+    data['feedback'] = feedback
+    return JsonResponse(
+        data, status=201, json_dumps_params={'separators': (',', ':')})
+
+
+def _invalid(form):
+    """
+    Returns the field errors of an invalid create form as JSON.
+    """
+    return JsonResponse(
+        {'errors': form.errors}, status=400,
+        json_dumps_params={'separators': (',', ':')})
+
 
 def category_create(request):
+    mode = _response_mode(request)
     context = {
-        'category_form': forms.CategoryForm(),
-        'categories': models.Category.objects.all()
+        'category_form': forms.CategoryForm()
     }
 
     if 'name' in request.POST:
-        forms.CategoryForm(request.POST).save()
+        category_form = forms.CategoryForm(request.POST)
+        if not category_form.is_valid():
+            if mode == 'json':
+                return _invalid(category_form)
+            context['category_form'] = category_form
+            context['category_listing'] = _cached_listing(
+                request, 'category-listing.html', queries.category_listing(),
+                'categories')
+            return render(request, 'category-create.html', context, status=400)
+        category = category_form.save()
+        if mode:
+            return _created(request, mode, {
+                'id': category.id,
+                'name': category.name,
+                'book_count': category.book_count
+            }, 'Category: {0} created!'.format(category.name))
 
-        context['categories'] = models.Category.objects.all()
+        context['category_listing'] = _cached_listing(
+            request, 'category-listing.html', queries.category_listing(),
+            'categories')
         context['feedback'] = 'Category: {0} created!'.format(request.POST['name'])
 
         return render(request, 'category-create.html', context, status=201)
+    context['category_listing'] = _cached_listing(
+        request, 'category-listing.html', queries.category_listing(),
+        'categories')
     return render(request, 'category-create.html', context)
 
 
@@ -46,7 +148,10 @@ def category_delete(request, categ_id):
     try:
         context['category'] = models.Category.objects.get(pk=categ_id)
         if request.method == 'POST':
-            context['category'].delete()
+            if deletion.should_defer(context['category']):
+                deletion.delete_category_deferred(context['category'])
+            else:
+                deletion.delete_category(context['category'])
             context['category'] = None
             return render(request, 'category-delete.html', context)
     except models.Category.DoesNotExist:
@@ -56,40 +161,95 @@ def category_delete(request, categ_id):
 
 def book_create(request):
     context = {
-        'books': models.Book.objects.all(),
         'book_form': forms.BookForm()
     }
     if request.POST:
-        new_book = forms.BookForm(request.POST).save()
+        mode = _response_mode(request)
+        book_form = forms.BookForm(request.POST)
+        if not book_form.is_valid():
+            if mode == 'json':
+                return _invalid(book_form)
+            context['book_form'] = book_form
+            context['book_listing'] = _cached_listing(
+                request, 'book-listing.html', queries.book_listing(), 'books')
+            return render(request, 'book-create.html', context, status=400)
+        with transaction.atomic():
+            new_book = book_form.save()
+            counters.adjust(new_book.category_id, 1)
+
+        feedback = '{0} added to {1} category!'.format(
+            new_book.title, new_book.category.name)
+        if mode:
+            return _created(request, mode, {
+                'id': new_book.id,
+                'title': new_book.title,
+                'category_id': new_book.category_id,
+                'category': new_book.category.name
+            }, feedback)
 
-        context['books'] = models.Book.objects.all()
+        context['book_listing'] = _cached_listing(
+            request, 'book-listing.html', queries.book_listing(), 'books')
 
-        context['feedback'] = '{0} added to {1} category!'.format(
-                new_book.title, new_book.category.name)
+        context['feedback'] = feedback
         return render(request, 'book-create.html', context, status=201)
 
+    context['book_listing'] = _cached_listing(
+        request, 'book-listing.html', queries.book_listing(), 'books')
     return render(request, 'book-create.html', context)
 
 
+def _book_changes(book, data):
+    """
+    Compares the title and category submitted in `data` with `book` and
+    returns a dict of the fields that differ, mapped to their new values.
+
+    The category is compared by id, so the current Category of the book is
+    never fetched. Raises Category.DoesNotExist for an unknown category.
+    """
+    changes = {}
+    title = data.get('title')
+    if title and title != book.title:
+        changes['title'] = title
+
+    try:
+        category_id = queries.parse_id(
+            data.get('category') or book.category_id)
+    except ValueError:
+        raise models.Category.DoesNotExist
+    if category_id != book.category_id:
+        if not models.Category.objects.filter(pk=category_id).exists():
+            raise models.Category.DoesNotExist
+        changes['category_id'] = category_id
+    return changes
+
+
 def book_edit(request, book_id):
-    book = models.Book.objects.get(pk=book_id)
+    book = models.Book.objects.only('title', 'category').get(pk=book_id)
     context = {
         'book_id': book_id,
         'book_form': forms.BookForm(initial={
-            'category': book.category,
+            'category': book.category_id,
             'title': book.title
             })
     }
     if 'title' in request.POST or 'category' in request.POST:
-        if request.POST.get('title') and book.title != request.POST['title']:
-            book.title = request.POST['title']
-
-        new_category = request.POST.get('category')
-        if new_category and book.category != new_category:
-            category = models.Category.objects.get(pk=new_category)
-            book.category = category
+        try:
+            changes = _book_changes(book, request.POST)
+        except models.Category.DoesNotExist:
+            context['feedback'] = 'Category of id {0} does not exist!'.format(
+                request.POST['category'])
+            return render(request, 'book-edit.html', context, status=400)
 
-        book.save()
+        old_category_id = book.category_id
+        for field, value in changes.items():
+            setattr(book, field, value)
+        if 'category_id' in changes:
+            with transaction.atomic():
+                book.save(update_fields=changes.keys())
+                counters.adjust(old_category_id, -1)
+                counters.adjust(book.category_id, 1)
+        elif changes:
+            book.save(update_fields=changes.keys())
         context['feedback'] = 'Edit successful!'
 
         return render(request, 'book-edit.html', context)
@@ -103,7 +263,11 @@ def book_delete(request, book_id):
         }
         if request.method == 'POST':
             title = context['book'].title
-            context['book'].delete()
+            with transaction.atomic():
+                deleted, _ = context['book'].delete()
+                # a concurrent delete already took the book off the counter
+                if deleted:
+                    counters.adjust(context['book'].category_id, -1)
             context['book'] = None
             context['feedback'] = 'Book: {0} deleted!'.format(title)
             return render(request, 'book-delete.html', context)
@@ -112,4 +276,76 @@ def book_delete(request, book_id):
         context = {
             'feedback': 'Book of id {0} does not exist!'.format(book_id)
         }
-        return render(request, 'book-delete.html', context)
\ No newline at end of file
+        return render(request, 'book-delete.html', context)
+
+
+def book_import(request):
+    context = {
+        'import_form': forms.ImportForm()
+    }
+    if request.method == 'POST':
+        import_form = forms.ImportForm(request.POST, request.FILES)
+        if not import_form.is_valid():
+            context['import_form'] = import_form
+            return render(request, 'book-import.html', context, status=400)
+
+        upload = import_form.cleaned_data['file']
+        fmt = import_form.cleaned_data['format'] or importer.guess_format(
+            upload.name)
+        if importer.should_defer(upload):
+            job = importer.import_books_deferred(upload, fmt)
+            context['feedback'] = 'Import queued as job {0}.'.format(job.pk)
+            context['job_url'] = reverse(
+                'api-job-detail', kwargs={'job_id': job.pk})
+            return render(request, 'book-import.html', context, status=202)
+        rows = importer.read_rows(codecs.iterdecode(upload, 'utf-8'), fmt)
+        try:
+            result = importer.import_books(rows)
+        except (ValueError, csv.Error) as error:
+            context['feedback'] = 'Import failed: {0}'.format(error)
+            return render(request, 'book-import.html', context, status=400)
+
+        context['feedback'] = str(result)
+        return render(request, 'book-import.html', context, status=201)
+    return render(request, 'book-import.html', context)
+
+
+def book_export(request):
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in exporter.FORMATS:
+        return HttpResponse(
+            'Unknown export format: {0}'.format(fmt), status=400)
+    response = StreamingHttpResponse(
+        exporter.export_lines(fmt), content_type=exporter.CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = (
+        'attachment; filename="books.{0}"'.format(fmt))
+    return response
+
+
+@cache.cached_get
+def book_search(request):
+    term = request.GET.get('q', '').strip()
+    mode = request.GET.get('mode', 'contains')
+    if mode not in search.MODES:
+        mode = 'contains'
+    try:
+        category_id = int(request.GET['category'])
+    except (KeyError, ValueError):
+        category_id = None
+
+    context = {
+        'q': term,
+        'mode': mode,
+        'category_id': category_id,
+        'categories': cache.category_choices()
+    }
+    _listing_page(
+        request, search.search_books(term, mode, category_id), context,
+        'books')
+    return render(request, 'book-search.html', context)
+
+
+def metrics(request):
+    return HttpResponse(
+        instrumentation.registry.render() + admission.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8')
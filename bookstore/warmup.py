@@ -0,0 +1,54 @@
+"""
+Preparation of a worker process before it accepts traffic.
+
+Django builds the URL resolver, compiles the templates and the SQL of the
+listings and opens database connections on the requests that first need
+them, so the first requests a new process serves pay for all of it.
+prewarm() does that work at startup instead.
+
+Connections opened at startup belong to the thread and the process that
+opened them: prewarm() suits servers that load the application in each
+worker process, as gunicorn and uWSGI do by default, rather than in a master
+process that forks the workers afterwards.
+"""
+from django.core.urlresolvers import get_resolver
+from django.db import connections
+
+from bookstore import queries, rendering
+
+
+def prewarm_urls():
+    """
+    Builds the URL resolver, compiling every URL pattern.
+    """
+    get_resolver().reverse_dict
+
+
+def prewarm_queries():
+    """
+    Compiles the SQL of the listing queries without running them, filling
+    the caches of the model metadata on the way.
+    """
+    for queryset in (queries.book_listing(), queries.category_listing()):
+        str(queryset.query)
+
+
+def prewarm_databases():
+    """
+    Opens the connection to every database whose connections persist between
+    requests.
+    """
+    for alias in connections:
+        if connections[alias].settings_dict['CONN_MAX_AGE'] != 0:
+            connections[alias].ensure_connection()
+
+
+def prewarm():
+    """
+    Prepares the URLs, templates, queries and database connections of the
+    bookstore.
+    """
+    prewarm_urls()
+    rendering.prewarm()
+    prewarm_queries()
+    prewarm_databases()
@@ -0,0 +1,27 @@
+"""
+ASGI config for inventory project.
+
+It exposes the ASGI callable as a module-level variable named ``application``
+for an ASGI server such as uvicorn or daphne:
+
+    uvicorn inventory.asgi:application
+
+Django 1.10 has no ASGI support of its own; see bookstore.asgi.
+"""
+
+import os
+
+import django
+from django.conf import settings
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "inventory.settings")
+
+django.setup(set_prefix=False)
+
+from bookstore import rendering  # noqa: E402
+from bookstore.asgi import ASGIHandler  # noqa: E402
+
+application = ASGIHandler()
+
+if settings.BOOKSTORE_PREWARM_TEMPLATES:
+    rendering.prewarm()
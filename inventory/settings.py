@@ -22,10 +22,16 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = '!!*m&njwsnf^7keg09om*uw0kk4(kh^!c_e5*558$*+fj*6rel'
 
+# INVENTORY_PRODUCTION=1 selects the production configuration: debug mode
+# off, compiled templates kept in memory and the production database mode.
+PRODUCTION = os.environ.get('INVENTORY_PRODUCTION') == '1'
+
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = not PRODUCTION
 
-ALLOWED_HOSTS = []
+# INVENTORY_ALLOWED_HOSTS lists the served host names, separated by commas
+ALLOWED_HOSTS = list(filter(
+    None, os.environ.get('INVENTORY_ALLOWED_HOSTS', '').split(',')))
 
 
 # Application definition
@@ -41,6 +47,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'bookstore.middleware.InstrumentationMiddleware',
+    'bookstore.middleware.AdmissionControlMiddleware',
+    'bookstore.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,7 +63,8 @@ ROOT_URLCONF = 'inventory.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # the Django backend, with render times recorded for Server-Timing
+        'BACKEND': 'bookstore.instrumentation.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -68,19 +78,68 @@ TEMPLATES = [
     },
 ]
 
+if PRODUCTION:
+    # keep every compiled template in memory instead of finding and parsing
+    # it again on each render; the WSGI and ASGI entry points compile the
+    # bookstore templates at startup (see bookstore.rendering)
+    TEMPLATES[0]['APP_DIRS'] = False
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
+
 WSGI_APPLICATION = 'inventory.wsgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/1.10/ref/settings/#databases
+#
+# In the production database mode connections persist between requests and
+# SQLite databases run in WAL mode with tuned pragmas and busy timeouts (see
+# inventory.backends.sqlite3). The INVENTORY_DB_* environment variables point
+# at another database server.
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'ENGINE': os.environ.get(
+            'INVENTORY_DB_ENGINE', 'django.db.backends.sqlite3'),
+        'NAME': os.environ.get(
+            'INVENTORY_DB_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+        'USER': os.environ.get('INVENTORY_DB_USER', ''),
+        'PASSWORD': os.environ.get('INVENTORY_DB_PASSWORD', ''),
+        'HOST': os.environ.get('INVENTORY_DB_HOST', ''),
+        'PORT': os.environ.get('INVENTORY_DB_PORT', ''),
+        # seconds a connection is reused for; 0 opens one per request
+        'CONN_MAX_AGE': int(os.environ.get(
+            'INVENTORY_DB_CONN_MAX_AGE', 600 if PRODUCTION else 0)),
     }
 }
 
+if PRODUCTION and (
+        DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3'):
+    DATABASES['default']['ENGINE'] = 'inventory.backends.sqlite3'
+    DATABASES['default']['OPTIONS'] = {
+        # seconds sqlite3.connect() waits for a lock
+        'timeout': 20,
+    }
+
+# INVENTORY_DB_REPLICAS lists the names of read replicas of the default
+# database, separated by commas. The listings and category choices that GET
+# requests compute go to a replica once it has caught up with the catalogue
+# (see bookstore.routers); locally a copy of the SQLite file of the default
+# database stands in for a replica.
+BOOKSTORE_REPLICAS = []
+for index, name in enumerate(
+        filter(None, os.environ.get('INVENTORY_DB_REPLICAS', '').split(','))):
+    alias = 'replica{0}'.format(index)
+    DATABASES[alias] = dict(
+        DATABASES['default'], NAME=name.strip(), TEST={'MIRROR': 'default'})
+    BOOKSTORE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['bookstore.routers.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators
@@ -119,3 +178,56 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/1.10/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Bookstore
+
+# The alias of the CACHES backend that the bookstore caches share between
+# processes. When None, each process keeps its own cache.
+BOOKSTORE_CACHE_ALIAS = 'default'
+
+# The seconds a process may reuse the catalogue generation it read from the
+# database, serving pages that much out of date after the writes of other
+# processes. 0 reads the generation for every cached read.
+BOOKSTORE_GENERATION_TTL = 0
+
+# The bounds of the cache each process keeps in front of the shared one.
+BOOKSTORE_LOCAL_CACHE_ENTRIES = 1000
+BOOKSTORE_LOCAL_CACHE_BYTES = 32 * 1024 * 1024
+
+# Categories with more books than this are deleted by a background job rather
+# than within the request. None always deletes within the request.
+BOOKSTORE_DEFERRED_DELETE_THRESHOLD = 10000
+
+# Uploads larger than this many bytes are imported by a background job rather
+# than within the request. None always imports within the request.
+BOOKSTORE_DEFERRED_IMPORT_SIZE = 1024 * 1024
+
+# The number of worker processes started by `manage.py run_workers`, and the
+# directory holding the uploads and exports of background jobs.
+BOOKSTORE_JOB_WORKERS = os.cpu_count() or 1
+BOOKSTORE_JOB_FILES = os.path.join(BASE_DIR, 'job-files')
+
+# The bearer tokens accepted by the API endpoints that write (see
+# bookstore.api), from INVENTORY_API_TOKENS, separated by commas.
+BOOKSTORE_API_TOKENS = list(filter(
+    None, os.environ.get('INVENTORY_API_TOKENS', '').split(',')))
+
+# The number of threads that run the database and template work of the async
+# views served by inventory.asgi.
+BOOKSTORE_ASYNC_THREADS = 32
+
+# Whether the WSGI and ASGI entry points compile the bookstore templates
+# before serving the first request.
+BOOKSTORE_PREWARM_TEMPLATES = PRODUCTION
+
+# The concurrency limits of the hot pages, per process and URL name: at most
+# `concurrency` requests run at once, up to `queue` more wait at most
+# `timeout` seconds for a slot, and the others are answered with a 503 and a
+# Retry-After of `retry_after` seconds (see bookstore.admission).
+BOOKSTORE_ADMISSION = {
+    'book-create': {
+        'concurrency': 16, 'queue': 64, 'timeout': 5.0, 'retry_after': 1},
+    'category-create': {
+        'concurrency': 16, 'queue': 64, 'timeout': 5.0, 'retry_after': 1},
+}
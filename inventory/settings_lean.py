@@ -0,0 +1,46 @@
+"""
+Lean Django settings for the bookstore workers.
+
+The bookstore views have no logins, messages or session state, and its pages
+need no static files, so this profile loads the bookstore app alone: no
+admin, auth, contenttypes, sessions, messages or staticfiles, five
+middlewares instead of ten, no translation machinery and the bookstore
+URLconf as the root. Everything else, including the production
+configuration selected by INVENTORY_PRODUCTION, comes from
+inventory.settings.
+
+Serve it with inventory.wsgi_lean, which prepares the worker before it
+accepts traffic (see bookstore.warmup). The admin and the management
+commands of the contrib apps need the full settings.
+"""
+
+import copy
+
+from inventory.settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [
+    'bookstore',
+]
+
+MIDDLEWARE = [
+    'bookstore.middleware.InstrumentationMiddleware',
+    'bookstore.middleware.AdmissionControlMiddleware',
+    'bookstore.middleware.ReplicaRoutingMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+
+ROOT_URLCONF = 'bookstore.urls'
+
+# a copy, leaving the settings of inventory.settings untouched
+TEMPLATES = copy.deepcopy(TEMPLATES)  # noqa: F405
+TEMPLATES[0]['OPTIONS']['context_processors'] = [
+    'django.template.context_processors.request',
+]
+
+WSGI_APPLICATION = 'inventory.wsgi_lean.application'
+
+AUTH_PASSWORD_VALIDATORS = []
+
+# The bookstore has no translations.
+USE_I18N = False
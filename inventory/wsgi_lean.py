@@ -0,0 +1,21 @@
+"""
+WSGI config for the lean bookstore worker profile.
+
+It exposes the WSGI callable of inventory.settings_lean as a module-level
+variable named ``application``, once the URLs, templates, queries and
+database connections of the bookstore are ready (see bookstore.warmup):
+
+    gunicorn inventory.wsgi_lean:application
+"""
+
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "inventory.settings_lean")
+
+application = get_wsgi_application()
+
+from bookstore import warmup  # noqa: E402
+
+warmup.prewarm()